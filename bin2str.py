@@ -23,29 +23,22 @@ import argparse
 
 
 _BIN2CHAR = "()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\]^_`abcdefg"
-_BIN2HEX = "0123456789ABCDEF"
 
 
 def to3cp2b(bin_data):
-    result = ""
+    result = []
     for i in range(len(bin_data) // 2):
         b1 = bin_data[2 * i]
         b2 = bin_data[2 * i + 1]
         c1 = _BIN2CHAR[b1 >> 2]
         c2 = _BIN2CHAR[((b1 & 3) << 3) | (b2 >> 5)]
         c3 = _BIN2CHAR[(b2 & 31)]
-        result += c1 + c2 + c3
-    return result
+        result.append(c1 + c2 + c3)
+    return "".join(result)
 
 
 def tohex(bin_data):
-    result = ""
-    for i in range(len(bin_data)):
-        b = bin_data[i]
-        c1 = _BIN2HEX[b >> 4]
-        c2 = _BIN2HEX[b & 15]
-        result += c1 + c2
-    return result
+    return bin_data.hex().upper()
 
 
 def convert(bin_data, use_hex):
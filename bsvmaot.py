@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; -*-
+# -------------------------------------------------------------------------------------------------
+# Copyright (c) 2020 Marcus Geelnard
+#
+# This software is provided 'as-is', without any express or implied warranty. In no event will the
+# authors be held liable for any damages arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose, including commercial
+# applications, and to alter it and redistribute it freely, subject to the following restrictions:
+#
+#  1. The origin of this software must not be misrepresented; you must not claim that you wrote
+#     the original software. If you use this software in a product, an acknowledgment in the
+#     product documentation would be appreciated but is not required.
+#
+#  2. Altered source versions must be plainly marked as such, and must not be misrepresented as
+#     being the original software.
+#
+#  3. This notice may not be removed or altered from any source distribution.
+# -------------------------------------------------------------------------------------------------
+
+# Ahead-of-time translation of BSVM programs into the language of a VM implementation.
+#
+# The program is split into basic blocks by following all statically known control flow from
+# the entry point. Code that can not be reached that way (e.g. the targets of computed jumps) is
+# left to the interpreter of the VM.
+
+import ast
+import re
+import bsvmasm
+
+# Control flow instructions.
+#
+#  * _BRANCHES    - Conditional branches.
+#  * _JUMPS       - Jumps to the final operand (if it is an immediate or PC-relative value).
+#  * _FALLTHROUGH - May continue with the next instruction (or return to it, as for JSR).
+#  * _BLOCK_ENDS  - Ends a basic block.
+_BRANCHES = ["BEQ", "BNE", "BLT", "BLE", "BGT", "BGE"]
+_BRANCHES += ["CBEQ", "CBNE", "CBLT", "CBLE", "CBGT", "CBGE", "DBNZ"]
+_JUMPS = ["JMP", "JSR", "TSPAWN"] + _BRANCHES
+_FALLTHROUGH = ["JSR", "TSPAWN"] + _BRANCHES
+_BLOCK_ENDS = _JUMPS + ["RTS", "EXIT"]
+
+
+def _ops(mnemonics):
+    return {bsvmasm._OPCODES[x]["descrs"][0][0] & 63 for x in mnemonics}
+
+
+def mnemonic(op):
+    for name, op_descr in bsvmasm._OPCODES.items():
+        if op_descr["descrs"][0][0] & 63 == op:
+            return name
+    return "?"
+
+
+def read_table(lines, name):
+    # Extract a table, given as a Python list literal (that may span several lines), from the
+    # source code of a VM template.
+    for k, line in enumerate(lines):
+        if line.startswith(f"{name}=["):
+            text = ""
+            for line in lines[k:]:
+                text += line + "\n"
+                try:
+                    return ast.literal_eval(text[len(name) + 1 :])
+                except SyntaxError:
+                    pass
+    raise ValueError(f"No table named {name}")
+
+
+def decode(code, addr, nout, ninr, ninx):
+    # Decode the instruction at address addr (the code is loaded at address 1). Returns the tuple
+    # (op0, a, b, x, next_addr), where a and b are the leading register numbers and x is the final
+    # operand (a register number for arg type 0), or None if there is no valid instruction.
+    k = addr - 1
+    if k < 0 or k >= len(code):
+        return None
+    op0 = code[k]
+    op = op0 & 63
+    at = op0 >> 6
+    if op == 0 or op >= len(nout):
+        return None
+    k += 1
+    o = [0, 0, 0]
+    for i in range(nout[op] + ninr[op]):
+        o[i] = code[k] if k < len(code) else 0
+        k += 1
+    if ninx[op]:
+        if at == 3:
+            o[2] = int.from_bytes(code[k : k + 4], "little", signed=True)
+            k += 4
+        else:
+            v = code[k] if k < len(code) else 0
+            k += 1
+            if at != 0:
+                if v > 127:
+                    v -= 256
+                if at == 2:
+                    v += addr
+            o[2] = v
+    if k > len(code):
+        return None
+    return (op0, o[0], o[1], o[2], k + 1)
+
+
+def find_blocks(code, nout, ninr, ninx):
+    # Find all basic blocks that are reachable from the entry point (address 1). Returns a dict
+    # that maps the start address of each block to its list of (address, instruction) tuples.
+    jumps = _ops(_JUMPS)
+    fallthrough = _ops(_FALLTHROUGH)
+    block_ends = _ops(_BLOCK_ENDS)
+
+    blocks = {}
+    todo = [1]
+    while todo:
+        start = todo.pop()
+        if start in blocks:
+            continue
+        instrs = []
+        addr = start
+        while True:
+            instr = decode(code, addr, nout, ninr, ninx)
+            if instr is None:
+                break
+            instrs.append((addr, instr))
+            op0 = instr[0]
+            op = op0 & 63
+            addr = instr[4]
+            if op in block_ends:
+                if op in jumps and op0 >= 64:
+                    todo.append(instr[3])
+                if op in fallthrough:
+                    todo.append(addr)
+                break
+        if instrs:
+            blocks[start] = instrs
+    return blocks
+
+
+def gen_python(code, template_lines, counters=False):
+    # Translate the program to Python functions (one per basic block), using the instruction
+    # semantics of the Python VM template. If counters is True, the functions count the executed
+    # instructions (see PERF). Returns the source lines that define the functions and the "aot"
+    # table that the VM uses for looking up the blocks.
+    sem = read_table(template_lines, "sem")
+    nout = read_table(template_lines, "nout")
+    ninr = read_table(template_lines, "ninr")
+    ninx = read_table(template_lines, "ninx")
+
+    lines = []
+    table = []
+    blocks = find_blocks(code, nout, ninr, ninx)
+    for start in sorted(blocks):
+        lines.append(f"def b{start}(r,m):")
+        lines.append("\tglobal cc,running,exit_code")
+        if counters:
+            lines.append("\tglobal ni")
+        for addr, (op0, a, b, x, next_addr) in blocks[start]:
+            op = op0 & 63
+            lines.append(f"\t# {addr:08x}: {mnemonic(op)}")
+            if counters:
+                lines.append("\tni+=1")
+            sem_lines = sem[op] if op < len(sem) else None
+            if not sem_lines:
+                sem_lines = ["running=False", "return {N}"]
+            if op0 < 64:
+                x = f"r[{x}]"
+            for line in sem_lines:
+                lines.append("\t" + line.format(A=a, B=b, X=x, N=next_addr))
+        if not lines[-1].lstrip().startswith("return"):
+            lines.append(f"\treturn {next_addr}")
+        lines.append("")
+        table.append(f"({start},{next_addr},b{start})")
+
+    lines.append("aot=[" + ",".join(table) + "]")
+    return lines
+
+
+def py_bytes(data):
+    # Return a Python bytes literal for data. Quotes, backslashes and "#" are escaped, so that the
+    # literal is not mistaken for the end of a string or a comment by the minifier.
+    chars = []
+    for c in bytearray(data):
+        if 32 <= c < 127 and chr(c) not in "\\'\"#":
+            chars.append(chr(c))
+        else:
+            chars.append(f"\\x{c:02x}")
+    return "b'" + "".join(chars) + "'"
+
+
+def read_c_table(lines, name):
+    # Extract a table, given as a C array initializer (on a single line), from the source code of
+    # a VM template.
+    for line in lines:
+        match = re.search(name + r"\[\]=\{([0-9,]*)\}", line)
+        if match:
+            return [int(x) for x in match.group(1).split(",")]
+    raise ValueError(f"No table named {name}")
+
+
+def read_c_cases(lines):
+    # Extract the code for each instruction (the "case" bodies of the instruction switch statement)
+    # from the source code of a VM template.
+    cases = {}
+    body = None
+    for line in lines[[k for k, x in enumerate(lines) if "switch(op){" in x][0] :]:
+        match = re.match(r"\s*case (\d+):", line)
+        if match:
+            body = []
+            cases[int(match.group(1))] = body
+        elif line.strip() == "break;" or line.strip().startswith("default:"):
+            body = None
+        elif body is not None:
+            body.append(line)
+    return cases
+
+
+def gen_c(code, template_lines, counters=False):
+    # Translate the program to C code (one labelled piece of code per basic block), using the
+    # instruction implementations of the C VM template. Execution starts at the dispatch label (D),
+    # which jumps to the block for the current PC, or falls through to the interpreter for code
+    # that has not been translated. If counters is True, the code counts the executed instructions
+    # (see PERF). Returns the source lines to be inserted before the main interpreter loop.
+    nout = read_c_table(template_lines, "nout")
+    ninr = read_c_table(template_lines, "ninr")
+    ninx = read_c_table(template_lines, "ninx")
+    nwr = read_c_table(template_lines, "nwr")
+    cases = read_c_cases(template_lines)
+
+    blocks = find_blocks(code, nout, ninr, ninx)
+    block_ends = _ops(_BLOCK_ENDS)
+    jumps = _ops(_JUMPS)
+    fallthrough = _ops(_FALLTHROUGH)
+
+    ranges = []
+    code_lines = []
+    for start in sorted(blocks):
+        code_lines.append(f"  B{start}:")
+        for addr, (op0, a, b, x, next_addr) in blocks[start]:
+            op = op0 & 63
+            code_lines.append(f"  // {addr:08x}: {mnemonic(op)}")
+
+            # Set up the operands (o[]) and the PC, as the interpreter would.
+            leading = [a, b][: nout[op] + ninr[op]]
+            operands = [
+                str(reg) if k < nout[op] else f"r[{reg}]" for k, reg in enumerate(leading)
+            ]
+            if ninx[op]:
+                operands.append(f"r[{x}]" if op0 < 64 else str(x))
+            setup = f"pc={next_addr};"
+            if counters:
+                setup += "++ni;"
+            for k, operand in enumerate(operands):
+                setup += f"o[{k}]={operand};"
+            code_lines.append("  " + setup)
+
+            # The instruction implementation.
+            body = cases.get(op, ["running=0;"])
+            code_lines.extend(body)
+
+            # Leave the translated code if a memory write hit it.
+            if nwr[op]:
+                code_lines.append("  if(!ce)goto D;")
+
+            # Jump directly to the next block, if possible.
+            if op in block_ends:
+                targets = []
+                if op in jumps and op0 >= 64:
+                    targets.append(x)
+                if op in fallthrough:
+                    targets.append(next_addr)
+                for target in targets:
+                    if target in blocks:
+                        code_lines.append(f"  if(pc=={target})goto B{target};")
+        code_lines.append("  goto D;")
+        ranges.extend([start, next_addr])
+
+    lines = []
+    lines.append("  // Mark the memory that is covered by translated code.")
+    lines.append(f"  ce={max(ranges[1::2])};")
+    lines.append("  cm=calloc(ce,1);")
+    lines.append("  {")
+    lines.append(f"    static const int b[]={{{','.join(str(x) for x in ranges)}}};")
+    lines.append(f"    for(i=0;i<{len(ranges)};i+=2)for(k=b[i];k<b[i+1];++k)cm[k]=1;")
+    lines.append("  }")
+    lines.append("  int o[4];")
+    lines.append("  goto D;")
+    lines.extend(code_lines)
+    lines.append("  // Dispatch to translated code (or fall through to the interpreter).")
+    lines.append("  D:")
+    dispatch = "".join(f"case {start}:goto B{start};" for start in sorted(blocks))
+    lines.append(f"  if(ce&&running)switch(pc){{{dispatch}}}")
+    return lines
@@ -209,6 +209,194 @@ _OPCODES = {
         [0x9f, _REG, _PCREL8],
         [0xdf, _REG, _IMM32],
     ]},
+
+    # Fused compare & branch
+    "CBEQ": {"descrs": [
+        [0x20, _REG, _REG, _REG],
+        [0x60, _REG, _REG, _IMM8],
+        [0xa0, _REG, _REG, _PCREL8],
+        [0xe0, _REG, _REG, _IMM32],
+    ]},
+    "CBNE": {"descrs": [
+        [0x21, _REG, _REG, _REG],
+        [0x61, _REG, _REG, _IMM8],
+        [0xa1, _REG, _REG, _PCREL8],
+        [0xe1, _REG, _REG, _IMM32],
+    ]},
+    "CBLT": {"descrs": [
+        [0x22, _REG, _REG, _REG],
+        [0x62, _REG, _REG, _IMM8],
+        [0xa2, _REG, _REG, _PCREL8],
+        [0xe2, _REG, _REG, _IMM32],
+    ]},
+    "CBLE": {"descrs": [
+        [0x23, _REG, _REG, _REG],
+        [0x63, _REG, _REG, _IMM8],
+        [0xa3, _REG, _REG, _PCREL8],
+        [0xe3, _REG, _REG, _IMM32],
+    ]},
+    "CBGT": {"descrs": [
+        [0x24, _REG, _REG, _REG],
+        [0x64, _REG, _REG, _IMM8],
+        [0xa4, _REG, _REG, _PCREL8],
+        [0xe4, _REG, _REG, _IMM32],
+    ]},
+    "CBGE": {"descrs": [
+        [0x25, _REG, _REG, _REG],
+        [0x65, _REG, _REG, _IMM8],
+        [0xa5, _REG, _REG, _PCREL8],
+        [0xe5, _REG, _REG, _IMM32],
+    ]},
+    "DBNZ": {"descrs": [
+        [0x26, _REG, _REG],
+        [0x66, _REG, _IMM8],
+        [0xa6, _REG, _PCREL8],
+        [0xe6, _REG, _IMM32],
+    ]},
+
+    # Bulk memory operations
+    "MEMCPY": {"descrs": [
+        [0x27, _REG, _REG, _REG],
+        [0x67, _REG, _REG, _IMM8],
+        [0xe7, _REG, _REG, _IMM32],
+    ]},
+    "MEMMOVE": {"descrs": [
+        [0x28, _REG, _REG, _REG],
+        [0x68, _REG, _REG, _IMM8],
+        [0xe8, _REG, _REG, _IMM32],
+    ]},
+    "MEMSET": {"descrs": [
+        [0x29, _REG, _REG, _REG],
+        [0x69, _REG, _REG, _IMM8],
+        [0xe9, _REG, _REG, _IMM32],
+    ]},
+
+    # Memory scanning & comparison
+    "MEMCHR": {"descrs": [
+        [0x2a, _REG, _REG, _REG],
+        [0x6a, _REG, _REG, _IMM8],
+        [0xea, _REG, _REG, _IMM32],
+    ]},
+    "MEMSPN": {"descrs": [
+        [0x2b, _REG, _REG, _REG],
+        [0x6b, _REG, _REG, _IMM8],
+        [0xeb, _REG, _REG, _IMM32],
+    ]},
+    "MEMCMP": {"descrs": [
+        [0x2c, _REG, _REG, _REG],
+        [0x6c, _REG, _REG, _IMM8],
+        [0xec, _REG, _REG, _IMM32],
+    ]},
+    "HASH": {"descrs": [
+        [0x2d, _REG, _REG, _REG],
+        [0x6d, _REG, _REG, _IMM8],
+        [0xed, _REG, _REG, _IMM32],
+    ]},
+
+    # Integer/decimal conversion
+    "ITOA": {"descrs": [
+        [0x2e, _REG, _REG, _REG],
+        [0x6e, _REG, _REG, _IMM8],
+        [0xee, _REG, _REG, _IMM32],
+    ]},
+    "ATOI": {"descrs": [
+        [0x2f, _REG, _REG, _REG],
+        [0x6f, _REG, _REG, _IMM8],
+        [0xef, _REG, _REG, _IMM32],
+    ]},
+
+    # Memory size
+    "BRK": {"descrs": [
+        [0x30, _REG, _REG],
+        [0x70, _REG, _IMM8],
+        [0xf0, _REG, _IMM32],
+    ]},
+
+    # Snapshot
+    "SNAP": {"descrs": [[0x31]]},
+
+    # Run a system command, capturing its output
+    "RUNO": {"descrs": [
+        [0x32, _REG, _REG, _REG],
+        [0x72, _REG, _REG, _IMM8],
+        [0xf2, _REG, _REG, _IMM32],
+    ]},
+
+    # Background jobs
+    "SPAWN": {"descrs": [
+        [0x33, _REG, _REG, _REG],
+        [0x73, _REG, _REG, _IMM8],
+        [0xf3, _REG, _REG, _IMM32],
+    ]},
+    "POLL": {"descrs": [
+        [0x34, _REG, _REG],
+        [0x74, _REG, _IMM8],
+        [0xf4, _REG, _IMM32],
+    ]},
+    "WAIT": {"descrs": [
+        [0x35, _REG, _REG],
+        [0x75, _REG, _IMM8],
+        [0xf5, _REG, _IMM32],
+    ]},
+    "STATUS": {"descrs": [
+        [0x36, _REG, _REG],
+        [0x76, _REG, _IMM8],
+        [0xf6, _REG, _IMM32],
+    ]},
+
+    # Threads and atomic memory operations
+    "TSPAWN": {"descrs": [
+        [0x37, _REG, _REG, _REG],
+        [0x77, _REG, _REG, _IMM8],
+        [0xb7, _REG, _REG, _PCREL8],
+        [0xf7, _REG, _REG, _IMM32],
+    ]},
+    "TJOIN": {"descrs": [
+        [0x38, _REG, _REG],
+        [0x78, _REG, _IMM8],
+        [0xf8, _REG, _IMM32],
+    ]},
+    "CAS": {"descrs": [
+        [0x39, _REG, _REG, _REG],
+        [0x79, _REG, _REG, _IMM8],
+        [0xb9, _REG, _REG, _PCREL8],
+        [0xf9, _REG, _REG, _IMM32],
+    ]},
+    "XADD": {"descrs": [
+        [0x3a, _REG, _REG],
+        [0x7a, _REG, _IMM8],
+        [0xba, _REG, _PCREL8],
+        [0xfa, _REG, _IMM32],
+    ]},
+
+    # File I/O
+    "FOPEN": {"descrs": [
+        [0x3b, _REG, _REG, _REG],
+        [0x7b, _REG, _REG, _IMM8],
+        [0xfb, _REG, _REG, _IMM32],
+    ]},
+    "FCLOSE": {"descrs": [
+        [0x3c, _REG],
+        [0x7c, _IMM8],
+        [0xfc, _IMM32],
+    ]},
+    "FREAD": {"descrs": [
+        [0x3d, _REG, _REG, _REG],
+        [0x7d, _REG, _REG, _IMM8],
+        [0xfd, _REG, _REG, _IMM32],
+    ]},
+    "FWRITE": {"descrs": [
+        [0x3e, _REG, _REG, _REG],
+        [0x7e, _REG, _REG, _IMM8],
+        [0xfe, _REG, _REG, _IMM32],
+    ]},
+
+    # Performance counters
+    "PERF": {"descrs": [
+        [0x3f, _REG, _REG],
+        [0x7f, _REG, _IMM8],
+        [0xff, _REG, _IMM32],
+    ]},
 }
 # fmt: on
 
@@ -492,9 +680,12 @@ def emit_utf8(c):
         )
 
 
-def compile_source(lines, verbosity_level, file_name):
+def compile_source(lines, verbosity_level, file_name, symbols=None):
+    # If symbols is a dict, it is filled with the addresses of the global code labels (i.e. labels
+    # that are defined with "label:", not local labels or assigned values), keyed by label name.
     success = False
     labels = {}
+    code_labels = set()
     code_from_last_pass = b""
     try:
         for compilation_pass in range(1, 100):
@@ -566,6 +757,8 @@ def compile_source(lines, verbosity_level, file_name):
                     else:
                         # This is a global label - use it as the scope label.
                         scope_label = label
+                        if line.endswith(":"):
+                            code_labels.add(label)
                     if label in new_labels:
                         raise AsmError(
                             line_no, "Re-definition of label: {}".format(label)
@@ -808,6 +1001,9 @@ def compile_source(lines, verbosity_level, file_name):
         print(f"{file_name}:{e.line_no}: ERROR: {e.msg}")
         success = False
 
+    if success and symbols is not None:
+        symbols.update((label, labels[label]) for label in code_labels)
+
     return success, code
 
 
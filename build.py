@@ -21,10 +21,12 @@
 
 import argparse
 import bin2str
+import bsvmaot
 import bsvmasm
 import os
 import stat
 import sys
+import zlib
 from pathlib import Path
 
 _REPO_ROOT = Path(__file__).parent
@@ -43,10 +45,20 @@ _BATVM_TEMPLATE = _REPO_ROOT / "vm/bsvm.template.bat"
 _BATVM_OUT = _OUT_DIR / "bsvm.bat"
 _CVM_TEMPLATE = _REPO_ROOT / "vm/bsvm.template.c"
 _CVM_OUT = _OUT_DIR / "bsvm.c"
+_CVM_AOT_OUT = _OUT_DIR / "bsvm_aot.c"
 _PSVM_TEMPLATE = _REPO_ROOT / "vm/bsvm.template.ps1"
 _PSVM_OUT = _OUT_DIR / "bsvm.ps1"
 _PYVM_TEMPLATE = _REPO_ROOT / "vm/bsvm.template.py"
 _PYVM_OUT = _OUT_DIR / "bsvm.py"
+_PYVM_AOT_OUT = _OUT_DIR / "bsvm_aot.py"
+_PYVM_BIN_OUT = _OUT_DIR / "bsvm.bin"
+_PYVM_SYM_OUT = _OUT_DIR / "bsvm.sym"
+_PYCLIENT_TEMPLATE = _REPO_ROOT / "vm/bsvmc.template.py"
+_PYCLIENT_OUT = _OUT_DIR / "bsvmc.py"
+_PYASYNC_TEMPLATE = _REPO_ROOT / "vm/bsvm_async.template.py"
+_PYASYNC_OUT = _OUT_DIR / "bsvm_async.py"
+_PYRUN_TEMPLATE = _REPO_ROOT / "vm/bsvm_run.template.py"
+_PYRUN_OUT = _OUT_DIR / "bsvm_run.py"
 
 
 def read_file(name):
@@ -71,11 +83,18 @@ def compile_file(src_name, verbosity_level):
     srd_dir = src_name.parent
     lines = read_file(src_name)
     lines = bsvmasm.preprocess(lines, srd_dir)
-    (success, code) = bsvmasm.compile_source(lines, verbosity_level, src_name)
+    symbols = {}
+    (success, code) = bsvmasm.compile_source(lines, verbosity_level, src_name, symbols)
     if not success:
         print(f"Unable to compile {src_name}")
         sys.exit(1)
-    return code
+    return code, symbols
+
+
+def remove_counters(lines):
+    # Remove the code that maintains the performance counters, i.e. the lines that end with a
+    # "(counters only)" comment.
+    return [x for x in lines if not x.endswith("(counters only)")]
 
 
 def remove_line_comment(line, start_str="#"):
@@ -131,11 +150,13 @@ def minify_sh(lines):
     return filtered_lines
 
 
-def gen_sh(template, out, code, verbosity_level, debug):
+def gen_sh(template, out, code, verbosity_level, debug, counters):
     if verbosity_level >= 1:
         print(f"Generating {out}")
 
     old_lines = read_file(template)
+    if not counters:
+        old_lines = remove_counters(old_lines)
     lines = []
     for line in old_lines:
         # Perform template substitutions.
@@ -185,18 +206,29 @@ def gen_bat(code, verbosity_level, debug):
     write_file(_BATVM_OUT, lines, make_executable=True, line_end="\r\n")
 
 
-def gen_c(code, verbosity_level, debug):
+def gen_c(out, code, verbosity_level, debug, counters, aot=False):
     if verbosity_level >= 1:
-        print(f"Generating {_CVM_OUT}")
+        print(f"Generating {out}")
 
-    old_lines = read_file(_CVM_TEMPLATE)
-    lines = []
-    for line in old_lines:
+    template_lines = read_file(_CVM_TEMPLATE)
+    if not counters:
+        template_lines = remove_counters(template_lines)
+    old_lines = []
+    for line in template_lines:
         # Perform template substitutions.
         if line.startswith("const char p[]="):
             prg_str = bin2str.convert(code, use_hex=False).replace("\\", "\\\\")
             line = f'const char p[]="{prg_str}";'
+        elif line.strip() == "// AOT: BLOCKS" and aot:
+            # Translate the program to C code ahead of time.
+            old_lines.extend(bsvmaot.gen_c(code, template_lines, counters))
+            continue
+        elif line.strip() == "// AOT: DISPATCH" and aot:
+            line = "    goto D;"
+        old_lines.append(line)
 
+    lines = []
+    for line in old_lines:
         # Perform simple minification (except for debug builds).
         if not debug:
             # Remove comments.
@@ -221,14 +253,16 @@ def gen_c(code, verbosity_level, debug):
         else:
             lines.append(line)
 
-    write_file(_CVM_OUT, lines, make_executable=False)
+    write_file(out, lines, make_executable=False)
 
 
-def gen_powershell(code, verbosity_level, debug):
+def gen_powershell(code, verbosity_level, debug, counters):
     if verbosity_level >= 1:
         print(f"Generating {_PSVM_OUT}")
 
     old_lines = read_file(_PSVM_TEMPLATE)
+    if not counters:
+        old_lines = remove_counters(old_lines)
     lines = []
     for line in old_lines:
         # Perform template substitutions.
@@ -248,43 +282,84 @@ def gen_powershell(code, verbosity_level, debug):
     write_file(_PSVM_OUT, lines, make_executable=True)
 
 
-def gen_python(code, verbosity_level, debug):
+def gen_python(out, code, verbosity_level, debug, counters, aot=False):
     if verbosity_level >= 1:
-        print(f"Generating {_PYVM_OUT}")
+        print(f"Generating {out}")
 
-    old_lines = read_file(_PYVM_TEMPLATE)
-    lines = []
-    del_lext_line = False
-    for line in old_lines:
+    template_lines = read_file(_PYVM_TEMPLATE)
+    if not counters:
+        template_lines = remove_counters(template_lines)
+    old_lines = []
+    for line in template_lines:
         # Perform template substitutions.
         if line.startswith("p="):
             prg_str = bin2str.convert(code, use_hex=False).replace("\\", "\\\\")
             line = f"p='{prg_str}'"
+        elif line.startswith("pb="):
+            line = f"pb={zlib.crc32(code)}"
+        elif line.startswith("aot=") and aot:
+            # Translate the program to Python code ahead of time.
+            old_lines.extend(bsvmaot.gen_python(code, template_lines, counters))
+            continue
+        elif line.startswith("pa=") and aot:
+            line = f"pa={bsvmaot.py_bytes(code)}"
+        old_lines.append(line)
+
+    lines = old_lines if debug else minify_python(old_lines)
+    write_file(out, lines, make_executable=True)
 
-        # Perform simple minification (except for debug builds).
-        if not debug:
-            # Remove comments (except the shebang).
-            if not line.startswith("#!/"):
-                line = remove_line_comment(line)
-
-            # Remove debug code and empty lines.
-            if (
-                line.lstrip().startswith("WriteDebug")
-                or line.strip() == ""
-                or del_lext_line
-            ):
-                line = ""
-            if line.startswith("def WriteDebug"):
-                line = ""
-                del_lext_line = True
-            else:
-                del_lext_line = False
-            if line:
-                lines.append(line)
+
+def minify_python(old_lines):
+    lines = []
+    del_lext_line = False
+    for line in old_lines:
+        # Remove comments (except the shebang).
+        if not line.startswith("#!/"):
+            line = remove_line_comment(line)
+
+        # Remove debug code and empty lines.
+        if line.lstrip().startswith("WriteDebug") or line.strip() == "" or del_lext_line:
+            line = ""
+        if line.startswith("def WriteDebug"):
+            line = ""
+            del_lext_line = True
         else:
+            del_lext_line = False
+        if line:
             lines.append(line)
+    return lines
+
+
+def gen_python_module(template, out, verbosity_level, debug, make_executable=False):
+    if verbosity_level >= 1:
+        print(f"Generating {out}")
+
+    lines = read_file(template)
+    if not debug:
+        lines = minify_python(lines)
+
+    write_file(out, lines, make_executable=make_executable)
 
-    write_file(_PYVM_OUT, lines, make_executable=True)
+
+def gen_python_bin(code, verbosity_level):
+    # The Python VMs load the program from this file (if it matches the program), which is faster
+    # than decoding the packed program string.
+    if verbosity_level >= 1:
+        print(f"Generating {_PYVM_BIN_OUT}")
+    with open(_PYVM_BIN_OUT, "wb") as f:
+        f.write(code)
+
+
+def gen_python_sym(code, symbols, verbosity_level):
+    # The Python VM profiler (BSVM_PROFILE) uses this file for translating code addresses to label
+    # names. The first line is the CRC-32 of the program, followed by one "address name" line per
+    # label, sorted by address.
+    if verbosity_level >= 1:
+        print(f"Generating {_PYVM_SYM_OUT}")
+    lines = [str(zlib.crc32(code))]
+    for name, addr in sorted(symbols.items(), key=lambda x: (x[1], x[0])):
+        lines.append(f"{addr} {name}")
+    write_file(_PYVM_SYM_OUT, lines)
 
 
 def gen_bat_frontend(verbosity_level, debug):
@@ -309,19 +384,30 @@ def gen_sh_frontend(verbosity_level, debug):
     write_file(_SH_FRONTEND_OUT, lines, make_executable=True)
 
 
-def build(verbosity_level, debug):
+def build(verbosity_level, debug, gen_bin, gen_sym, counters):
     # Compile the main source.
     src_name = _REPO_ROOT / _MAIN_SOURCE
     if verbosity_level >= 1:
         print(f"Compiling {src_name}")
-    code = compile_file(src_name, verbosity_level)
+    code, symbols = compile_file(src_name, verbosity_level)
 
     # Generate the different interpreters.
-    gen_sh(_BASHVM_TEMPLATE, _BASHVM_OUT, code, verbosity_level, debug)
+    gen_sh(_BASHVM_TEMPLATE, _BASHVM_OUT, code, verbosity_level, debug, counters)
     gen_bat(code, verbosity_level, debug)
-    gen_c(code, verbosity_level, debug)
-    gen_powershell(code, verbosity_level, debug)
-    gen_python(code, verbosity_level, debug)
+    gen_c(_CVM_OUT, code, verbosity_level, debug, counters)
+    gen_c(_CVM_AOT_OUT, code, verbosity_level, debug, counters, aot=True)
+    gen_powershell(code, verbosity_level, debug, counters)
+    gen_python(_PYVM_OUT, code, verbosity_level, debug, counters)
+    gen_python(_PYVM_AOT_OUT, code, verbosity_level, debug, counters, aot=True)
+    if gen_bin:
+        gen_python_bin(code, verbosity_level)
+    if gen_sym:
+        gen_python_sym(code, symbols, verbosity_level)
+    gen_python_module(
+        _PYCLIENT_TEMPLATE, _PYCLIENT_OUT, verbosity_level, debug, make_executable=True
+    )
+    gen_python_module(_PYASYNC_TEMPLATE, _PYASYNC_OUT, verbosity_level, debug)
+    gen_python_module(_PYRUN_TEMPLATE, _PYRUN_OUT, verbosity_level, debug, make_executable=True)
 
     # Generate the frontends.
     gen_bat_frontend(verbosity_level, debug)
@@ -337,6 +423,21 @@ def main():
     parser.add_argument(
         "-d", "--debug", action="store_true", help="generate debug code"
     )
+    parser.add_argument(
+        "--bin",
+        action="store_true",
+        help="generate a binary program file for the Python VMs",
+    )
+    parser.add_argument(
+        "--sym",
+        action="store_true",
+        help="generate a symbol file for the Python VM profiler (BSVM_PROFILE)",
+    )
+    parser.add_argument(
+        "--counters",
+        action="store_true",
+        help="count the executed instructions (for the PERF instruction)",
+    )
     args = parser.parse_args()
 
     # Select verbosity level.
@@ -346,7 +447,7 @@ def main():
     elif args.extra_verbose:
         verbosity_level = 2
 
-    build(verbosity_level, args.debug)
+    build(verbosity_level, args.debug, args.bin, args.sym, args.counters)
 
 
 if __name__ == "__main__":
@@ -30,6 +30,9 @@
 main:
     jsr     mem_init
 
+    ; Resume from here when started from a snapshot image.
+    snap
+
     ; Test the parser.
     mov     r1, #bs_source
     jsr     parse_program
@@ -79,14 +82,10 @@ loop_test:
 1$:
     mov     r129, #1000
 2$:
-    sub     r129, #1
-    cmp     r129, #0
-    bne     2$
+    dbnz    r129, 2$
     mov     r50, #loop_text
     print   r50, #loop_text_size
-    sub     r128, #1
-    cmp     r128, #0
-    bne     1$
+    dbnz    r128, 1$
     mov     r50, #loop_done_text
     println r50, #loop_done_text_size
     rts
@@ -33,9 +33,8 @@
 ;
 ; -------------------------------------------------------------------------------------------------
 
-; The memory size must be matched by the VM implementation.
-_MEM_END = 1048576
 _STACK_SIZE = 4096
+_MEM_GROW_SIZE = 65536      ; Minimum number of bytes to grow the memory by when it is full
 
 
 ; -------------------------------------------------------------------------------------------------
@@ -45,7 +44,7 @@ _STACK_SIZE = 4096
 
 mem_init:
     mov     r1, #mem_start      ; r1 = Start of allocatable memory
-    mov     r2, #_MEM_END
+    brk     r2, #0              ; r2 = End of memory
     sub     r2, r1              ; r2 = Memory size
 
     ; Create the first free block.
@@ -76,19 +75,16 @@ malloc:
 
     mov     r10, r1
     add     r10, #5             ; minimum block size required for splitting a block into two
+    mov     r11, #2             ; r11 = kind of the last block (for comparisons)
 
     ; First fit: Find the first free block that is large enough.
 1$:
     ldw     r3, r2, #0          ; r3 = candidate_size
     ldb     r4, r2, #4          ; r4 = kind
-    cmp     r4, #2
-    beq     5$                  ; kind == 2 (end)?
-    cmp     r4, #0
-    bne     2$                  ; kind != 0 (free)?
-    cmp     r1, r3
-    beq     4$                  ; size == candidate_size?
-    cmp     r10, r3
-    blt     3$                  ; size+5 < candidate_size?
+    cbeq    r4, r11, 5$         ; kind == 2 (end)?
+    cbne    r4, z, 2$           ; kind != 0 (free)?
+    cbeq    r1, r3, 4$          ; size == candidate_size?
+    cblt    r10, r3, 3$         ; size+5 < candidate_size?
 
     ; On to the next block.
 2$:
@@ -117,8 +113,28 @@ malloc:
     add     r1, #5              ; Return the block start address
     rts
 
-    ; No more free memory.
+    ; No more free memory, so grow the memory and turn the last block into a free block.
 5$:
+    mov     r3, #_MEM_GROW_SIZE
+    cblt    r10, r3, 6$         ; size+5 < grow size?
+    mov     r3, r1              ; Grow by exactly the requested size
+6$:
+    mov     r5, r2
+    add     r5, #5
+    add     r5, r3              ; r5 = start of the new last block
+    mov     r6, r5
+    add     r6, #5              ; r6 = required end of memory
+    cblt    r6, r2, 7$          ; Overflow?
+    brk     r7, r6
+    cblt    r7, r6, 7$          ; Unable to grow the memory?
+
+    stw     r3, r2, #0          ; size
+    stb     z, r2, #4           ; kind = 0 (free)
+    stw     z, r5, #0           ; size = 0
+    stb     r11, r5, #4         ; kind = 2 (end)
+    jmp     1$
+
+7$:
     mov     r1, #0
     rts
 
@@ -28,31 +28,7 @@
 ; -------------------------------------------------------------------------------------------------
 
 memcpy:
-    mov     r8, #0
-
-    mov     r6, r3
-    shr     r6, #2      ; r6 = number of 32-bit words
-    cmp     r6, #0
-    beq     2$
-    shl     r6, #2
-1$:
-    ldw     r4, r2, r8
-    stw     r4, r1, r8
-    add     r8, #4
-    cmp     r8, r6
-    bne     1$
-
-2$:
-    cmp     r3, #0
-    beq     4$          ; Nothing to do?
-
-3$:
-    ldb     r4, r2, r8
-    stb     r4, r1, r8
-    add     r8, #1
-    cmp     r8, r3
-    bne     3$
-4$:
+    memcpy  r1, r2, r3
     rts
 
 
@@ -70,50 +46,11 @@ memcpy:
 int2str_max_str_len = 11    ; -2^31 => "-2147483648"
 
 int2str:
-    mov     r2, #4$
-    mov     r3, #int2str_max_str_len
-
-    ; Handle negative numbers.
-    mov     r5, r1
-    cmp     r5, #0
-    bge     1$
-    cmp     r5, #-2147483648 ; Special case (we can't negate -2147483648)
-    beq     3$
-    mov     r1, #0
-    sub     r1, r5
-
-1$:
-    mov     r4, r1
-    mod     r4, #10
-    add     r4, #48         ; Convert decimal number to ASCII
-    sub     r3, #1
-    stb     r4, r2, r3
-    div     r1, #10
-    cmp     r1, #0
-    bne     1$
-
-    ; Inject a negative sign if necessary.
-    cmp     r5, #0
-    bge     2$
-    sub     r3, #1
-    mov     r4, #45         ; "-"
-    stb     r4, r2, r3
-
-2$:
-    mov     r1, r2
-    add     r1, r3          ; r1 = start of string
-    mov     r2, #int2str_max_str_len
-    sub     r2, r3          ; r2 = length of string
-    rts
-
-3$:
-    mov     r1, #5$
-    mov     r2, #int2str_max_str_len
+    mov     r3, r1
+    mov     r1, #1$
+    itoa    r2, r1, r3
     rts
 
-4$:
+1$:
     .space int2str_max_str_len
 
-5$:
-    .ascii "-2147483648"
-
@@ -69,6 +69,9 @@ obj_new:
     stw     r2, r1, #_OBJ_COUNT
     stw     r200, r1, #_OBJ_SIZE
 
+    ; Clear the object data.
+    memset  r1, z, r200
+
     rts
 
 
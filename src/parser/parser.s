@@ -37,6 +37,7 @@
 ;
 ;   r150 = current line number
 ;   r151 = start of current line
+;   r152 = end of the program string (the terminating zero)
 ; -------------------------------------------------------------------------------------------------
 
 ; -------------------------------------------------------------------------------------------------
@@ -59,6 +60,9 @@ parse_program:
     mov     r150, #1        ; Line number = 1
     mov     r151, r129      ; Start of first line
 
+    mov     r152, r129
+    memchr  r152, z, #0x7fffffff    ; r152 = End of program string
+
 parse_next_line:
     ; Find the start of a statement (skip spaces).
 1$:
@@ -229,32 +233,32 @@ parse_error_str4:
 ; Output:
 ;   r128 = current character
 ;   r129 = current parse position
+;
+; Clobbered:
+;   r200, r201
 ; -------------------------------------------------------------------------------------------------
 
 parse_spaces:
-1$:
-    cmp     r128, #32       ; SPACE
-    beq     2$
-    cmp     r128, #9        ; TAB
-    beq     2$
-    cmp     r128, #13       ; CR
-    beq     2$
-    cmp     r128, #35       ; "#" - start of line comment
-    beq     3$
-    rts
-2$:
-    add     r129, #1
+    ; Skip spaces, tabs and CRs.
+    mov     r200, #_parse_spaces_set
+    mov     r201, r152
+    sub     r201, r129      ; r201 = number of characters left
+    memspn  r129, r200, r201
     ldb     r128, r129, z
-    jmp     1$
+    cmp     r128, #35       ; "#" - start of line comment
+    bne     1$
 
-    ; Find end of line comment (i.e. LF).
-3$:
-    add     r129, #1
+    ; Find end of line comment (i.e. LF or the end of the program).
+    mov     r200, #10       ; LF
+    mov     r201, r152
+    sub     r201, r129
+    memchr  r129, r200, r201
     ldb     r128, r129, z
-    cmp     r128, #10       ; LF
-    bne     3$
+1$:
     rts
 
+_parse_spaces_set:
+    .asciz  " \t\r"
 
 
 ; -------------------------------------------------------------------------------------------------
@@ -268,25 +272,13 @@ parse_spaces:
 ;
 ; Output:
 ;   cc = status (EQ if equal, otherwise not equal)
-;
-; Clobbered:
-;   r200, r201, r202
 ; -------------------------------------------------------------------------------------------------
 
 parse_memcmp:
     cmp     r132, r142          ; Same length?
-    bne     2$
-
-    mov     r200, #0
-1$:
-    ldb     r201, r131, r200
-    ldb     r202, r141, r200
-    cmp     r201, r202
-    bne     2$
-    add     r200, #1
-    cmp     r200, r132
     bne     1$
-2$:
+    memcmp  r131, r141, r132
+1$:
     rts
 
 
@@ -379,6 +371,9 @@ parse_statement:
 ;   r131 = start of name (value)
 ;   r132 = length of name
 ;   r133 = _NULL (no objref)
+;
+; Clobbered:
+;   r200, r201
 ; -------------------------------------------------------------------------------------------------
 
 parse_name:
@@ -397,28 +392,13 @@ parse_name:
     bgt     4$
 1$:
     add     r129, #1
-    ldb     r128, r129, z
 
     ; Chars 2.. must be in [a-zA-Z0-9_]
-2$:
-    cmp     r128, #122      ; "z"
-    bgt     4$
-    cmp     r128, #97       ; "a"
-    bge     3$
-    cmp     r128, #95       ; "_"
-    beq     3$
-    cmp     r128, #48       ; "0"
-    blt     4$
-    cmp     r128, #57       ; "9"
-    ble     3$
-    cmp     r128, #65       ; "A"
-    blt     4$
-    cmp     r128, #90       ; "Z"
-    bgt     4$
-3$:
-    add     r129, #1
+    mov     r200, #_parse_name_set
+    mov     r201, r152
+    sub     r201, r129      ; r201 = number of characters left
+    memspn  r129, r200, r201
     ldb     r128, r129, z
-    jmp     2$
 
     ; End of name.
 4$:
@@ -430,6 +410,9 @@ parse_name:
     mov     r133, #_NULL
     rts
 
+_parse_name_set:
+    .asciz  "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_"
+
 
 ; -------------------------------------------------------------------------------------------------
 ; parse_number()
@@ -445,33 +428,34 @@ parse_name:
 ;   r131 = integer number (value)
 ;   r132 = 0 (no str)
 ;   r133 = _NULL (no objref)
+;
+; Clobbered:
+;   r200, r201, r202
 ; -------------------------------------------------------------------------------------------------
 
 parse_number:
-    mov     r131, #0
-
-1$:
     ; Numeric characters are [0-9].
-    cmp     r128, #48       ; "0"
-    blt     2$
-    cmp     r128, #57       ; "9"
-    bgt     2$
+    mov     r200, #_parse_number_set
+    mov     r201, r152
+    sub     r201, r129      ; r201 = number of characters left
+    mov     r202, r129      ; r202 = start of number
+    memspn  r129, r200, r201
+    ldb     r128, r129, z
 
     ; Convert from decimal ASCII to integer.
-    sub     r128, #48
-    mul     r131, #10
-    add     r131, r128
+    mov     r201, r129
+    sub     r201, r202      ; r201 = number of digits
+    atoi    r131, r202, r201
+    bne     parse_err_invalid
 
-    add     r129, #1
-    ldb     r128, r129, z
-    jmp     1$
-
-2$:
     mov     r130, #_VAL_TYPE_INT
     mov     r132, #0
     mov     r133, #_NULL
     rts
 
+_parse_number_set:
+    .asciz  "0123456789"
+
 
 ; -------------------------------------------------------------------------------------------------
 ; parse_expression()
@@ -104,12 +104,10 @@ val_cmp_eq:
     ; Compare all characters.
     mov     r1, #0
 2$:
-    cmp     r1, r132
-    beq     3$
+    cbeq    r1, r132, 3$
     ldb     r2, r131, r1
     ldb     r3, r141, r1
-    cmp     r2, r3
-    bne     4$
+    cbne    r2, r3, 4$
     add     r1, #1
     jmp     2$
 
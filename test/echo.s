@@ -0,0 +1,27 @@
+; Copy the input (stdin) to the output, one line at a time. The lines are printed with their
+; lengths, so that the line splitting is visible: "3:ab\n" for the input line "ab\n".
+
+entry:
+    mov     z, #0
+    mov     sp, #0x010000
+    mov     r3, #num
+1$:
+    mov     r1, #buf
+    fread   r1, z, #-8
+    cbeq    r1, z, 2$
+    itoa    r4, r3, r1
+    mov     r5, #58         ; ":"
+    stb     r5, r3, r4
+    add     r4, #1
+    print   r3, r4
+    mov     r2, #buf
+    print   r2, r1
+    jmp     #1$
+2$:
+    exit    z
+
+num:
+    .space  16
+buf:
+    .space  16
+mem_start:
@@ -0,0 +1,28 @@
+; ITOA of register values that have gone past 32 bits (the Python and bash VMs may hold wider
+; values in the registers). Expected output: "-2147483648\n0\n-6\n".
+
+entry:
+    mov     z, #0
+    mov     r3, #buf
+
+    mov     r1, #0x7fffffff
+    add     r1, #1
+    itoa    r4, r3, r1
+    println r3, r4
+
+    mov     r1, #65536
+    mul     r1, #65536
+    itoa    r4, r3, r1
+    println r3, r4
+
+    mov     r1, #-65536
+    mul     r1, #65536
+    add     r1, #-6
+    itoa    r4, r3, r1
+    println r3, r4
+
+    exit    z
+
+buf:
+    .space  16
+mem_start:
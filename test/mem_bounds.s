@@ -0,0 +1,57 @@
+; Bulk memory instructions with ranges that go past the end of the memory, which must be cut at
+; the end of the memory. Expected output: "AAxy....\nhash ok\ncmp ok\n".
+
+entry:
+    mov     z, #0
+    brk     r1, #0          ; r1 = memory size
+
+    ; Fill the last four bytes of the memory with "A".
+    mov     r2, r1
+    sub     r2, #4
+    mov     r3, #65
+    memset  r2, r3, #100
+
+    ; Copy "xy" to the last two bytes of the memory.
+    mov     r2, r1
+    sub     r2, #2
+    mov     r3, #xy
+    memcpy  r2, r3, #100
+
+    ; Copy the last four bytes of the memory to buf.
+    mov     r2, r1
+    sub     r2, #4
+    mov     r3, #buf
+    memmove r3, r2, #100
+
+    mov     r3, #buf
+    println r3, #8
+
+    ; The hash of the last four bytes of the memory is the hash of "AAxy".
+    hash    r4, r2, #100
+    hash    r5, r3, #4
+    cbne    r4, r5, 1$
+    mov     r4, #hash_ok
+    println r4, #7
+
+    ; The last four bytes of the memory compare as shorter than the same bytes in buf.
+    memcmp  r2, r3, #100
+    bge     #1$
+    memcmp  r3, r2, #100
+    ble     #1$
+    memcmp  r2, r3, #4
+    bne     #1$
+    mov     r4, #cmp_ok
+    println r4, #6
+1$:
+    exit    z
+
+xy:
+    .ascii  "xy"
+    .space  2
+buf:
+    .ascii  "........"
+hash_ok:
+    .ascii  "hash ok"
+cmp_ok:
+    .ascii  "cmp ok"
+mem_start:
@@ -0,0 +1,40 @@
+; Self-modifying code that is covered by more than one compiled block: the blocks that start at
+; add_11 and at add_10 both contain the ADD instruction that is patched. Expected output: 840.
+
+entry:
+    mov     z, #0
+    mov     sp, #0x010000
+    mov     r1, #0
+
+    ; Run both routines enough times to make them hot (compiled).
+    mov     r2, #20
+1$:
+    jsr     #add_11
+    jsr     #add_10
+    dbnz    r2, 1$
+
+    ; Patch the immediate operand of the ADD instruction at add_10 (10 -> 20).
+    mov     r3, #add_10
+    mov     r4, #20
+    stb     r4, r3, #2
+
+    ; Both routines must now use the patched instruction.
+    mov     r2, #20
+2$:
+    jsr     #add_11
+    dbnz    r2, 2$
+
+    mov     r3, #buf
+    itoa    r4, r3, r1
+    println r3, r4
+    exit    z
+
+add_11:
+    add     r1, #1
+add_10:
+    add     r1, #10
+    rts
+
+buf:
+    .space  16
+mem_start:
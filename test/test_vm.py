@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; -*-
+# -------------------------------------------------------------------------------------------------
+# Copyright (c) 2020 Marcus Geelnard
+#
+# This software is provided 'as-is', without any express or implied warranty. In no event will the
+# authors be held liable for any damages arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose, including commercial
+# applications, and to alter it and redistribute it freely, subject to the following restrictions:
+#
+#  1. The origin of this software must not be misrepresented; you must not claim that you wrote
+#     the original software. If you use this software in a product, an acknowledgment in the
+#     product documentation would be appreciated but is not required.
+#
+#  2. Altered source versions must be plainly marked as such, and must not be misrepresented as
+#     being the original software.
+#
+#  3. This notice may not be removed or altered from any source distribution.
+# -------------------------------------------------------------------------------------------------
+
+# Tests that run BS VM programs (test/*.s) in all the VM implementations that can be run on this
+# system, and compare the output. Run with "python3 -m unittest discover test" (or pytest).
+
+import asyncio
+import importlib.util
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+_TEST_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(_TEST_DIR.parent))
+
+import build  # noqa: E402
+
+# Input for test/echo.s, and the expected output.
+_ECHO_INPUT = b"ab\nverylongline\n\nxyz"
+_ECHO_OUTPUT = b"3:ab\n8:verylong5:line\n1:\n3:xyz"
+
+
+def build_vms(src_name, out_dir):
+    # Build the program src_name into the VM implementations in out_dir, and return a list of
+    # (name, command, extra environment) tuples for running the VMs.
+    code, _ = build.compile_file(src_name, 0)
+    build.gen_python(out_dir / "bsvm.py", code, 0, False, False)
+    build.gen_python(out_dir / "bsvm_aot.py", code, 0, False, False, aot=True)
+    vms = [
+        ("python", [sys.executable, str(out_dir / "bsvm.py")], {}),
+        ("python-jit", [sys.executable, str(out_dir / "bsvm.py")], {"BSVM_JIT": "1"}),
+        ("python-aot", [sys.executable, str(out_dir / "bsvm_aot.py")], {}),
+    ]
+
+    cc = shutil.which("gcc") or shutil.which("clang") or shutil.which("cc")
+    if cc:
+        for name in ("bsvm", "bsvm_aot"):
+            build.gen_c(out_dir / f"{name}.c", code, 0, False, False, aot=name.endswith("aot"))
+            exe = out_dir / name
+            subprocess.run([cc, "-O2", "-o", str(exe), str(out_dir / f"{name}.c")], check=True)
+            vms.append(("c" + name[4:].replace("_", "-"), [str(exe)], {}))
+
+    bash = shutil.which("bash")
+    if bash:
+        build.gen_sh(build._BASHVM_TEMPLATE, out_dir / "bsvm.bash", code, 0, False, False)
+        vms.append(("bash", [bash, str(out_dir / "bsvm.bash")], {}))
+
+    return vms
+
+
+def load_python_vm(src_name, out_dir, name="bsvm"):
+    # Build the program src_name into the Python VM (and the asyncio scheduler) in out_dir, and
+    # import the module name (bsvm or bsvm_async) from there.
+    code, _ = build.compile_file(src_name, 0)
+    build.gen_python(out_dir / "bsvm.py", code, 0, False, False)
+    build.gen_python_module(build._PYASYNC_TEMPLATE, out_dir / "bsvm_async.py", 0, False)
+    sys.modules.pop("bsvm", None)
+    spec = importlib.util.spec_from_file_location(name, out_dir / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ProgramTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def check_program(self, name, expected, stdin=b""):
+        # Run the program test/<name>.s in all VMs, and check that they all print expected.
+        for vm, cmd, env in build_vms(_TEST_DIR / f"{name}.s", Path(self.tmp_dir)):
+            with self.subTest(vm=vm):
+                result = subprocess.run(
+                    cmd,
+                    input=stdin,
+                    stdout=subprocess.PIPE,
+                    env=dict(os.environ, **env),
+                    timeout=60,
+                )
+                self.assertEqual(result.stdout.decode("utf8"), expected)
+
+    def test_smc_overlap(self):
+        # A store into code that is covered by overlapping compiled blocks must drop all of them.
+        self.check_program("smc_overlap", "840\n")
+
+    def test_itoa_wrap(self):
+        # ITOA formats the register value as a signed 32-bit integer, even if it has gone past 32
+        # bits (so the output fits in 11 bytes).
+        self.check_program("itoa_wrap", "-2147483648\n0\n-6\n")
+
+    def test_mem_bounds(self):
+        # Bulk memory ranges that go past the end of the memory are cut at the end of the memory.
+        self.check_program("mem_bounds", "AAxy....\nhash ok\ncmp ok\n")
+
+
+class EmbedTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.bsvm = load_python_vm(_TEST_DIR / "echo.s", Path(self.tmp_dir))
+
+    def test_input_callback(self):
+        # The input callback may return less than requested (here one byte at a time).
+        for chunk in (1, 3, 1000):
+            with self.subTest(chunk=chunk):
+                f = io.BytesIO(_ECHO_INPUT)
+                out = []
+                vm = self.bsvm.BSVM(output=out.append, input=lambda n: f.read(min(n, chunk)))
+                self.assertEqual(vm.run(), 0)
+                self.assertEqual(b"".join(out), _ECHO_OUTPUT)
+
+
+class AsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.addCleanup(sys.modules.pop, "bsvm", None)
+        self.bsvm_async = load_python_vm(_TEST_DIR / "echo.s", Path(self.tmp_dir), "bsvm_async")
+
+    def test_input_does_not_block_other_vms(self):
+        # The first VM waits for input that is only available once the second VM has finished,
+        # which only happens if the first VM does not block the scheduler while it waits.
+        done = threading.Event()
+        waited = []
+
+        def slow_input(n):
+            if waited:
+                return b""
+            waited.append(done.wait(10))
+            return _ECHO_INPUT
+
+        fast_input = io.BytesIO(_ECHO_INPUT).read
+        out1 = []
+        out2 = []
+        vm1 = self.bsvm_async.new(output=out1.append, input=slow_input)
+        vm2 = self.bsvm_async.new(output=out2.append, input=fast_input)
+
+        async def run_and_signal(vm):
+            v = await self.bsvm_async.run(vm)
+            done.set()
+            return v
+
+        async def run_both():
+            return await asyncio.gather(self.bsvm_async.run(vm1), run_and_signal(vm2))
+
+        self.assertEqual(asyncio.run(run_both()), [0, 0])
+        self.assertEqual(waited, [True])
+        self.assertEqual(b"".join(out1), _ECHO_OUTPUT)
+        self.assertEqual(b"".join(out2), _ECHO_OUTPUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
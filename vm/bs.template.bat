@@ -28,19 +28,19 @@ set d=%~dp0
 REM Select the VM implementation to use (in order of preference).
 call :findCmd python3
 if %ERRORLEVEL% EQU 0 (
-    "%c%" "%d%\bsvm.py" %*
+    "%c%" -S -E "%d%\bsvm_run.py" %*
     exit /B !ERRORLEVEL!
 )
 
 call :findCmd python
 if %ERRORLEVEL% EQU 0 (
-    "%c%" "%d%\bsvm.py" %*
+    "%c%" -S -E "%d%\bsvm_run.py" %*
     exit /B !ERRORLEVEL!
 )
 
 call :findCmd python2
 if %ERRORLEVEL% EQU 0 (
-    "%c%" "%d%\bsvm.py" %*
+    "%c%" -S -E "%d%\bsvm_run.py" %*
     exit /B !ERRORLEVEL!
 )
 
@@ -38,11 +38,11 @@ _GE=5 # _GT | _EQ
 #  * ninr - Number of input register operands.
 #  * ninx - Number of "final" input operands (any operand kind).
 #
-# OP:                       1 1 1 1 1 1 1 1 1 1 2 2 2 2 2 2 2 2 2 2 3 3
-#     (0) 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
-nout=($_B 1 1 1 0 0 0 0 0 0 0 0 0 0 0 0 0 1 1 1 1 1 1 1 1 1 1 1 0 0 0 0)
-ninr=($_B 0 1 1 2 2 0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 1 1 1)
-ninx=($_B 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 1 1 1 1 1 1)
+# OP:                       1 1 1 1 1 1 1 1 1 1 2 2 2 2 2 2 2 2 2 2 3 3 3 3 3 3 3 3 3 3 4 4 4 4 4 4 4 4 4 4 5 5 5 5 5 5 5 5 5 5 6 6 6 6
+#     (0) 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3
+nout=($_B 1 1 1 0 0 0 0 0 0 0 0 0 0 0 0 0 1 1 1 1 1 1 1 1 1 1 1 0 0 0 0 0 0 0 0 0 0 1 0 0 0 1 1 0 1 1 1 1 0 1 1 1 1 1 1 1 1 1 1 0 1 1 1)
+ninr=($_B 0 1 1 2 2 0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 1 1 1 2 2 2 2 2 2 0 2 2 2 1 1 2 1 1 1 0 0 1 1 0 0 0 1 0 1 0 1 0 1 1 0)
+ninx=($_B 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 1 1 1 1 1 1)
 
 # Helper functions.
 WriteDebug(){ >&2 echo "DEBUG: $1"; }
@@ -67,12 +67,52 @@ getS(){
   done
 }
 
+clip(){
+  # Set n to the number of bytes of the memory range $1..$1+$2-1 that are within the memory.
+  n=$2
+  [ $n -gt $((ms-$1)) ] && n=$((ms-$1))
+  [ $1 -lt 0 ] || [ $n -lt 0 ] && n=0
+}
+
+# Background jobs (SPAWN). jp holds the process ID of each job handle (1-jn),
+# and at most nj jobs (BSVM_JOBS, or the number of CPU cores) run at once.
+jn=0
+nj=${BSVM_JOBS:-$(getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1)}
+
+jdone(){
+  # Find a finished job (job $1, or any job if $1 is 0), and put its handle in
+  # v (0 if there is none). Wait for a job to finish if $2 is 1.
+  while :;do
+    v=0
+    n=0
+    for ((k=1;k<=jn;k++));do
+      [ -z "${jp[$k]}" ] || [ $1 != 0 -a $1 != $k ] && continue
+      n=1
+      kill -0 ${jp[$k]} 2>/dev/null || { v=$k; return; }
+    done
+    [ $2 = 0 -o $n = 0 ] && return
+    sleep 0.01
+  done
+}
+
+# Open files (FOPEN). fp holds the name and fo the read offset of each file
+# handle (3-), since the files are accessed with separate commands.
+fn=2
+
+# Input (FREAD from handle 0). Lines are read from stdin with the read builtin,
+# and the bytes ib[ip] .. ib[ie] are waiting to be consumed.
+ip=1
+ie=0
+
 # Note: We leave the memory empty and rely on well-behaving code (i.e. that
-# does not read undefined values).
+# does not read undefined values). The memory size (which is given by BSVM_MEM)
+# is only used for telling the program how much memory it may use.
+ms=${BSVM_MEM:-1048576}
 
 # Clear execution state.
 pc=1
 cc=0
+ni=0 # Number of executed instructions (PERF)
 
 # Convert the packed string to bytes and store it in the memory.
 v=$((($(echo "$p"|awk '{print length}')*2)/3))
@@ -102,6 +142,7 @@ while [ $running -eq 1 ];do
   pc0=$pc
   op0=${m[pc]}
   pc=$((pc+1))
+  ni=$((ni+1)) # (counters only)
 
   # Decode the opcode:
   #   Bits 0-5: operation
@@ -334,6 +375,370 @@ while [ $running -eq 1 ];do
       eval "$str"
       ;;
 
+    32) # CBEQ
+      WriteDebug "CBEQ ${o[1]}, ${o[2]}, ${o[3]}"
+      [ ${o[1]} -eq ${o[2]} ] && pc=${o[3]}
+      ;;
+
+    33) # CBNE
+      WriteDebug "CBNE ${o[1]}, ${o[2]}, ${o[3]}"
+      [ ${o[1]} -ne ${o[2]} ] && pc=${o[3]}
+      ;;
+
+    34) # CBLT
+      WriteDebug "CBLT ${o[1]}, ${o[2]}, ${o[3]}"
+      [ ${o[1]} -lt ${o[2]} ] && pc=${o[3]}
+      ;;
+
+    35) # CBLE
+      WriteDebug "CBLE ${o[1]}, ${o[2]}, ${o[3]}"
+      [ ${o[1]} -le ${o[2]} ] && pc=${o[3]}
+      ;;
+
+    36) # CBGT
+      WriteDebug "CBGT ${o[1]}, ${o[2]}, ${o[3]}"
+      [ ${o[1]} -gt ${o[2]} ] && pc=${o[3]}
+      ;;
+
+    37) # CBGE
+      WriteDebug "CBGE ${o[1]}, ${o[2]}, ${o[3]}"
+      [ ${o[1]} -ge ${o[2]} ] && pc=${o[3]}
+      ;;
+
+    38) # DBNZ
+      WriteDebug "DBNZ R${o[1]}, ${o[2]}"
+      r[${o[1]}]=$((${r[${o[1]}]}-1))
+      [ ${r[${o[1]}]} -ne 0 ] && pc=${o[2]}
+      ;;
+
+    39|40) # MEMCPY, MEMMOVE
+      WriteDebug "MEMMOVE ${o[1]}, ${o[2]}, ${o[3]}"
+      clip ${o[2]} ${o[3]}
+      k=$n
+      clip ${o[1]} ${o[3]}
+      [ $k -lt $n ] && n=$k
+      # Copy backwards if the ranges overlap with the destination last.
+      if [ ${o[1]} -gt ${o[2]} ];then
+        for ((i=n-1;i>=0;i--));do m[$((${o[1]}+i))]=${m[$((${o[2]}+i))]};done
+      else
+        for ((i=0;i<n;i++));do m[$((${o[1]}+i))]=${m[$((${o[2]}+i))]};done
+      fi
+      ;;
+
+    41) # MEMSET
+      WriteDebug "MEMSET ${o[1]}, ${o[2]}, ${o[3]}"
+      v=$((${o[2]}&255))
+      clip ${o[1]} ${o[3]}
+      for ((i=0;i<n;i++));do m[$((${o[1]}+i))]=$v;done
+      ;;
+
+    42) # MEMCHR
+      WriteDebug "MEMCHR R${o[1]}, ${o[2]}, ${o[3]}"
+      a=${r[${o[1]}]}
+      v=$((${o[2]}&255))
+      for ((i=0;i<${o[3]};i++));do [ "${m[$((a+i))]}" = $v ] && break;done
+      r[${o[1]}]=$((a+i))
+      ;;
+
+    43) # MEMSPN
+      WriteDebug "MEMSPN R${o[1]}, ${o[2]}, ${o[3]}"
+      t=()
+      a=${o[2]}
+      while [ "${m[$a]:-0}" != 0 ];do t[${m[$a]}]=1;a=$((a+1));done
+      a=${r[${o[1]}]}
+      for ((i=0;i<${o[3]};i++));do [ -n "${t[${m[$((a+i))]:-0}]}" ] || break;done
+      r[${o[1]}]=$((a+i))
+      ;;
+
+    44) # MEMCMP
+      WriteDebug "MEMCMP ${o[1]}, ${o[2]}, ${o[3]}"
+      clip ${o[2]} ${o[3]}
+      k=$n
+      clip ${o[1]} ${o[3]}
+      # A range that is cut short compares as shorter.
+      cc=$_EQ
+      [ $n -lt $k ] && cc=$_LT
+      [ $n -gt $k ] && cc=$_GT && n=$k
+      for ((i=0;i<n;i++));do
+        a=${m[$((${o[1]}+i))]:-0}
+        b=${m[$((${o[2]}+i))]:-0}
+        [ $a -lt $b ] && cc=$_LT && break
+        [ $a -gt $b ] && cc=$_GT && break
+      done
+      ;;
+
+    45) # HASH
+      WriteDebug "HASH R${o[1]}, ${o[2]}, ${o[3]}"
+      v=4294967295
+      clip ${o[2]} ${o[3]}
+      for ((i=0;i<n;i++));do
+        v=$((v^${m[$((${o[2]}+i))]:-0}))
+        for k in 1 2 3 4 5 6 7 8;do v=$(((v>>1)^(3988292384&-(v&1))));done
+      done
+      v=$((v^4294967295))
+      [ $v -gt 2147483647 ] && v=$((v-4294967296))
+      r[${o[1]}]=$v
+      ;;
+
+    46) # ITOA
+      WriteDebug "ITOA R${o[1]}, ${o[2]}, ${o[3]}"
+      s=$(((${o[3]}+2147483648&4294967295)-2147483648))  # Registers may exceed 32 bits
+      i=0
+      while [ -n "${s:$i:1}" ];do
+        c=${s:$i:1}
+        [ "$c" = - ] && m[$((${o[2]}+i))]=45 || m[$((${o[2]}+i))]=$((48+c))
+        i=$((i+1))
+      done
+      r[${o[1]}]=$i
+      ;;
+
+    47) # ATOI
+      WriteDebug "ATOI R${o[1]}, ${o[2]}, ${o[3]}"
+      a=${o[2]}
+      k=$((a+${o[3]}))
+      n=0
+      [ $a -lt $k ] && [ "${m[$a]}" = 45 ] && n=1 && a=$((a+1))
+      v=0
+      cc=0
+      [ $a -lt $k ] && cc=$_EQ
+      while [ $a -lt $k ];do
+        c=${m[$a]:-0}
+        [ $c -lt 48 ] || [ $c -gt 57 ] && cc=0 && break
+        v=$((v*10+c-48))
+        [ $v -gt $((2147483647+n)) ] && cc=0 && break
+        a=$((a+1))
+      done
+      [ $cc = 0 ] && v=0
+      [ $n = 1 ] && v=$((-v))
+      r[${o[1]}]=$v
+      ;;
+
+    48) # BRK
+      WriteDebug "BRK R${o[1]}, ${o[2]}"
+      [ ${o[2]} -gt $ms ] && [ ${o[2]} -lt 2147483648 ] && ms=${o[2]}
+      r[${o[1]}]=$ms
+      ;;
+
+    49) # SNAP (snapshot images are not supported)
+      WriteDebug "SNAP"
+      ;;
+
+    50) # RUNO
+      a=${o[2]}
+      while [ "${m[$a]:-0}" != 0 ];do a=$((a+1));done
+      getS ${o[2]} $((a-${o[2]}))
+      WriteDebug "RUNO R${o[1]}, ${o[2]}, ${o[3]} ($str)"
+      f=${TMPDIR:-/tmp}/bsvm.$$
+      (eval "$str") >"$f"
+      [ $? = 0 ] && cc=$_EQ || cc=0
+      t=($(od -An -v -tu1 "$f"))
+      rm -f "$f"
+      a=${r[${o[1]}]}
+      n=0
+      for c in ${t[@]};do
+        [ $n -lt ${o[3]} ] || break
+        m[$((a+n))]=$c
+        n=$((n+1))
+      done
+      r[${o[1]}]=$n
+      ;;
+
+    51) # SPAWN
+      getS ${o[2]} ${o[3]}
+      WriteDebug "SPAWN R${o[1]}, ${o[2]}, ${o[3]} ($str)"
+      while :;do
+        n=0
+        for ((k=1;k<=jn;k++));do
+          [ -n "${jp[$k]}" ] && kill -0 ${jp[$k]} 2>/dev/null && n=$((n+1))
+        done
+        [ $n -lt $nj ] && break
+        sleep 0.01
+      done
+      (eval "$str") &
+      jn=$((jn+1))
+      jp[$jn]=$!
+      r[${o[1]}]=$jn
+      ;;
+
+    52) # POLL
+      WriteDebug "POLL R${o[1]}, ${o[2]}"
+      jdone ${o[2]} 0
+      r[${o[1]}]=$v
+      ;;
+
+    53) # WAIT
+      WriteDebug "WAIT R${o[1]}, ${o[2]}"
+      jdone ${o[2]} 1
+      r[${o[1]}]=$v
+      ;;
+
+    54) # STATUS
+      WriteDebug "STATUS R${o[1]}, ${o[2]}"
+      k=${o[2]}
+      v=-1
+      if [ $k -gt 0 ] && [ $k -le $jn ] && [ -n "${jp[$k]}" ];then
+        wait ${jp[$k]}
+        v=$?
+        jp[$k]=
+      fi
+      r[${o[1]}]=$v
+      ;;
+
+    55) # TSPAWN (threads are not supported, so always fail)
+      WriteDebug "TSPAWN R${o[1]}, ${o[2]}, ${o[3]}"
+      r[${o[1]}]=0
+      ;;
+
+    56) # TJOIN
+      WriteDebug "TJOIN R${o[1]}, ${o[2]}"
+      r[${o[1]}]=-1
+      ;;
+
+    57) # CAS (there is only a single thread, so this is trivially atomic)
+      WriteDebug "CAS R${o[1]}, ${o[2]}, ${o[3]}"
+      a=${o[3]}
+      getI $a
+      cc=0
+      if [ $v -eq ${r[${o[1]}]} ];then
+        cc=$_EQ
+        w=${o[2]}
+        m[$a]=$((w&255))
+        m[$((a+1))]=$(((w>>8)&255))
+        m[$((a+2))]=$(((w>>16)&255))
+        m[$((a+3))]=$(((w>>24)&255))
+      fi
+      r[${o[1]}]=$v
+      ;;
+
+    58) # XADD
+      WriteDebug "XADD R${o[1]}, ${o[2]}"
+      a=${o[2]}
+      getI $a
+      w=$((v+${r[${o[1]}]}))
+      m[$a]=$((w&255))
+      m[$((a+1))]=$(((w>>8)&255))
+      m[$((a+2))]=$(((w>>16)&255))
+      m[$((a+3))]=$(((w>>24)&255))
+      r[${o[1]}]=$v
+      ;;
+
+    59) # FOPEN
+      a=${o[2]}
+      while [ "${m[$a]:-0}" != 0 ];do a=$((a+1));done
+      getS ${o[2]} $((a-${o[2]}))
+      WriteDebug "FOPEN R${o[1]}, ${o[2]}, ${o[3]} ($str)"
+      v=-1
+      case ${o[3]} in
+        0) [ -f "$str" ] && [ -r "$str" ] && v=0;;
+        1) (: >"$str") 2>/dev/null && v=0;;
+        2) (: >>"$str") 2>/dev/null && v=0;;
+        3) [ -f "$str" ] && v=$(($(wc -c <"$str")));;
+        4)
+          if [ -f "$str" ] && [ -r "$str" ];then
+            v=$ms
+            for c in $(od -An -v -tu1 "$str");do
+              m[$ms]=$c
+              ms=$((ms+1))
+            done
+          fi
+          ;;
+      esac
+      if [ ${o[3]} -lt 3 ] && [ $v = 0 ];then
+        fn=$((fn+1))
+        fp[$fn]=$str
+        fo[$fn]=0
+        v=$fn
+      fi
+      r[${o[1]}]=$v
+      ;;
+
+    60) # FCLOSE
+      WriteDebug "FCLOSE ${o[1]}"
+      [ ${o[1]} -gt 2 ] && fp[${o[1]}]=
+      ;;
+
+    61) # FREAD
+      WriteDebug "FREAD R${o[1]}, ${o[2]}, ${o[3]}"
+      k=${o[2]}
+      a=${r[${o[1]}]}
+      l=${o[3]}
+      [ $l -lt 0 ] && l=$((-l))
+      n=-1
+      if [ $k = 0 ];then
+        if [ $ip -gt $ie ] && [ ${o[3]} -lt 0 ];then
+          # Read the next line.
+          ip=1
+          ie=0
+          IFS= read -r t
+          v=$?
+          for c in $(printf '%s' "$t" | od -An -v -tu1);do
+            ie=$((ie+1))
+            ib[$ie]=$c
+          done
+          [ $v = 0 ] && ie=$((ie+1)) && ib[$ie]=10
+        fi
+        n=0
+        while [ $n -lt $l ] && [ $ip -le $ie ];do
+          c=${ib[$ip]}
+          ip=$((ip+1))
+          m[$((a+n))]=$c
+          n=$((n+1))
+          [ ${o[3]} -lt 0 ] && [ $c = 10 ] && break
+        done
+        if [ $n -lt ${o[3]} ];then
+          for c in $(dd bs=1 count=$((${o[3]}-n)) 2>/dev/null | od -An -v -tu1);do
+            m[$((a+n))]=$c
+            n=$((n+1))
+          done
+        fi
+      elif [ $k -gt 2 ] && [ -n "${fp[$k]}" ];then
+        n=0
+        if [ $l -gt 0 ];then
+          for c in $(od -An -v -tu1 -j ${fo[$k]} -N $l "${fp[$k]}" 2>/dev/null);do
+            m[$((a+n))]=$c
+            n=$((n+1))
+            [ ${o[3]} -lt 0 ] && [ $c = 10 ] && break
+          done
+        fi
+        fo[$k]=$((${fo[$k]}+n))
+      fi
+      r[${o[1]}]=$n
+      ;;
+
+    62) # FWRITE
+      WriteDebug "FWRITE R${o[1]}, ${o[2]}, ${o[3]}"
+      k=${o[2]}
+      n=-1
+      if [ $k -gt 2 ] && [ -n "${fp[$k]}" ];then
+        a=${r[${o[1]}]}
+        str=""
+        for ((n=0;n<${o[3]};n++));do
+          str+=$(printf '\\%03o' ${m[$((a+n))]:-0})
+        done
+        printf "$str" >>"${fp[$k]}" || n=-1
+      fi
+      r[${o[1]}]=$n
+      ;;
+
+    63) # PERF
+      WriteDebug "PERF R${o[1]}, ${o[2]}"
+      v=0
+      case ${o[2]} in
+        0) v=$ni;;
+        1|2)
+          # Use the wall clock (there is no portable monotonic clock).
+          t=$(date +%s%N 2>/dev/null)
+          case "$t" in
+            *N) t=$(($(date +%s)*1000000000));;
+          esac
+          [ ${o[2]} = 1 ] && v=$((t/1000)) || v=$((t/1000000))
+          ;;
+      esac
+      v=$((v&0xffffffff))
+      [ $v -gt 2147483647 ] && v=$((v-4294967296))
+      r[${o[1]}]=$v
+      ;;
+
     *)
       WriteDebug "Unsupported op=$op @ pc=$pc"
       running=0
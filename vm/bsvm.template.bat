@@ -57,30 +57,34 @@ REM  * nout - Number of output (or in/out) register operands.
 REM  * ninr - Number of input register operands.
 REM  * ninx - Number of "final" input operands (any operand kind).
 REM
-REM  OP:                        1 1 1 1 1 1 1 1 1 1 2 2 2 2 2 2 2 2 2 2 3 3
-REM         0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
+REM  OP:                        1 1 1 1 1 1 1 1 1 1 2 2 2 2 2 2 2 2 2 2 3 3 3 3 3 3 3 3 3 3 4 4 4 4 4 4 4 4 4 4 5 5 5 5 5 5 5 5 5 5 6 6 6 6
+REM         0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3
 set /A n=0
-for %%i in (0 1 1 1 0 0 0 0 0 0 0 0 0 0 0 0 0 1 1 1 1 1 1 1 1 1 1 1 0 0 0 0) do (
+for %%i in (0 1 1 1 0 0 0 0 0 0 0 0 0 0 0 0 0 1 1 1 1 1 1 1 1 1 1 1 0 0 0 0 0 0 0 0 0 0 1 0 0 0 1 1 0 1 1 1 1 0 1 1 1 1 1 1 1 1 1 1 0 1 1 1) do (
     set nout[!n!]=%%i
     set /A n+=1
 )
 set /A n=0
-for %%i in (0 0 1 1 2 2 0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 1 1 1) do (
+for %%i in (0 0 1 1 2 2 0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 1 1 1 2 2 2 2 2 2 0 2 2 2 1 1 2 1 1 1 0 0 1 1 0 0 0 1 0 1 0 1 0 1 1 0) do (
     set ninr[!n!]=%%i
     set /A n+=1
 )
 set /A n=0
-for %%i in (0 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 1 1 1 1 1 1) do (
+for %%i in (0 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 0 1 1 1 1 1 1 1 1 1 1 1 1 1 1) do (
     set ninx[!n!]=%%i
     set /A n+=1
 )
 
 REM Note: We leave the memory empty and rely on well-behaving code (i.e. that
-REM does not read undefined values).
+REM does not read undefined values). The memory size (which is given by BSVM_MEM)
+REM is only used for telling the program how much memory it may use.
+set /A ms=1048576
+if defined BSVM_MEM set /A ms=BSVM_MEM
 
 REM Clear execution state.
 set /A pc=1
 set /A cc=0
+set /A jn=0
 for /L %%n in (0,1,255) do set /A reg[%%n]=0
 
 REM Convert the hex string to bytes and store it in the memory.
@@ -126,7 +130,7 @@ set /A running=1
 
     call :WriteDebug "PC=%pc0% CC=%cc% OP=%op0% OP*=%op% AT=%at%"
     if %op% LSS 1 goto :Ibad
-    if %op% GTR 31 goto :Ibad
+    if %op% GTR 63 goto :Ibad
 
     REM Read the operands.
     set /A k=0
@@ -413,6 +417,303 @@ set /A running=1
         %s%
         goto :mxl
 
+    :I32
+        call :WriteDebug "CBEQ !o[0]!, !o[1]!, !o[2]!"
+        if !o[0]! EQU !o[1]! set /A pc=o[2]
+        goto :mxl
+
+    :I33
+        call :WriteDebug "CBNE !o[0]!, !o[1]!, !o[2]!"
+        if !o[0]! NEQ !o[1]! set /A pc=o[2]
+        goto :mxl
+
+    :I34
+        call :WriteDebug "CBLT !o[0]!, !o[1]!, !o[2]!"
+        if !o[0]! LSS !o[1]! set /A pc=o[2]
+        goto :mxl
+
+    :I35
+        call :WriteDebug "CBLE !o[0]!, !o[1]!, !o[2]!"
+        if !o[0]! LEQ !o[1]! set /A pc=o[2]
+        goto :mxl
+
+    :I36
+        call :WriteDebug "CBGT !o[0]!, !o[1]!, !o[2]!"
+        if !o[0]! GTR !o[1]! set /A pc=o[2]
+        goto :mxl
+
+    :I37
+        call :WriteDebug "CBGE !o[0]!, !o[1]!, !o[2]!"
+        if !o[0]! GEQ !o[1]! set /A pc=o[2]
+        goto :mxl
+
+    :I38
+        call :WriteDebug "DBNZ R!o[0]!, !o[1]!"
+        set /A reg[!o[0]!]-=1
+        set /A v=reg[!o[0]!]
+        if !v! NEQ 0 set /A pc=o[1]
+        goto :mxl
+
+    :I39
+    :I40
+        call :WriteDebug "MEMMOVE !o[0]!, !o[1]!, !o[2]!"
+        REM Copy backwards if the ranges overlap with the destination last.
+        if !o[0]! LEQ !o[1]! goto :o5
+        set /A i=o[2]-1
+        :l6
+            if !i! LSS 0 goto :mxl
+            set /A a=o[0]+i
+            set /A b=o[1]+i
+            set /A m[!a!]=m[!b!]
+            set /A i-=1
+            goto :l6
+        :o5
+        set /A i=0
+        :l7
+            if !i! GEQ !o[2]! goto :mxl
+            set /A a=o[0]+i
+            set /A b=o[1]+i
+            set /A m[!a!]=m[!b!]
+            set /A i+=1
+            goto :l7
+
+    :I41
+        call :WriteDebug "MEMSET !o[0]!, !o[1]!, !o[2]!"
+        set /A "v=o[1]&255"
+        set /A i=0
+        :l8
+            if !i! GEQ !o[2]! goto :mxl
+            set /A a=o[0]+i
+            set /A m[!a!]=v
+            set /A i+=1
+            goto :l8
+
+    :I42
+        call :WriteDebug "MEMCHR R!o[0]!, !o[1]!, !o[2]!"
+        set /A a=reg[!o[0]!]
+        set /A "v=o[1]&255"
+        set /A i=0
+        :l9
+            if !i! GEQ !o[2]! goto :o6
+            set /A b=a+i
+            if "!m[%b%]!"=="!v!" goto :o6
+            set /A i+=1
+            goto :l9
+        :o6
+        set /A reg[!o[0]!]=a+i
+        goto :mxl
+
+    :I43
+        call :WriteDebug "MEMSPN R!o[0]!, !o[1]!, !o[2]!"
+        for /L %%n in (0,1,255) do set t[%%n]=
+        set /A a=o[1]
+        :l10
+            set /A c=m[!a!]
+            if !c! EQU 0 goto :o7
+            set t[!c!]=1
+            set /A a+=1
+            goto :l10
+        :o7
+        set /A a=reg[!o[0]!]
+        set /A i=0
+        :l11
+            if !i! GEQ !o[2]! goto :o8
+            set /A b=a+i
+            set /A c=m[!b!]
+            if not defined t[!c!] goto :o8
+            set /A i+=1
+            goto :l11
+        :o8
+        set /A reg[!o[0]!]=a+i
+        goto :mxl
+
+    :I44
+        call :WriteDebug "MEMCMP !o[0]!, !o[1]!, !o[2]!"
+        set /A cc=_EQ
+        set /A i=0
+        :l12
+            if !i! GEQ !o[2]! goto :mxl
+            set /A a=o[0]+i
+            set /A b=o[1]+i
+            set /A a=m[!a!]
+            set /A b=m[!b!]
+            if !a! LSS !b! set /A cc=_LT
+            if !a! GTR !b! set /A cc=_GT
+            if !cc! NEQ !_EQ! goto :mxl
+            set /A i+=1
+            goto :l12
+
+    :I45
+        call :WriteDebug "HASH R!o[0]!, !o[1]!, !o[2]!"
+        set /A v=-1
+        set /A i=0
+        :l13
+            if !i! GEQ !o[2]! goto :o9
+            set /A a=o[1]+i
+            set /A "v^=m[!a!]"
+            for /L %%n in (1,1,8) do set /A "v=((v>>1)&2147483647)^(-306674912&-(v&1))"
+            set /A i+=1
+            goto :l13
+        :o9
+        set /A "reg[!o[0]!]=~v"
+        goto :mxl
+
+    :I46
+        call :WriteDebug "ITOA R!o[0]!, !o[1]!, !o[2]!"
+        set s=!o[2]!
+        set /A i=0
+        :l14
+            set c=!s:~%i%,1!
+            if "!c!"=="" goto :o10
+            set /A a=o[1]+i
+            if "!c!"=="-" (set /A m[!a!]=45) else set /A m[!a!]=48+c
+            set /A i+=1
+            goto :l14
+        :o10
+        set /A reg[!o[0]!]=i
+        goto :mxl
+
+    :I47
+        call :WriteDebug "ATOI R!o[0]!, !o[1]!, !o[2]!"
+        REM The number is accumulated as a negative value, to handle -2147483648.
+        set /A a=o[1]
+        set /A k=a+o[2]
+        set /A n=0
+        if !a! LSS !k! if "!m[%a%]!"=="45" set /A n=1
+        set /A a+=n
+        set /A v=0
+        set /A cc=0
+        if !a! LSS !k! set /A cc=_EQ
+        :l15
+            if !a! GEQ !k! goto :o11
+            set /A c=m[!a!]-48
+            if !c! LSS 0 goto :o12
+            if !c! GTR 9 goto :o12
+            if !v! LSS -214748364 goto :o12
+            set /A "b=-2147483647-1+c"
+            set /A "d=v*10"
+            if !v! EQU -214748364 if !d! LSS !b! goto :o12
+            set /A v=d-c
+            set /A a+=1
+            goto :l15
+        :o12
+        set /A cc=0
+        :o11
+        if !n! EQU 0 if !v! EQU -2147483648 set /A cc=0
+        if !cc! EQU 0 set /A v=0
+        if !n! EQU 0 set /A v=-v
+        set /A reg[!o[0]!]=v
+        goto :mxl
+
+    :I48
+        call :WriteDebug "BRK R!o[0]!, !o[1]!"
+        if !o[1]! GTR !ms! set /A ms=o[1]
+        set /A reg[!o[0]!]=ms
+        goto :mxl
+
+    :I49
+        REM Snapshot images are not supported.
+        call :WriteDebug "SNAP"
+        goto :mxl
+
+    :I50
+        REM Capturing the output of a command is not supported.
+        call :WriteDebug "RUNO R!o[0]!, !o[1]!, !o[2]!"
+        set /A reg[!o[0]!]=0
+        set /A cc=0
+        goto :mxl
+
+    :I51
+        REM Jobs are run to completion when they are started, and job[n] holds the exit status.
+        call :getS "!o[1]!" "!o[2]!"
+        call :WriteDebug "SPAWN R!o[0]!, !o[1]!, !o[2]! (%s%)"
+        %s%
+        set /A jn+=1
+        set /A job[!jn!]=!ERRORLEVEL!
+        set /A reg[!o[0]!]=jn
+        goto :mxl
+
+    :I52
+        call :WriteDebug "POLL R!o[0]!, !o[1]!"
+        goto :jdone
+
+    :I53
+        call :WriteDebug "WAIT R!o[0]!, !o[1]!"
+        :jdone
+        set /A v=0
+        if !o[1]! NEQ 0 (
+            if defined job[!o[1]!] set /A v=o[1]
+        ) else (
+            for /L %%k in (!jn!,-1,1) do if defined job[%%k] set /A v=%%k
+        )
+        set /A reg[!o[0]!]=v
+        goto :mxl
+
+    :I54
+        call :WriteDebug "STATUS R!o[0]!, !o[1]!"
+        set /A v=-1
+        if defined job[!o[1]!] set /A v=job[!o[1]!]
+        set job[!o[1]!]=
+        set /A reg[!o[0]!]=v
+        goto :mxl
+
+    :I55
+        REM Threads are not supported, so TSPAWN always fails.
+        call :WriteDebug "TSPAWN R!o[0]!, !o[1]!, !o[2]!"
+        set /A reg[!o[0]!]=0
+        goto :mxl
+
+    :I56
+        call :WriteDebug "TJOIN R!o[0]!, !o[1]!"
+        set /A reg[!o[0]!]=-1
+        goto :mxl
+
+    :I57
+        call :WriteDebug "CAS R!o[0]!, !o[1]!, !o[2]!"
+        set /A w=o[1]
+        call :atom
+        if !v! EQU !reg[%o[0]%]! (
+            set /A cc=_EQ
+            call :stw
+        ) else set /A cc=0
+        set /A reg[!o[0]!]=v
+        goto :mxl
+
+    :I58
+        call :WriteDebug "XADD R!o[0]!, !o[1]!"
+        set /A o[2]=o[1]
+        call :atom
+        set /A w=v+reg[!o[0]!]
+        call :stw
+        set /A reg[!o[0]!]=v
+        goto :mxl
+
+    :I59
+        REM File I/O (including input from stdin) is not supported, so FOPEN, FREAD and FWRITE always fail.
+        call :WriteDebug "FOPEN R!o[0]!, !o[1]!, !o[2]!"
+        set /A reg[!o[0]!]=-1
+        goto :mxl
+
+    :I60
+        call :WriteDebug "FCLOSE !o[0]!"
+        goto :mxl
+
+    :I61
+        call :WriteDebug "FREAD R!o[0]!, !o[1]!, !o[2]!"
+        set /A reg[!o[0]!]=-1
+        goto :mxl
+
+    :I62
+        call :WriteDebug "FWRITE R!o[0]!, !o[1]!, !o[2]!"
+        set /A reg[!o[0]!]=-1
+        goto :mxl
+
+    :I63
+        REM Performance counters are not supported.
+        call :WriteDebug "PERF R!o[0]!, !o[1]!"
+        set /A reg[!o[0]!]=0
+        goto :mxl
+
     :Ibad
         call :WriteDebug "Unsupported op0=%op0% @ pc=%pc%"
         set /A running=0
@@ -421,6 +722,31 @@ set /A running=1
 
 REM Helper functions.
 
+:atom
+  REM Load the word at o[2] into v (used by CAS and XADD).
+  set /A a=o[2]
+  set /A b0=m[%a%]
+  set /A a+=1
+  set /A b1=m[%a%]
+  set /A a+=1
+  set /A b2=m[%a%]
+  set /A a+=1
+  set /A b3=m[%a%]
+  set /A "v=b0|(b1<<8)|(b2<<16)|(b3<<24)"
+  exit /B 0
+
+:stw
+  REM Store w to the word at o[2].
+  set /A a=o[2]
+  set /A "m[%a%]=w&255"
+  set /A a+=1
+  set /A "m[%a%]=(w>>8)&255"
+  set /A a+=1
+  set /A "m[%a%]=(w>>16)&255"
+  set /A a+=1
+  set /A "m[%a%]=(w>>24)&255"
+  exit /B 0
+
 :WriteDebug
   echo DEBUG: %~1 1>&2
   exit /B 0
@@ -21,6 +21,22 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <time.h>
+#ifdef _WIN32
+#include <io.h>
+#include <process.h>
+#define getpid _getpid
+#define isatty _isatty
+#define popen _popen
+#define pclose _pclose
+#else
+#include <dirent.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <sys/wait.h>
+#include <unistd.h>
+#include <utime.h>
+#endif
 
 // Constants.
 #define _EQ 1
@@ -28,6 +44,7 @@
 #define _LE 3  // _LT | _EQ
 #define _GT 4
 #define _GE 5  // _GT | _EQ
+#define _PAGE 4096  // Snapshot image page size
 
 // Define the BS VM program. We use a packed string (3 characters per 2 bytes).
 const char p[]="?((((("  // DON'T MODIFY THIS LINE! IT IS REPLACED BY THE BUILD PROCESS!
@@ -37,19 +54,68 @@ const char p[]="?((((("  // DON'T MODIFY THIS LINE! IT IS REPLACED BY THE BUILD
 //  * nout - Number of output (or in/out) register operands.
 //  * ninr - Number of input register operands.
 //  * ninx - Number of "final" input operands (any operand kind).
+//  * nwr  - 1 if the instruction may write to memory (used by the ahead of time translation).
 //
-// OP:                                1 1 1 1 1 1 1 1 1 1 2 2 2 2 2 2 2 2 2 2 3 3
-//                0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
-const int nout[]={0,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,1,1,1,1,1,1,1,1,0,0,0,0},
-          ninr[]={0,0,1,1,2,2,0,0,0,0,0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1},
-          ninx[]={0,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,1,1,1,1};
+// OP:                                1 1 1 1 1 1 1 1 1 1 2 2 2 2 2 2 2 2 2 2 3 3 3 3 3 3 3 3 3 3 4 4 4 4 4 4 4 4 4 4 5 5 5 5 5 5 5 5 5 5 6 6 6 6
+//                0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3
+const int nout[]={0,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,1,1,1,1,1,1,1,1,0,0,0,0,0,0,0,0,0,0,1,0,0,0,1,1,0,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,0,1,1,1},
+          ninr[]={0,0,1,1,2,2,0,0,0,0,0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,2,2,2,2,2,2,0,2,2,2,1,1,2,1,1,1,0,0,1,1,0,0,0,1,0,1,0,1,0,1,1,0},
+          ninx[]={0,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,1,1,1,1},
+           nwr[]={0,0,0,0,1,1,0,1,0,0,0,0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,0,0,0,0,1,0,0,0,1,0,0,0,0,0,0,1,1,0,0,1,0,0};
 
 // Memory.
 unsigned char* m;
+int ms;  // Memory size
 
 // CPU state.
 int r[256],pc,cc;
 
+// Translated code (ahead-of-time compiled builds only).
+//
+//  * cm - Code map (non-zero for memory addresses that are covered by translated code).
+//  * ce - End of the translated code (zero when the translated code must not be used).
+unsigned char* cm;
+int ce=0;
+
+// Snapshot image (enabled with BSVM_IMAGE=<file>).
+//
+//  * img - Name of the image file (zero once the image has been restored or saved).
+//  * pid - Program identifier (CRC-32 of the packed program string).
+char* img;
+unsigned pid;
+
+// Output. The output is flushed on exit, before RUN, when the buffer is full, and after every print
+// if stdout is a TTY or if line buffering is forced with BSVM_LINEBUF=1.
+int lb;
+
+// Background jobs (SPAWN). The C VM runs each job to completion when it is started, so a job is
+// just a slot (handle 1-256) that holds the exit status until it has been read.
+//
+//  * ju - Non-zero for job handles that are in use.
+//  * jq - Exit status of each job.
+unsigned char ju[257];
+int jq[257];
+
+// Threads (TSPAWN). Threads are forked processes, and the memory is moved to a shared memory map
+// (that can not grow) when the first thread is started.
+//
+//  * sh - Non-zero once the memory is shared.
+int sh;
+
+// Number of executed instructions (PERF, only counted if the VM is built with counters enabled).
+long long ni;
+
+// Open files (FOPEN), by handle (3-255, since handles 0-2 are reserved for the standard streams, and
+// handle 0 is stdin).
+FILE* fh[256];
+
+// Result cache for RUN and RUNO (enabled with BSVM_CACHE=1, not supported on Windows).
+//
+//  * rcd - Cache directory (zero if the cache is disabled).
+//  * rcs - Maximum cache size in bytes (BSVM_CACHE_SIZE, 64 MiB by default).
+char* rcd;
+long long rcs;
+
 // Work variables.
 char* s=0;
 
@@ -60,13 +126,457 @@ int getI(int a){
   return ((int)m[a])|(((int)m[a+1])<<8)|(((int)m[a+2])<<16)|(((int)m[a+3])<<24);
 }
 
+int clip(int a,int l){
+  // Number of bytes of the memory range a..a+l-1 that are within the memory (0 if a is outside).
+  return a<0||a>=ms||l<=0?0:l<ms-a?l:ms-a;
+}
+
+void chkW(int a,int l){
+  // Stop using the translated code if a memory write hits it (e.g. self-modifying code).
+  for(;l>0&&a<ce;--l,++a)if(cm[a])ce=0;
+}
+
 void setI(int a,int v){
+  chkW(a,4);
   m[a]=v;
   m[a+1]=v>>8;
   m[a+2]=v>>16;
   m[a+3]=v>>24;
 }
 
+unsigned crc(const unsigned char* a,int l){
+  // CRC-32 (as used by zlib).
+  unsigned u=~0u;
+  int i;
+  for(;l>0;--l){
+    u^=*a++;
+    for(i=0;i<8;++i)u=(u>>1)^(0xedb88320u&-(u&1));
+  }
+  return ~u;
+}
+
+int zpage(int a){
+  // Check if a snapshot image page only contains zeros.
+  int i;
+  for(i=a;i<a+_PAGE&&i<ms;++i)if(m[i])return 0;
+  return 1;
+}
+
+void snap(int a){
+  // Save the VM state to the image file (unless it was restored from there), resuming at a. Only
+  // the memory pages that are not all zeros are saved. The image is written to a temporary file
+  // first, so that other VM instances never see a partial image.
+  int h[6],i,k;
+  char t[4096];
+  unsigned char z[_PAGE];
+  FILE* f;
+  if(!img||strlen(img)>4000)return;
+  h[0]=0x4d565342;  // "BSVM"
+  h[1]=pid;
+  h[2]=a;
+  h[3]=cc;
+  h[4]=ms;
+  for(h[5]=0,i=0;i<ms;i+=_PAGE)h[5]+=!zpage(i);
+  sprintf(t,"%s.%d",img,(int)getpid());
+  if((f=fopen(t,"wb"))){
+    k=fwrite(h,4,6,f)==6&&fwrite(r,4,256,f)==256;
+    for(i=0;k&&i<ms;i+=_PAGE){
+      if(zpage(i))continue;
+      memset(z,0,_PAGE);
+      memcpy(z,&m[i],i+_PAGE<ms?_PAGE:ms-i);
+      k=fwrite(&i,4,1,f)==1&&fwrite(z,1,_PAGE,f)==_PAGE;
+    }
+    if(fclose(f)||!k||(remove(img),rename(t,img)))remove(t);
+  }
+  img=0;
+}
+
+int restore(void){
+  // Restore the VM state from the image file, if there is one that was made from this program.
+  int h[6],v[256],a,k=0;
+  unsigned char z[_PAGE];
+  FILE* f=fopen(img,"rb");
+  if(!f)return 0;
+  if(fread(h,4,6,f)==6&&h[0]==0x4d565342&&(unsigned)h[1]==pid&&fread(v,4,256,f)==256){
+    if(h[4]>ms){
+      free(m);
+      ms=h[4];
+      m=calloc(ms,1);
+    }
+    for(k=m!=0;k&&h[5]>0;--h[5]){
+      k=fread(&a,4,1,f)==1&&fread(z,1,_PAGE,f)==_PAGE&&a>=0&&a<ms;
+      if(k)memcpy(&m[a],z,a+_PAGE<ms?_PAGE:ms-a);
+    }
+    if(k){
+      memcpy(r,v,sizeof(r));
+      pc=h[2];
+      cc=h[3];
+    }
+  }
+  fclose(f);
+  return k;
+}
+
+int sys(const char* c){
+  // Run a system command, and return its exit status.
+  int v=system(c);
+#ifdef _WIN32
+  return v;
+#else
+  return WIFEXITED(v)?WEXITSTATUS(v):-1;
+#endif
+}
+
+int thread(int a,int s){
+  // Start a thread at address a with the stack pointer s. Returns the handle of the thread (its
+  // process ID) in the calling thread, 0 in the new thread (which continues at a), and -1 if the
+  // thread could not be started.
+#ifdef _WIN32
+  return -1;
+#else
+  unsigned char* t;
+  int p;
+  if(!sh){
+    t=mmap(0,ms,PROT_READ|PROT_WRITE,MAP_SHARED|MAP_ANONYMOUS,-1,0);
+    if(t==MAP_FAILED)return -1;
+    memcpy(t,m,ms);
+    free(m);
+    m=t;
+    sh=1;
+  }
+  fflush(stdout);
+  p=fork();
+  if(!p){
+    r[255]=s;
+    pc=a;
+  }
+  return p;
+#endif
+}
+
+int join(int h){
+  // Wait for thread h to finish, and return its exit code (-1 if there is no such thread).
+#ifdef _WIN32
+  return -1;
+#else
+  int v;
+  return h>0&&waitpid(h,&v,0)==h&&WIFEXITED(v)?WEXITSTATUS(v):-1;
+#endif
+}
+
+int cas(int a,int x,int y){
+  // Atomic compare and swap: if the word at address a equals x, replace it with y. Returns the old
+  // value of the word. The atomic operations use GCC style builtins (on little endian hosts).
+#if defined(__GNUC__)&&defined(__BYTE_ORDER__)&&__BYTE_ORDER__==__ORDER_LITTLE_ENDIAN__
+  return __sync_val_compare_and_swap((int*)&m[a],x,y);
+#else
+  int v=getI(a);
+  if(v==x)setI(a,y);
+  return v;
+#endif
+}
+
+int xadd(int a,int x){
+  // Atomic fetch and add: add x to the word at address a. Returns the old value of the word.
+#if defined(__GNUC__)&&defined(__BYTE_ORDER__)&&__BYTE_ORDER__==__ORDER_LITTLE_ENDIAN__
+  return __sync_fetch_and_add((int*)&m[a],x);
+#else
+  int v=getI(a);
+  setI(a,v+x);
+  return v;
+#endif
+}
+
+// SHA-256 hash state (for the result cache keys, which are the same as in the Python VM).
+typedef struct{
+  unsigned int h[8];
+  unsigned char b[64];
+  unsigned long long n;
+}Sha;
+
+#define ROR(x,n) (((x)>>(n))|((x)<<(32-(n))))
+
+void shaBlock(unsigned int* h,const unsigned char* b){
+  // Process a 64-byte block.
+  static const unsigned int k[64]={
+    0x428a2f98,0x71374491,0xb5c0fbcf,0xe9b5dba5,0x3956c25b,0x59f111f1,0x923f82a4,0xab1c5ed5,
+    0xd807aa98,0x12835b01,0x243185be,0x550c7dc3,0x72be5d74,0x80deb1fe,0x9bdc06a7,0xc19bf174,
+    0xe49b69c1,0xefbe4786,0x0fc19dc6,0x240ca1cc,0x2de92c6f,0x4a7484aa,0x5cb0a9dc,0x76f988da,
+    0x983e5152,0xa831c66d,0xb00327c8,0xbf597fc7,0xc6e00bf3,0xd5a79147,0x06ca6351,0x14292967,
+    0x27b70a85,0x2e1b2138,0x4d2c6dfc,0x53380d13,0x650a7354,0x766a0abb,0x81c2c92e,0x92722c85,
+    0xa2bfe8a1,0xa81a664b,0xc24b8b70,0xc76c51a3,0xd192e819,0xd6990624,0xf40e3585,0x106aa070,
+    0x19a4c116,0x1e376c08,0x2748774c,0x34b0bcb5,0x391c0cb3,0x4ed8aa4a,0x5b9cca4f,0x682e6ff3,
+    0x748f82ee,0x78a5636f,0x84c87814,0x8cc70208,0x90befffa,0xa4506ceb,0xbef9a3f7,0xc67178f2};
+  unsigned int w[64],v[8],t,u;
+  int i;
+  for(i=0;i<16;++i)w[i]=(unsigned int)b[4*i]<<24|b[4*i+1]<<16|b[4*i+2]<<8|b[4*i+3];
+  for(;i<64;++i){
+    t=ROR(w[i-15],7)^ROR(w[i-15],18)^(w[i-15]>>3);
+    u=ROR(w[i-2],17)^ROR(w[i-2],19)^(w[i-2]>>10);
+    w[i]=w[i-16]+t+w[i-7]+u;
+  }
+  memcpy(v,h,sizeof(v));
+  for(i=0;i<64;++i){
+    t=v[7]+(ROR(v[4],6)^ROR(v[4],11)^ROR(v[4],25))+((v[4]&v[5])^(~v[4]&v[6]))+k[i]+w[i];
+    u=(ROR(v[0],2)^ROR(v[0],13)^ROR(v[0],22))+((v[0]&v[1])^(v[0]&v[2])^(v[1]&v[2]));
+    memmove(&v[1],&v[0],7*sizeof(*v));
+    v[4]+=t;
+    v[0]=t+u;
+  }
+  for(i=0;i<8;++i)h[i]+=v[i];
+}
+
+void shaInit(Sha* s){
+  static const unsigned int h[8]={
+    0x6a09e667,0xbb67ae85,0x3c6ef372,0xa54ff53a,0x510e527f,0x9b05688c,0x1f83d9ab,0x5be0cd19};
+  memcpy(s->h,h,sizeof(h));
+  s->n=0;
+}
+
+void shaAdd(Sha* s,const void* a,size_t l){
+  // Add l bytes at a to the hashed data.
+  const unsigned char* p=a;
+  for(;l>0;--l){
+    s->b[s->n++&63]=*p++;
+    if(!(s->n&63))shaBlock(s->h,s->b);
+  }
+}
+
+char* shaHex(Sha* s,char* x){
+  // Finish the hash, and store it at x as a hexadecimal string (65 bytes, including the zero
+  // terminator). Returns x.
+  unsigned long long n=s->n*8;
+  unsigned char z[8];
+  int i;
+  shaAdd(s,"\x80",1);
+  while((s->n&63)!=56)shaAdd(s,"",1);
+  for(i=0;i<8;++i)z[i]=(unsigned char)(n>>(56-8*i));
+  shaAdd(s,z,8);
+  for(i=0;i<8;++i)sprintf(&x[8*i],"%08x",s->h[i]);
+  return x;
+}
+
+char* ckey(const char* c){
+  // Name of the cache entry for the command c. The key is the SHA-256 hash of the command, the
+  // input files (BSVM_CACHE_FILES, separated by colons, with the hashes of their contents) and the
+  // environment variables (BSVM_CACHE_ENV, separated by commas), exactly as in the Python VM, so
+  // that the VMs share the cache entries (see spec/bsvm.md).
+  static char e[4200];
+  char b[4096],d[65],*x,*y,*n,*v;
+  size_t l;
+  FILE* f;
+  Sha k,h;
+  shaInit(&k);
+  shaAdd(&k,c,strlen(c));
+  for(x=getenv("BSVM_CACHE_FILES");x&&*x;x=y+(*y!=0)){
+    y=x+strcspn(x,":");
+    if(y==x)continue;
+    n=malloc(y-x+1);
+    memcpy(n,x,y-x);
+    n[y-x]=0;
+    strcpy(d,"-");
+    if((f=fopen(n,"rb"))){
+      shaInit(&h);
+      while((l=fread(b,1,sizeof(b),f))>0)shaAdd(&h,b,l);
+      fclose(f);
+      shaHex(&h,d);
+    }
+    shaAdd(&k,"",1);
+    shaAdd(&k,n,y-x+1);
+    shaAdd(&k,d,strlen(d));
+    free(n);
+  }
+  for(x=getenv("BSVM_CACHE_ENV");x&&*x;x=y+(*y!=0)){
+    y=x+strcspn(x,",");
+    if(y==x)continue;
+    n=malloc(y-x+1);
+    memcpy(n,x,y-x);
+    n[y-x]=0;
+    shaAdd(&k,"",1);
+    shaAdd(&k,n,y-x);
+    shaAdd(&k,"=",1);
+    if((v=getenv(n)))shaAdd(&k,v,strlen(v));
+    free(n);
+  }
+  sprintf(e,"%s/%s",rcd,shaHex(&k,d));
+  return e;
+}
+
+unsigned char* slurp(FILE* f,size_t* l){
+  // Read the rest of the file f into a new buffer, and return the buffer and its size (in l).
+  size_t k=65536;
+  unsigned char* b=malloc(k);
+  for(*l=0;b&&(*l+=fread(&b[*l],1,k-*l,f))==k;)b=realloc(b,k*=2);
+  return b;
+}
+
+void evict(void){
+  // Remove the least recently used cache entries until the cache is within its size limit.
+#ifndef _WIN32
+  char e[4400],o[4400];
+  DIR* d;
+  struct dirent* x;
+  struct stat t;
+  long long k;
+  time_t u=0;
+  do{
+    if(!(d=opendir(rcd)))return;
+    for(k=0,*o=0;(x=readdir(d));){
+      if(x->d_name[0]=='.')continue;
+      sprintf(e,"%s/%s",rcd,x->d_name);
+      if(stat(e,&t))continue;
+      k+=t.st_size;
+      if(!*o||t.st_mtime<u){
+        u=t.st_mtime;
+        strcpy(o,e);
+      }
+    }
+    closedir(d);
+  }while(k>rcs&&*o&&!remove(o));
+#endif
+}
+
+void mkdirs(char* d){
+  // Create the directory d and its parent directories (if they do not exist).
+#ifndef _WIN32
+  char* x;
+  for(x=d+1;*x;++x){
+    if(*x!='/')continue;
+    *x=0;
+    mkdir(d,0777);
+    *x='/';
+  }
+  mkdir(d,0777);
+#endif
+}
+
+int crun(const char* c,int a,int x,int* n){
+  // Run the command c through the result cache, and return its exit status. The output is stored
+  // at address a (at most x bytes, and n is set to the stored size), or it goes to stdout if a is
+  // negative. The command is only executed if its result is not already in the cache.
+  char* e=ckey(c),t[4300];
+  unsigned char* b=0;
+  size_t l=0;
+  int v=-1,k;
+  FILE* f=fopen(e,"rb");
+  if(f&&fscanf(f,"%d",&v)==1&&fgetc(f)=='\n'){
+    b=slurp(f,&l);
+    fclose(f);
+#ifndef _WIN32
+    utime(e,0);  // Mark the entry as recently used
+#endif
+  }else{
+    if(f)fclose(f);
+    v=-1;
+    if((f=popen(c,"r"))){
+      b=slurp(f,&l);
+      v=pclose(f);
+#ifndef _WIN32
+      v=WIFEXITED(v)?WEXITSTATUS(v):-1;
+#endif
+    }
+    if(b){
+      // Store the result in a temporary file first, so that other VM instances never see a partial
+      // cache entry.
+      mkdirs(rcd);
+      sprintf(t,"%s.%d",e,(int)getpid());
+      if((f=fopen(t,"wb"))){
+        k=fprintf(f,"%d\n",v)>0&&fwrite(b,1,l,f)==l;
+        if(fclose(f)||!k||rename(t,e))remove(t);
+      }
+      evict();
+    }
+  }
+  if(a<0){
+    if(l>0)fwrite(b,1,l,stdout);
+    fflush(stdout);
+  }else{
+    *n=x<=0?0:(size_t)x<l?x:(int)l;
+    if(*n>0)memcpy(&m[a],b,*n);
+  }
+  free(b);
+  return v;
+}
+
+void cinit(void){
+  // Set up the result cache, if it is enabled with BSVM_CACHE=1. The cache directory is
+  // ${XDG_CACHE_HOME}/bs/run (or ~/.cache/bs/run), or ~/Library/Caches/bs/run on macOS.
+#ifndef _WIN32
+  char* x=getenv("BSVM_CACHE"),*h=getenv("HOME");
+  int k=-1;
+  if(!x||!strcmp(x,"0"))return;
+  rcd=malloc(4096);
+#ifdef __APPLE__
+  if(h)k=snprintf(rcd,4096,"%s/Library/Caches/bs/run",h);
+#else
+  x=getenv("XDG_CACHE_HOME");
+  if(x&&*x)k=snprintf(rcd,4096,"%s/bs/run",x);
+  else if(h)k=snprintf(rcd,4096,"%s/.cache/bs/run",h);
+#endif
+  if(k<0||k>=4000){
+    free(rcd);
+    rcd=0;
+  }
+  x=getenv("BSVM_CACHE_SIZE");
+  rcs=x?atoll(x):1<<26;
+#endif
+}
+
+int fopn(const char* n,int x){
+  // Open the file n for reading (x=0), writing (x=1) or appending (x=2), and return its handle.
+  // With x=3 the size of the file is returned instead, and with x=4 the file is loaded into new
+  // memory at the end of the address space (the memory grows), and its address is returned.
+  // Returns -1 on failure.
+  FILE* f;
+  long l;
+  unsigned char* q;
+  int h=-1;
+  if(x<0||x>4||!(f=fopen(n,x==1?"wb":x==2?"ab":"rb")))return -1;
+  if(x<3){
+    for(h=3;h<256&&fh[h];++h);
+    if(h<256){
+      fh[h]=f;
+      return h;
+    }
+    h=-1;
+  }else if(!fseek(f,0,SEEK_END)&&(l=ftell(f))>=0&&l<0x7fffffff-ms){
+    if(x==3){
+      h=l;
+    }else if(!sh&&(q=realloc(m,ms+l))){
+      memset(&q[ms],0,l);
+      m=q;
+      rewind(f);
+      if(fread(&m[ms],1,l,f)==(size_t)l)h=ms;
+      ms+=l;
+    }
+  }
+  fclose(f);
+  return h;
+}
+
+int perf(int x){
+  // Read the performance counter x: the number of executed instructions (x=0), or the monotonic
+  // clock in microseconds (x=1) or in milliseconds (x=2). Returns the lowest 32 bits of the counter.
+  long long v=0;
+#ifdef _WIN32
+  if(x==1||x==2)v=(long long)clock()*(x==1?1000000:1000)/CLOCKS_PER_SEC;
+#else
+  struct timespec t;
+  if((x==1||x==2)&&!clock_gettime(CLOCK_MONOTONIC,&t))v=x==1?t.tv_sec*1000000LL+t.tv_nsec/1000:t.tv_sec*1000LL+t.tv_nsec/1000000;
+#endif
+  if(!x)v=ni;
+  return (int)(unsigned)v;
+}
+
+FILE* fget(int h,int a,int* l){
+  // Get the file with the handle h (stdin if h is 0), and clamp the length l of the memory range at
+  // address a to the memory size. Returns zero if the handle or the address is invalid.
+  if((h&&h<3)||h<0||h>255||a<0||a>ms)return 0;
+  if(*l>ms-a)*l=ms-a;
+  if(*l<0)*l=0;
+  return h?fh[h]:stdin;
+}
+
 void getS(int a,int l){
   // Extract the string from memory.
   free(s);
@@ -77,28 +587,53 @@ void getS(int a,int l){
 
 int main(int argc, char** argv){
   int i,k,n,v,a;
+  long long w;
+  FILE* f;
+  unsigned char t[256],*q;
 
-  // Create memory.
-  m=malloc(1<<20);
+  // Create memory (the initial size is given by BSVM_MEM, in bytes). Large allocations are backed
+  // lazily by the OS, so only the pages that are actually touched are allocated.
+  s=getenv("BSVM_MEM");
+  ms=s?atoi(s):1<<20;
+  m=calloc(ms,1);
+  s=0;
+
+  // Set up the input and output buffering.
+  lb=isatty(fileno(stdout))||((s=getenv("BSVM_LINEBUF"))&&strcmp(s,"0"));
+  s=0;
+  setvbuf(stdout,0,_IOFBF,65536);
+  setvbuf(stdin,0,_IOFBF,1<<20);
+
+  // Set up the RUN result cache.
+  cinit();
 
   // Clear execution state.
   pc=1;
   cc=0;
 
-  // Convert the packed string to bytes and store it in the memory.
-  v=(sizeof(p)*2)/3;
-  WriteDebug("prg_size=%d",v);
-  for(i=0;i<v/2;++i){
-    int c1=p[i*3]-40,    // 6 bits (0-63)
-        c2=p[i*3+1]-40,  // 5 bits (0-31)
-        c3=p[i*3+2]-40;  // 5 bits (0-31)
-    m[i*2+1]=(c1<<2)|(c2>>3);
-    m[i*2+2]=((c2&7)<<5)|c3;
-    WriteDebug("(c1,c2,c3)=(%d,%d,%d) -> (%d,%d)",c1,c2,c3,m[i*2+1],m[i*2+2]);
+  // Restore the VM state from the snapshot image (if any), or load the program.
+  img=getenv("BSVM_IMAGE");
+  pid=crc((const unsigned char*)p,sizeof(p)-1);
+  if(img&&restore()){
+    WriteDebug("Restored %s",img);
+    img=0;
+  }else{
+    // Convert the packed string to bytes and store it in the memory.
+    v=(sizeof(p)*2)/3;
+    WriteDebug("prg_size=%d",v);
+    for(i=0;i<v/2;++i){
+      int c1=p[i*3]-40,    // 6 bits (0-63)
+          c2=p[i*3+1]-40,  // 5 bits (0-31)
+          c3=p[i*3+2]-40;  // 5 bits (0-31)
+      m[i*2+1]=(c1<<2)|(c2>>3);
+      m[i*2+2]=((c2&7)<<5)|c3;
+      WriteDebug("(c1,c2,c3)=(%d,%d,%d) -> (%d,%d)",c1,c2,c3,m[i*2+1],m[i*2+2]);
+    }
   }
 
   // Main execution loop.
   int exit_code=1,running=1;
+  // AOT: BLOCKS
   while(running){
     // Read the next opcode.
     int pc0=pc,
@@ -112,6 +647,7 @@ int main(int argc, char** argv){
         op=op0&63;
 
     WriteDebug("PC=%d CC=%d OP=%d OP*=%d AT=%d",pc0,cc,op0,op,at);
+    ++ni;  // (counters only)
 
     // Read the operands.
     int o[4];
@@ -171,6 +707,7 @@ int main(int argc, char** argv){
 
     case 4: // STB
       WriteDebug("STB %d, %d, %d",o[0],o[1],o[2]);
+      chkW(o[1]+o[2],1);
       m[o[1]+o[2]]=o[0];
       break;
 
@@ -304,29 +841,286 @@ int main(int argc, char** argv){
       break;
 
     case 29: // PRINTLN
-      getS(o[0],o[1]);
-      WriteDebug("PRINTLN %d, %d (%s)",o[0],o[1],s);
-      printf("%s\n",s);
-      fflush(stdout);
+      WriteDebug("PRINTLN %d, %d",o[0],o[1]);
+      if(o[1]>0)fwrite(&m[o[0]],1,o[1],stdout);
+      putchar('\n');
+      if(lb)fflush(stdout);
       break;
 
     case 30: // PRINT
-      getS(o[0],o[1]);
-      WriteDebug("PRINT %d, %d (%s)",o[0],o[1],s);
-      printf("%s",s);
-      fflush(stdout);
+      WriteDebug("PRINT %d, %d",o[0],o[1]);
+      if(o[1]>0)fwrite(&m[o[0]],1,o[1],stdout);
+      if(lb)fflush(stdout);
       break;
 
     case 31: // RUN
       getS(o[0],o[1]);
       WriteDebug("RUN %d, %d (%s)",o[0],o[1],s);
-      system(s);
+      fflush(stdout);
+      if(rcd)crun(s,-1,0,&n);
+      else system(s);
+      break;
+
+    case 32: // CBEQ
+      WriteDebug("CBEQ %d, %d, %d",o[0],o[1],o[2]);
+      if(o[0]==o[1])pc=o[2];
+      break;
+
+    case 33: // CBNE
+      WriteDebug("CBNE %d, %d, %d",o[0],o[1],o[2]);
+      if(o[0]!=o[1])pc=o[2];
+      break;
+
+    case 34: // CBLT
+      WriteDebug("CBLT %d, %d, %d",o[0],o[1],o[2]);
+      if(o[0]<o[1])pc=o[2];
+      break;
+
+    case 35: // CBLE
+      WriteDebug("CBLE %d, %d, %d",o[0],o[1],o[2]);
+      if(o[0]<=o[1])pc=o[2];
+      break;
+
+    case 36: // CBGT
+      WriteDebug("CBGT %d, %d, %d",o[0],o[1],o[2]);
+      if(o[0]>o[1])pc=o[2];
+      break;
+
+    case 37: // CBGE
+      WriteDebug("CBGE %d, %d, %d",o[0],o[1],o[2]);
+      if(o[0]>=o[1])pc=o[2];
+      break;
+
+    case 38: // DBNZ
+      WriteDebug("DBNZ R%d, %d",o[0],o[1]);
+      if(--r[o[0]])pc=o[1];
+      break;
+
+    case 39: // MEMCPY
+      WriteDebug("MEMCPY %d, %d, %d",o[0],o[1],o[2]);
+      n=clip(o[0],o[2]);
+      if((k=clip(o[1],o[2]))<n)n=k;
+      chkW(o[0],n);
+      if(n>0)memcpy(&m[o[0]],&m[o[1]],n);
+      break;
+
+    case 40: // MEMMOVE
+      WriteDebug("MEMMOVE %d, %d, %d",o[0],o[1],o[2]);
+      n=clip(o[0],o[2]);
+      if((k=clip(o[1],o[2]))<n)n=k;
+      chkW(o[0],n);
+      if(n>0)memmove(&m[o[0]],&m[o[1]],n);
+      break;
+
+    case 41: // MEMSET
+      WriteDebug("MEMSET %d, %d, %d",o[0],o[1],o[2]);
+      n=clip(o[0],o[2]);
+      chkW(o[0],n);
+      if(n>0)memset(&m[o[0]],o[1],n);
+      break;
+
+    case 42: // MEMCHR
+      WriteDebug("MEMCHR R%d, %d, %d",o[0],o[1],o[2]);
+      a=r[o[0]];
+      n=o[2]<ms-a?o[2]:ms-a;
+      q=n>0?memchr(&m[a],o[1]&255,n):0;
+      r[o[0]]=q?q-m:a+o[2];
+      break;
+
+    case 43: // MEMSPN
+      WriteDebug("MEMSPN R%d, %d, %d",o[0],o[1],o[2]);
+      memset(t,0,256);
+      for(a=o[1];a<ms&&m[a];++a)t[m[a]]=1;
+      for(a=r[o[0]],k=a+o[2];a<k&&a<ms&&t[m[a]];++a);
+      r[o[0]]=a;
+      break;
+
+    case 44: // MEMCMP
+      WriteDebug("MEMCMP %d, %d, %d",o[0],o[1],o[2]);
+      a=clip(o[0],o[2]);
+      k=clip(o[1],o[2]);
+      n=a<k?a:k;
+      n=n>0?memcmp(&m[o[0]],&m[o[1]],n):0;
+      if(!n)n=a-k;  // A range that is cut short compares as shorter
+      cc=n?(n<0?_LT:_GT):_EQ;
+      break;
+
+    case 45: // HASH
+      WriteDebug("HASH R%d, %d, %d",o[0],o[1],o[2]);
+      n=clip(o[1],o[2]);
+      r[o[0]]=crc(n>0?&m[o[1]]:m,n);
+      break;
+
+    case 46: // ITOA
+      WriteDebug("ITOA R%d, %d, %d",o[0],o[1],o[2]);
+      n=sprintf((char*)t,"%d",o[2]);
+      chkW(o[1],n);
+      memcpy(&m[o[1]],t,n);
+      r[o[0]]=n;
+      break;
+
+    case 47: // ATOI
+      WriteDebug("ATOI R%d, %d, %d",o[0],o[1],o[2]);
+      a=o[1];
+      k=a+o[2];
+      n=a<k&&m[a]=='-';  // Negative?
+      a+=n;
+      v=a<k;  // Valid (i.e. at least one digit)?
+      for(w=0;v&&a<k;++a)v=m[a]>='0'&&m[a]<='9'&&(w=w*10+m[a]-'0')<=2147483647LL+n;
+      r[o[0]]=v?(int)(n?-w:w):0;
+      cc=v?_EQ:0;
+      break;
+
+    case 48: // BRK
+      WriteDebug("BRK R%d, %d",o[0],o[1]);
+      if(o[1]>ms&&!sh&&(q=realloc(m,o[1]))){
+        memset(&q[ms],0,o[1]-ms);
+        m=q;
+        ms=o[1];
+      }
+      r[o[0]]=ms;
+      break;
+
+    case 49: // SNAP
+      WriteDebug("SNAP");
+      snap(pc);
+      break;
+
+    case 50: // RUNO
+      q=memchr(&m[o[1]],0,ms-o[1]);
+      getS(o[1],q?q-&m[o[1]]:ms-o[1]);
+      WriteDebug("RUNO R%d, %d, %d (%s)",o[0],o[1],o[2],s);
+      fflush(stdout);
+
+      // Clamp the output size to the memory size (nothing is stored at an invalid address).
+      a=r[o[0]];
+      k=o[2];
+      if(a<0||a>ms)a=k=0;
+      if(k>ms-a)k=ms-a;
+      n=0;
+      cc=0;
+      if(rcd){
+        if(!crun(s,a,k,&n))cc=_EQ;
+      }else if((f=popen(s,"r"))){
+        if(k>0)n=fread(&m[a],1,k,f);
+        while(fread(t,1,sizeof(t),f));  // Discard the rest of the output
+        if(!pclose(f))cc=_EQ;
+      }
+      chkW(a,n);
+      r[o[0]]=n;
+      break;
+
+    case 51: // SPAWN
+      getS(o[1],o[2]);
+      WriteDebug("SPAWN R%d, %d, %d (%s)",o[0],o[1],o[2],s);
+      fflush(stdout);
+      for(k=1;k<257&&ju[k];++k);
+      if(k<257){
+        ju[k]=1;
+        jq[k]=sys(s);
+      }
+      r[o[0]]=k<257?k:0;
+      break;
+
+    case 52: // POLL
+      WriteDebug("POLL R%d, %d",o[0],o[1]);
+      for(k=o[1]?o[1]:1;!o[1]&&k<257&&!ju[k];++k);
+      r[o[0]]=k>0&&k<257&&ju[k]?k:0;
+      break;
+
+    case 53: // WAIT
+      WriteDebug("WAIT R%d, %d",o[0],o[1]);
+      for(k=o[1]?o[1]:1;!o[1]&&k<257&&!ju[k];++k);
+      r[o[0]]=k>0&&k<257&&ju[k]?k:0;
+      break;
+
+    case 54: // STATUS
+      WriteDebug("STATUS R%d, %d",o[0],o[1]);
+      k=o[1];
+      r[o[0]]=k>0&&k<257&&ju[k]?jq[k]:-1;
+      if(k>0&&k<257)ju[k]=0;
+      break;
+
+    case 55: // TSPAWN
+      WriteDebug("TSPAWN R%d, %d, %d",o[0],o[1],o[2]);
+      k=thread(o[2],o[1]);
+      if(k)r[o[0]]=k<0?0:k;
+      break;
+
+    case 56: // TJOIN
+      WriteDebug("TJOIN R%d, %d",o[0],o[1]);
+      r[o[0]]=join(o[1]);
+      break;
+
+    case 57: // CAS
+      WriteDebug("CAS R%d, %d, %d",o[0],o[1],o[2]);
+      k=cas(o[2],r[o[0]],o[1]);
+      cc=k==r[o[0]]?_EQ:0;
+      r[o[0]]=k;
+      chkW(o[2],4);
+      break;
+
+    case 58: // XADD
+      WriteDebug("XADD R%d, %d",o[0],o[1]);
+      r[o[0]]=xadd(o[1],r[o[0]]);
+      chkW(o[1],4);
+      break;
+
+    case 59: // FOPEN
+      q=memchr(&m[o[1]],0,ms-o[1]);
+      getS(o[1],q?q-&m[o[1]]:ms-o[1]);
+      WriteDebug("FOPEN R%d, %d, %d (%s)",o[0],o[1],o[2],s);
+      r[o[0]]=fopn(s,o[2]);
+      break;
+
+    case 60: // FCLOSE
+      WriteDebug("FCLOSE %d",o[0]);
+      if(o[0]>2&&o[0]<256&&fh[o[0]]){
+        fclose(fh[o[0]]);
+        fh[o[0]]=0;
+      }
+      break;
+
+    case 61: // FREAD
+      WriteDebug("FREAD R%d, %d, %d",o[0],o[1],o[2]);
+      a=r[o[0]];
+      n=o[2]<0?-o[2]:o[2];
+      if((f=fget(o[1],a,&n))){
+        if(o[2]<0){
+          // Read a line (including the newline).
+          for(k=0;k<n&&(v=getc(f))!=EOF;){
+            m[a+k++]=v;
+            if(v==10)break;
+          }
+          n=k;
+        }else{
+          n=fread(&m[a],1,n,f);
+        }
+        if(!n&&ferror(f))n=-1;
+        chkW(a,n);
+      }else{
+        n=-1;
+      }
+      r[o[0]]=n;
+      break;
+
+    case 62: // FWRITE
+      WriteDebug("FWRITE R%d, %d, %d",o[0],o[1],o[2]);
+      n=o[2];
+      f=fget(o[1],r[o[0]],&n);
+      r[o[0]]=f&&fwrite(&m[r[o[0]]],1,n,f)==(size_t)n?n:-1;
+      break;
+
+    case 63: // PERF
+      WriteDebug("PERF R%d, %d",o[0],o[1]);
+      r[o[0]]=perf(o[1]);
       break;
 
     default:
       WriteDebug("Unsupported op=%d @ pc=%d",op,pc);
       running=0;
     }
+    // AOT: DISPATCH
   }
 
   exit(exit_code);
@@ -38,15 +38,70 @@ class VM {
   #  * ninr - Number of input register operands.
   #  * ninx - Number of "final" input operands (any operand kind).
   #
-  # OP:                             1 1 1 1 1 1 1 1 1 1 2 2 2 2 2 2 2 2 2 2 3 3
-  #             0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
-  [Byte[]]$nout=0,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,1,1,1,1,1,1,1,1,0,0,0,0
-  [Byte[]]$ninr=0,0,1,1,2,2,0,0,0,0,0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1
-  [Byte[]]$ninx=0,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,1,1,1,1
+  # OP:                             1 1 1 1 1 1 1 1 1 1 2 2 2 2 2 2 2 2 2 2 3 3 3 3 3 3 3 3 3 3 4 4 4 4 4 4 4 4 4 4 5 5 5 5 5 5 5 5 5 5 6 6 6 6
+  #             0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3
+  [Byte[]]$nout=0,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,1,1,1,1,1,1,1,1,0,0,0,0,0,0,0,0,0,0,1,0,0,0,1,1,0,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,0,1,1,1
+  [Byte[]]$ninr=0,0,1,1,2,2,0,0,0,0,0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,2,2,2,2,2,2,0,2,2,2,1,1,2,1,1,1,0,0,1,1,0,0,0,1,0,1,0,1,0,1,1,0
+  [Byte[]]$ninx=0,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,1,1,1,1
 
   # Memory.
   [Byte[]]$m
 
+  # Background jobs (SPAWN), as processes keyed by job handle. At most njobs jobs (BSVM_JOBS, or
+  # the number of CPU cores by default) run at the same time.
+  [hashtable]$jobs=@{}
+  [Int32]$njobs=[Environment]::ProcessorCount
+  [Int32]$jn=0
+
+  [Int32]done([Int32]$h,[bool]$w){
+    # Return the handle of a finished job (job h, or any job if h is 0), or 0 if there is none. If
+    # w is true, wait until a job has finished (unless there are no such jobs).
+    while($true){
+      $k=@($this.jobs.Keys|Where-Object{($h -eq 0) -or ($_ -eq $h)}|Sort-Object)
+      foreach($x in $k){
+        if($this.jobs[$x].HasExited){return $x}
+      }
+      if((-not $w) -or ($k.Count -eq 0)){return 0}
+      Start-Sleep -Milliseconds 5
+    }
+    return 0
+  }
+
+  # Open files (FOPEN), as streams keyed by file handle (handles 0-2 are reserved for the standard
+  # streams, and stdin is added as handle 0 when it is first read).
+  [hashtable]$files=@{}
+  [Int32]$fn=2
+
+  [Int32]fopen([String]$n,[Int32]$x){
+    # Open the file n for reading (x=0), writing (x=1) or appending (x=2), and return its handle.
+    # With x=3 the size of the file is returned instead, and with x=4 the file is loaded into new
+    # memory at the end of the address space (the memory grows), and its address is returned.
+    # Returns -1 on failure.
+    try{
+      if($x -eq 3){return (New-Object System.IO.FileInfo $n).Length}
+      if($x -eq 4){
+        $t=[System.IO.File]::ReadAllBytes($n)
+        $a=$this.m.Length
+        $q=New-Object Byte[] ($a+$t.Length)
+        [Array]::Copy($this.m,$q,$a)
+        [Array]::Copy($t,0,$q,$a,$t.Length)
+        $this.m=$q
+        return $a
+      }
+      $f=switch($x){
+        0{[System.IO.File]::OpenRead($n)}
+        1{[System.IO.File]::Create($n)}
+        2{New-Object System.IO.FileStream $n,([System.IO.FileMode]::Append)}
+      }
+      if(-not $f){return -1}
+    }catch{
+      return -1
+    }
+    $this.fn++
+    $this.files[$this.fn]=$f
+    return $this.fn
+  }
+
   [Int32]getI([Int32]$a){
     return ([Int32]$this.m[$a]) -bor (([Int32]$this.m[$a+1]) -shl 8) -bor (([Int32]$this.m[$a+2]) -shl 16) -bor (([Int32]$this.m[$a+3]) -shl 24)
   }
@@ -58,6 +113,12 @@ class VM {
     $this.m[$a+3]=[Byte](($v -shr 24) -band 255)
   }
 
+  [Int32]clip([Int32]$a,[Int32]$l){
+    # Number of bytes of the memory range a..a+l-1 that are within the memory (0 if a is outside).
+    if(($a -lt 0) -or ($a -ge $this.m.Length) -or ($l -le 0)){return 0}
+    return [Math]::Min($l,$this.m.Length-$a)
+  }
+
   [string]getS([Int32]$a,[Int32]$l){
     $l2=[System.Text.Encoding]::UTF8.GetCharCount($this.m,$a,$l)
     [char[]]$utf8_chars=New-Object char[] $l2;
@@ -66,13 +127,16 @@ class VM {
   }
 
   [Int32]run([String]$p){
-    # Initialize the memory.
-    $this.m=New-Object Byte[] 1048576  # 1 MiB
+    # Initialize the memory (the initial size is given by BSVM_MEM, in bytes).
+    $ms=1048576  # 1 MiB
+    if($env:BSVM_MEM){$ms=[Int32]$env:BSVM_MEM}
+    $this.m=New-Object Byte[] $ms
 
     # Set the startup execution state.
     [Int32]$pc=1
     [Int32]$cc=0
     [Int32[]]$r=New-Object Int32[] 256
+    [Int64]$ni=0  # Number of executed instructions (PERF)
 
     # Convert the packed string to bytes and store it in the memory.
     $prg_size=($p.Length*2)/3
@@ -95,6 +159,7 @@ class VM {
       # Read the next opcode.
       $pc0=$pc
       $op0=$this.m[$pc++]
+      $ni++ # (counters only)
 
       # Decode the opcode:
       #   Bits 0-5: operation
@@ -313,6 +378,312 @@ class VM {
           Start-Process -Wait -FilePath $c -ArgumentList $a
         }
 
+        32{ # CBEQ
+          Write-Debug("CBEQ {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          if($o[0] -eq $o[1]){$pc=$o[2]}
+        }
+
+        33{ # CBNE
+          Write-Debug("CBNE {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          if($o[0] -ne $o[1]){$pc=$o[2]}
+        }
+
+        34{ # CBLT
+          Write-Debug("CBLT {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          if($o[0] -lt $o[1]){$pc=$o[2]}
+        }
+
+        35{ # CBLE
+          Write-Debug("CBLE {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          if($o[0] -le $o[1]){$pc=$o[2]}
+        }
+
+        36{ # CBGT
+          Write-Debug("CBGT {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          if($o[0] -gt $o[1]){$pc=$o[2]}
+        }
+
+        37{ # CBGE
+          Write-Debug("CBGE {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          if($o[0] -ge $o[1]){$pc=$o[2]}
+        }
+
+        38{ # DBNZ
+          Write-Debug("DBNZ R{0}, {1}" -f $o[0],$o[1])
+          $r[$o[0]]-=1
+          if($r[$o[0]] -ne 0){$pc=$o[1]}
+        }
+
+        39{ # MEMCPY
+          Write-Debug("MEMCPY {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $n=[Math]::Min($this.clip($o[0],$o[2]),$this.clip($o[1],$o[2]))
+          if($n -gt 0){[Array]::Copy($this.m,$o[1],$this.m,$o[0],$n)}
+        }
+
+        40{ # MEMMOVE
+          Write-Debug("MEMMOVE {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $n=[Math]::Min($this.clip($o[0],$o[2]),$this.clip($o[1],$o[2]))
+          if($n -gt 0){[Array]::Copy($this.m,$o[1],$this.m,$o[0],$n)}
+        }
+
+        41{ # MEMSET
+          Write-Debug("MEMSET {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $v=[Byte]($o[1] -band 255)
+          $n=$this.clip($o[0],$o[2])
+          for($i=0;$i -lt $n;$i++){$this.m[$o[0]+$i]=$v}
+        }
+
+        42{ # MEMCHR
+          Write-Debug("MEMCHR R{0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $a=$r[$o[0]]
+          $n=[Math]::Min($o[2],$this.m.Length-$a)
+          $k=-1
+          if($n -gt 0){$k=[Array]::IndexOf($this.m,[Byte]($o[1] -band 255),$a,$n)}
+          if($k -lt 0){$k=$a+$o[2]}
+          $r[$o[0]]=$k
+        }
+
+        43{ # MEMSPN
+          Write-Debug("MEMSPN R{0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $t=New-Object bool[] 256
+          for($a=$o[1];$this.m[$a] -ne 0;$a++){$t[$this.m[$a]]=$true}
+          $a=$r[$o[0]]
+          $k=$a+$o[2]
+          while(($a -lt $k) -and ($a -lt $this.m.Length) -and $t[$this.m[$a]]){$a++}
+          $r[$o[0]]=$a
+        }
+
+        44{ # MEMCMP
+          Write-Debug("MEMCMP {0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $n=$this.clip($o[0],$o[2])
+          $k=$this.clip($o[1],$o[2])
+          # A range that is cut short compares as shorter.
+          $cc=$this._EQ
+          if($n -lt $k){$cc=$this._LT}elseif($n -gt $k){$cc=$this._GT;$n=$k}
+          for($i=0;$i -lt $n;$i++){
+            $a=$this.m[$o[0]+$i]
+            $b=$this.m[$o[1]+$i]
+            if($a -ne $b){
+              if($a -lt $b){$cc=$this._LT}else{$cc=$this._GT}
+              break
+            }
+          }
+        }
+
+        45{ # HASH
+          Write-Debug("HASH R{0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          [Int64]$v=4294967295
+          $n=$this.clip($o[1],$o[2])
+          for($i=0;$i -lt $n;$i++){
+            $v=$v -bxor $this.m[$o[1]+$i]
+            for($k=0;$k -lt 8;$k++){
+              if($v -band 1){$v=($v -shr 1) -bxor 3988292384}else{$v=$v -shr 1}
+            }
+          }
+          $v=$v -bxor 4294967295
+          if($v -gt 2147483647){$v-=4294967296}
+          $r[$o[0]]=[Int32]$v
+        }
+
+        46{ # ITOA
+          Write-Debug("ITOA R{0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $t=[System.Text.Encoding]::ASCII.GetBytes([string]$o[2])
+          [Array]::Copy($t,0,$this.m,$o[1],$t.Length)
+          $r[$o[0]]=$t.Length
+        }
+
+        47{ # ATOI
+          Write-Debug("ATOI R{0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $a=$o[1]
+          $k=$a+$o[2]
+          $n=0
+          if(($a -lt $k) -and ($this.m[$a] -eq 45)){$n=1;$a++}
+          [Int64]$v=0
+          $cc=0
+          if($a -lt $k){$cc=$this._EQ}
+          for(;$a -lt $k;$a++){
+            $c=$this.m[$a]
+            if(($c -lt 48) -or ($c -gt 57)){$cc=0;break}
+            $v=$v*10+$c-48
+            if($v -gt 2147483647+$n){$cc=0;break}
+          }
+          if($cc -eq 0){$v=0}
+          if($n -eq 1){$v=-$v}
+          $r[$o[0]]=[Int32]$v
+        }
+
+        48{ # BRK
+          Write-Debug("BRK R{0}, {1}" -f $o[0],$o[1])
+          if($o[1] -gt $this.m.Length){
+            $t=New-Object Byte[] $o[1]
+            [Array]::Copy($this.m,$t,$this.m.Length)
+            $this.m=$t
+          }
+          $r[$o[0]]=$this.m.Length
+        }
+
+        49{ # SNAP (snapshot images are not supported)
+          Write-Debug("SNAP")
+        }
+
+        50{ # RUNO
+          for($k=$o[1];$this.m[$k] -ne 0;$k++){}
+          $str=$this.getS($o[1],$k-$o[1])
+          Write-Debug("RUNO R{0}, {1}, {2} ({3})" -f $o[0],$o[1],$o[2],$str)
+          $c=$str.Split(" ")[0]
+          $q=New-Object System.Diagnostics.Process
+          $q.StartInfo.FileName=$c
+          $q.StartInfo.Arguments=$str.Substring($c.Length).TrimStart()
+          $q.StartInfo.UseShellExecute=$false
+          $q.StartInfo.RedirectStandardOutput=$true
+          [void]$q.Start()
+          $t=New-Object System.IO.MemoryStream
+          $q.StandardOutput.BaseStream.CopyTo($t)
+          $q.WaitForExit()
+          $t=$t.ToArray()
+          $n=[Math]::Max([Math]::Min($t.Length,$o[2]),0)
+          [Array]::Copy($t,0,$this.m,$r[$o[0]],$n)
+          $r[$o[0]]=$n
+          $cc=0
+          if($q.ExitCode -eq 0){$cc=$this._EQ}
+        }
+
+        51{ # SPAWN
+          $str=$this.getS($o[1],$o[2])
+          Write-Debug("SPAWN R{0}, {1}, {2} ({3})" -f $o[0],$o[1],$o[2],$str)
+          if($env:BSVM_JOBS){$this.njobs=[Int32]$env:BSVM_JOBS}
+          while(@($this.jobs.Values|Where-Object{-not $_.HasExited}).Count -ge $this.njobs){
+            Start-Sleep -Milliseconds 5
+          }
+          $c=$str.Split(" ")[0]
+          $a=$str.Substring($c.Length).TrimStart()
+          if($a){
+            $q=Start-Process -PassThru -NoNewWindow -FilePath $c -ArgumentList $a
+          }else{
+            $q=Start-Process -PassThru -NoNewWindow -FilePath $c
+          }
+          $this.jn++
+          $this.jobs[$this.jn]=$q
+          $r[$o[0]]=$this.jn
+        }
+
+        52{ # POLL
+          Write-Debug("POLL R{0}, {1}" -f $o[0],$o[1])
+          $r[$o[0]]=$this.done($o[1],$false)
+        }
+
+        53{ # WAIT
+          Write-Debug("WAIT R{0}, {1}" -f $o[0],$o[1])
+          $r[$o[0]]=$this.done($o[1],$true)
+        }
+
+        54{ # STATUS
+          Write-Debug("STATUS R{0}, {1}" -f $o[0],$o[1])
+          $r[$o[0]]=-1
+          if($this.jobs.ContainsKey($o[1])){
+            $this.jobs[$o[1]].WaitForExit()
+            $r[$o[0]]=$this.jobs[$o[1]].ExitCode
+            $this.jobs.Remove($o[1])
+          }
+        }
+
+        55{ # TSPAWN (threads are not supported, so always fail)
+          Write-Debug("TSPAWN R{0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $r[$o[0]]=0
+        }
+
+        56{ # TJOIN
+          Write-Debug("TJOIN R{0}, {1}" -f $o[0],$o[1])
+          $r[$o[0]]=-1
+        }
+
+        57{ # CAS (there is only a single thread, so this is trivially atomic)
+          Write-Debug("CAS R{0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $v=$this.getI($o[2])
+          $cc=0
+          if($v -eq $r[$o[0]]){
+            $cc=$this._EQ
+            $this.setI($o[2],$o[1])
+          }
+          $r[$o[0]]=$v
+        }
+
+        58{ # XADD
+          Write-Debug("XADD R{0}, {1}" -f $o[0],$o[1])
+          $v=$this.getI($o[1])
+          $this.setI($o[1],$v+$r[$o[0]])
+          $r[$o[0]]=$v
+        }
+
+        59{ # FOPEN
+          for($k=$o[1];$this.m[$k] -ne 0;$k++){}
+          $str=$this.getS($o[1],$k-$o[1])
+          Write-Debug("FOPEN R{0}, {1}, {2} ({3})" -f $o[0],$o[1],$o[2],$str)
+          $r[$o[0]]=$this.fopen($str,$o[2])
+        }
+
+        60{ # FCLOSE
+          Write-Debug("FCLOSE {0}" -f $o[0])
+          if(($o[0] -gt 2) -and $this.files.ContainsKey($o[0])){
+            $this.files[$o[0]].Close()
+            $this.files.Remove($o[0])
+          }
+        }
+
+        61{ # FREAD
+          Write-Debug("FREAD R{0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $a=$r[$o[0]]
+          $r[$o[0]]=-1
+          if(($o[1] -eq 0) -and -not $this.files.ContainsKey(0)){
+            $this.files[0]=New-Object System.IO.BufferedStream ([Console]::OpenStandardInput()),1048576
+          }
+          if($this.files.ContainsKey($o[1])){
+            $f=$this.files[$o[1]]
+            $n=[Math]::Max([Math]::Min([Math]::Abs($o[2]),$this.m.Length-$a),0)
+            $k=0
+            if($o[2] -lt 0){
+              # Read a line (including the newline).
+              while($k -lt $n){
+                $v=$f.ReadByte()
+                if($v -lt 0){break}
+                $this.m[$a+$k]=$v
+                $k++
+                if($v -eq 10){break}
+              }
+            }else{
+              while($k -lt $n){
+                $v=$f.Read($this.m,$a+$k,$n-$k)
+                if($v -le 0){break}
+                $k+=$v
+              }
+            }
+            $r[$o[0]]=$k
+          }
+        }
+
+        62{ # FWRITE
+          Write-Debug("FWRITE R{0}, {1}, {2}" -f $o[0],$o[1],$o[2])
+          $a=$r[$o[0]]
+          $r[$o[0]]=-1
+          if(($o[1] -gt 2) -and $this.files.ContainsKey($o[1])){
+            $n=[Math]::Max([Math]::Min($o[2],$this.m.Length-$a),0)
+            $this.files[$o[1]].Write($this.m,$a,$n)
+            $r[$o[0]]=$n
+          }
+        }
+
+        63{ # PERF
+          Write-Debug("PERF R{0}, {1}" -f $o[0],$o[1])
+          [Int64]$v=0
+          if($o[1] -eq 0){$v=$ni}
+          if(($o[1] -eq 1) -or ($o[1] -eq 2)){
+            $v=[Int64]([Diagnostics.Stopwatch]::GetTimestamp()/([Diagnostics.Stopwatch]::Frequency/(1000000,1000)[$o[1]-1]))
+          }
+          $v=$v -band 0xffffffffL
+          if($v -gt 2147483647){$v-=4294967296L}
+          $r[$o[0]]=[Int32]$v
+        }
+
         default {
           Write-Debug("Unsupported op={0} @ pc={1}" -f $op, $pc)
           $running=$false
@@ -320,6 +691,8 @@ class VM {
       }
     }
 
+    # Close the files that are still open (so that their buffered data is written).
+    foreach($f in $this.files.Values){$f.Close()}
     return $exit_code
   }
 }
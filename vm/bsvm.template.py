@@ -20,18 +20,24 @@
 # -------------------------------------------------------------------------------------------------
 
 from __future__ import print_function
-import array,codecs,os,struct,sys
-
-# Ensure that we use UTF-8 encoding for stdout.
-sys.stdout=codecs.getwriter("utf8")(sys.stdout.detach() if sys.version_info[0]>=3 else sys.stdout)
+import array,atexit,binascii,io,mmap,os,struct,sys,time
 
 # Define the BS VM program. We use a packed string (3 characters per 2 bytes).
 p="?((((("  # DON'T MODIFY THIS LINE! IT IS REPLACED BY THE BUILD PROCESS!
 
+# CRC-32 of the program binary, for validating the optional bsvm.bin sidecar file.
+pb=0  # DON'T MODIFY THIS LINE! IT IS REPLACED BY THE BUILD PROCESS!
+
 # Constants.
 _EQ=1
 _LT=2
 _GT=4
+_HOT=16  # Number of entries before a block is compiled (tiered mode)
+_BLOCK_MAX=64  # Max number of instructions per compiled block
+_PAGE=4096  # Snapshot image page size
+_OUT_BUF=65536  # Output buffer size
+_IN_BUF=1<<20  # Input buffer size (stdin)
+_PROF_TOP=20  # Number of routines in the profile table
 
 # Instruction operand configuration (one element per instruction).
 #
@@ -39,16 +45,121 @@ _GT=4
 #  * ninr - Number of input register operands.
 #  * ninx - Number of "final" input operands (any operand kind).
 #
+# The first row of each table holds instructions 0-31, and the second row 32-63.
+#
 # OP:                     1 1 1 1 1 1 1 1 1 1 2 2 2 2 2 2 2 2 2 2 3 3
 #     0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
-nout=[0,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,1,1,1,1,1,1,1,1,0,0,0,0]
-ninr=[0,0,1,1,2,2,0,0,0,0,0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1]
-ninx=[0,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,1,1,1,1]
+#     3 3 3 3 3 3 3 3 4 4 4 4 4 4 4 4 4 4 5 5 5 5 5 5 5 5 5 5 6 6 6 6
+#     2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3
+nout=[0,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,1,1,1,1,1,1,1,1,0,0,0,0,
+      0,0,0,0,0,0,1,0,0,0,1,1,0,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,0,1,1,1]
+ninr=[0,0,1,1,2,2,0,0,0,0,0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,
+      2,2,2,2,2,2,0,2,2,2,1,1,2,1,1,1,0,0,1,1,0,0,0,1,0,1,0,1,0,1,1,0]
+ninx=[0,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,1,1,1,1,
+      1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,0,1,1,1,1,1,1,1,1,1,1,1,1,1,1]
+
+# Instruction semantics (one element per instruction), as lines of Python source code.
+#
+#  * {A} - Register number of the first leading register operand.
+#  * {B} - Register number of the second leading register operand.
+#  * {X} - Value of the final operand (any operand kind).
+#  * {N} - Address of the next instruction.
+#
+# Instructions that change the control flow end with a return statement that gives the new PC.
+# Stores that hit cached code return early, since the following code may have been modified.
+# Slice assignment reads the whole source range before writing, so MEMCPY is also overlap safe.
+sem=[
+	None,
+	["r[{A}]={X}"],  # MOV
+	["r[{A}]=m[r[{B}]+{X}]"],  # LDB
+	["r[{A}]=getI(r[{B}]+{X})"],  # LDW
+	["t=r[{B}]+{X}","m[t]=r[{A}]&255","if t<ce and inval(t,1):return {N}"],  # STB
+	["t=r[{B}]+{X}","setI(t,r[{A}])","if t<ce and inval(t,4):return {N}"],  # STW
+	["return {X}"],  # JMP
+	["t=r[255]-4","r[255]=t","setI(t,{N})","if t<ce:inval(t,4)","return {X}"],  # JSR
+	["t=r[255]","r[255]=t+4","return getI(t)"],  # RTS
+	["return {X} if cc&_EQ else {N}"],  # BEQ
+	["return {N} if cc&_EQ else {X}"],  # BNE
+	["return {X} if cc&_LT else {N}"],  # BLT
+	["return {X} if cc&(_LT|_EQ) else {N}"],  # BLE
+	["return {X} if cc&_GT else {N}"],  # BGT
+	["return {X} if cc&(_GT|_EQ) else {N}"],  # BGE
+	["t=r[{A}]","u={X}","cc=_EQ if t == u else (_LT if t < u else _GT)"],  # CMP
+	["t=r[255]-4","r[255]=t","setI(t,{X})","if t<ce and inval(t,4):return {N}"],  # PUSH
+	["t=r[255]","r[{A}]=getI(t)","r[255]=t+4"],  # POP
+	["r[{A}]+={X}"],  # ADD
+	["r[{A}]-={X}"],  # SUB
+	["r[{A}]*={X}"],  # MUL
+	["r[{A}]//={X}"],  # DIV
+	["r[{A}]%={X}"],  # MOD
+	["r[{A}]&={X}"],  # AND
+	["r[{A}]|={X}"],  # OR
+	["r[{A}]^={X}"],  # XOR
+	["r[{A}]<<={X}"],  # SHL
+	["r[{A}]>>={X}"],  # SHR
+	["exit_code={X}","running=False","return {N}"],  # EXIT
+	["put(r[{A}],{X},True)"],  # PRINTLN
+	["put(r[{A}],{X},False)"],  # PRINT
+	["run(bytes(m[r[{A}]:r[{A}]+max({X},0)]),False)"],  # RUN
+	["return {X} if r[{A}] == r[{B}] else {N}"],  # CBEQ
+	["return {X} if r[{A}] != r[{B}] else {N}"],  # CBNE
+	["return {X} if r[{A}] < r[{B}] else {N}"],  # CBLT
+	["return {X} if r[{A}] <= r[{B}] else {N}"],  # CBLE
+	["return {X} if r[{A}] > r[{B}] else {N}"],  # CBGT
+	["return {X} if r[{A}] >= r[{B}] else {N}"],  # CBGE
+	["t=r[{A}]-1","r[{A}]=t","return {X} if t else {N}"],  # DBNZ
+	["t=r[{A}]","v=r[{B}]","u=min(clip(t,{X}),clip(v,{X}))","m[t:t+u]=m[v:v+u]",  # MEMCPY
+		"if t<ce and inval(t,min(u,ce-t)):return {N}"],
+	["t=r[{A}]","v=r[{B}]","u=min(clip(t,{X}),clip(v,{X}))","m[t:t+u]=m[v:v+u]",  # MEMMOVE
+		"if t<ce and inval(t,min(u,ce-t)):return {N}"],
+	["t=r[{A}]","u=clip(t,{X})","m[t:t+u]=bytearray([r[{B}]&255])*u",  # MEMSET
+		"if t<ce and inval(t,min(u,ce-t)):return {N}"],
+	["t=r[{A}]","u=m.find(bytearray([r[{B}]&255]),t,t+{X})",  # MEMCHR
+		"r[{A}]=u if u >= 0 else t+{X}"],
+	["t=r[{A}]","r[{A}]=t+span(t,r[{B}],{X})"],  # MEMSPN
+	["t=r[{A}]","u=r[{B}]","x=m[t:t+clip(t,{X})]","y=m[u:u+clip(u,{X})]",  # MEMCMP
+		"cc=_EQ if x == y else (_LT if x < y else _GT)"],
+	["r[{A}]=crc(r[{B}],{X})"],  # HASH
+	["t=str((({X}+(1<<31))&0xffffffff)-(1<<31)).encode()","u=r[{B}]",  # ITOA
+		"m[u:u+len(t)]=t","r[{A}]=len(t)","if u<ce and inval(u,len(t)):return {N}"],
+	["t=atoi(r[{B}],{X})","cc=0 if t is None else _EQ","r[{A}]=t or 0"],  # ATOI
+	["r[{A}]=grow({X})","return {N}"],  # BRK
+	["snap({N})"],  # SNAP
+	["t=r[{A}]","u=r[{B}]","u,v=run(cstr(u),True)","v=v[:max(min({X},len(m)-t),0)]",  # RUNO
+		"m[t:t+len(v)]=v","r[{A}]=len(v)","cc=0 if u else _EQ",
+		"if t<ce and inval(t,len(v)):return {N}"],
+	["r[{A}]=spawn(bytes(m[r[{B}]:r[{B}]+max({X},0)]))"],  # SPAWN
+	["r[{A}]=done({X},False)"],  # POLL
+	["r[{A}]=done({X},True)"],  # WAIT
+	["r[{A}]=status({X})"],  # STATUS
+	["r[{A}]=thread({X},r[{B}])","return {N}"],  # TSPAWN
+	["r[{A}]=join({X})"],  # TJOIN
+	["t={X}","u=r[{A}]","v=cas(t,u,r[{B}])","r[{A}]=v","cc=_EQ if v == u else 0",  # CAS
+		"if t<ce and inval(t,4):return {N}"],
+	["t={X}","r[{A}]=xadd(t,r[{A}])","if t<ce and inval(t,4):return {N}"],  # XADD
+	["t=r[{B}]","r[{A}]=fopen(cstr(t),{X})","return {N}"],  # FOPEN
+	["fclose({X})"],  # FCLOSE
+	["t=r[{A}]","u=fread(r[{B}],t,{X})","r[{A}]=u",  # FREAD
+		"if t<ce and u>0 and inval(t,min(u,ce-t)):return {N}"],
+	["r[{A}]=fwrite(r[{B}],r[{A}],{X})"],  # FWRITE
+	["r[{A}]=perf({X})"],  # PERF
+]
+
+# Raised (in asynchronous mode only) by instructions that have to wait for the host, with what to
+# wait for as the argument: ("run",c) for running the command c (see BSVM.complete), ("read",n) for
+# reading at most n bytes of input, or ("poll",) for letting time pass while background jobs are
+# running. Nothing has been changed by the instruction when it raises Wait, so it is simply
+# executed again when the VM is resumed.
+class Wait(Exception):
+	pass
 
 # Helper functions.
 def WriteDebug(s):
 	print("DEBUG: " + s, file=sys.stderr)
 
+# Monotonic clock, in seconds.
+clock=getattr(time,"monotonic",time.time)
+
 def getI(a):
 	return struct.unpack_from("<l",m,a)[0]
 
@@ -59,229 +170,1148 @@ def getS(a,l):
 	# Extract the string from memory.
 	return m[a:(a+l)].decode("utf8")
 
-# Create RAM.
-m=bytearray(1<<20)
-
-# Clear execution state.
-pc=1
-cc=0
-r=array.array('l',(0 for i in range(0,256)))
-
-# Convert the packed string to bytes and store it in the memory.
-v=(len(p)*2)//3
-WriteDebug("prg_size={}".format(v))
-for i in range(0,v//2):
-	c1=ord(p[i*3])-40    # 6 bits (0-63)
-	c2=ord(p[i*3+1])-40  # 5 bits (0-31)
-	c3=ord(p[i*3+2])-40  # 5 bits (0-31)
-	b1=(c1<<2)|(c2>>3)
-	b2=((c2&7)<<5)|c3
-	m[i*2+1]=b1
-	m[i*2+2]=b2
-	WriteDebug("(c1,c2,c3)=({},{},{}) -> ({},{})".format(c1,c2,c3,b1,b2))
-
-# Main execution loop.
-exit_code=1
-running=True
-while running:
-	# Read the next opcode.
-	pc0=pc
-	op0=m[pc]
-	pc+=1
-
-	# Decode the opcode:
-	#   Bits 0-5: operation
-	#   Bits 6-7: argument type
-	at=op0>>6
+def clip(a,l):
+	# Number of bytes of the memory range a..a+l-1 that are within the memory (0 if a is outside).
+	return max(min(l,len(m)-a),0) if a >= 0 else 0
+
+def cstr(a):
+	# Extract the zero terminated string at address a from memory, as bytes (up to the end of the
+	# memory if there is no terminator).
+	e=m.find(b"\0",a)
+	return bytes(m[a:e if e >= 0 else len(m)])
+
+def put(a,l,nl):
+	# Write the memory range a..a+l-1 (and a newline if nl is True) to stdout, as raw bytes.
+	ob.extend(m[a:a+max(l,0)])
+	if nl:
+		ob.extend(b"\n")
+	if lb or len(ob) >= _OUT_BUF:
+		flush()
+
+def flush():
+	# Flush the output buffer.
+	if ob:
+		wr(bytes(ob))
+		del ob[:]
+
+def wr(s):
+	# Write s (bytes) to the output, i.e. to the output callback if there is one, or to stdout.
+	if oc:
+		oc(s)
+	else:
+		out.write(s)
+		out.flush()
+
+def run(c,o):
+	# Run the command c (bytes), and return its exit status and its output (if o is True, otherwise
+	# the output goes to stdout). When the result cache is enabled, the command is only executed if
+	# its result is not already in the cache. With an output callback, or in asynchronous mode, the
+	# output is always captured (and passed to the callback).
+	if rc is None:
+		if aq is None and (o or not oc):
+			return execute(c,o)
+		v,t=capture(c)
+	else:
+		n=os.path.join(rc[0],key(c))
+		try:
+			with open(n,"rb") as f:
+				v,t=f.read().split(b"\n",1)
+			v=int(v)
+			os.utime(n,None)
+		except (IOError,OSError,ValueError):
+			v,t=capture(c)
+			store(n,v,t)
+	if not o:
+		flush()
+		wr(t)
+	return v,t
+
+def capture(c):
+	# Execute the command c (bytes), and return its exit status and its output. In asynchronous
+	# mode, the host executes the command instead (see Wait).
+	if aq is None:
+		return execute(c,True)
+	if c not in aq:
+		flush()
+		raise Wait(("run",c))
+	return aq.pop(c)
+
+def pause():
+	# Wait a moment (for background jobs). In asynchronous mode, the host does the waiting instead.
+	if aq is not None:
+		raise Wait(("poll",))
+	time.sleep(0.005)
+
+def status(h):
+	# Wait for job h to finish, release its handle and return its exit status (-1 if there is no
+	# such job).
+	if aq is not None and h in jobs and jobs[h].poll() is None:
+		raise Wait(("poll",))
+	t=jobs.pop(h,None)
+	return -1 if t is None else t.wait()
+
+def key(c):
+	# Cache key for the command c: a hash of the command, the input files (with the hashes of their
+	# contents) and the environment variables that are selected by the cache configuration.
+	import hashlib
+	k=hashlib.sha256(c)
+	for x in rc[1]:
+		try:
+			with open(x,"rb") as f:
+				d=hashlib.sha256(f.read()).hexdigest()
+		except (IOError,OSError):
+			d="-"
+		k.update("\0{}\0{}".format(x,d).encode("utf8"))
+	for x in rc[2]:
+		k.update("\0{}={}".format(x,os.environ.get(x,"")).encode("utf8"))
+	return k.hexdigest()
+
+def store(n,v,t):
+	# Store the exit status v and the output t in the cache entry n, and then evict the least
+	# recently used entries until the cache is within its size limit. Errors are ignored (the
+	# result is simply not cached).
+	try:
+		if not os.path.isdir(rc[0]):
+			os.makedirs(rc[0])
+		x="{}.{}".format(n,os.getpid())
+		with open(x,"wb") as f:
+			f.write(str(v).encode()+b"\n"+t)
+		os.rename(x,n)
+		e=[]
+		for x in os.listdir(rc[0]):
+			x=os.path.join(rc[0],x)
+			s=os.stat(x)
+			e.append((s.st_mtime,s.st_size,x))
+		k=sum(x[1] for x in e)
+		for x in sorted(e):
+			if k <= rc[3]:
+				break
+			os.remove(x[2])
+			k-=x[1]
+	except (IOError,OSError):
+		pass
+
+def execute(c,o):
+	# Execute the command c (bytes), and return its exit status and its output (if o is True,
+	# otherwise the output goes to stdout). Simple commands are executed directly, and other
+	# commands are sent to the shell co-process (when available).
+	import re,shlex,shutil,subprocess
+	flush()
+	x=subprocess.PIPE if o else None
+	try:
+		a=None
+		if co is not None and not re.search(b"[^\\w@%+=:,./ \t\"'-]",c):
+			a=shlex.split(c.decode("utf8"))
+	except ValueError:
+		a=None
+	if a and "=" not in a[0] and shutil.which(a[0]):
+		p=subprocess.Popen(a,stdout=x)
+	elif co is None:
+		p=subprocess.Popen(c,shell=True,stdout=x)
+	else:
+		if not co:
+			shell()
+		t=b" >"+quote(co[2].encode()) if o else b""
+		co[0].write(b"(eval "+quote(c)+b")"+t+b";echo $? >&"+co[3]+b"\n")
+		co[0].flush()
+		v=int(co[1].readline() or 127)
+		if not o:
+			return v,b""
+		with open(co[2],"rb") as f:
+			return v,f.read()
+	v=p.communicate()[0]
+	return p.returncode,v or b""
+
+def quote(s):
+	# Quote a string for the shell.
+	return b"'"+s.replace(b"'",b"'\\''")+b"'"
+
+def shell():
+	# Start the shell co-process. The shell reads its script (the commands) from a pipe, so that the
+	# commands still inherit stdin, and it reports the exit status of each command over another
+	# pipe. The output of captured commands goes through a temporary file.
+	import subprocess,tempfile
+	a,b=os.pipe()
+	c,d=os.pipe()
+	e,f=tempfile.mkstemp()
+	os.close(e)
+	atexit.register(os.remove,f)
+	subprocess.Popen(["/bin/sh","/dev/fd/{}".format(a)],pass_fds=(a,d))
+	os.close(a)
+	os.close(d)
+	co[:]=[os.fdopen(b,"wb"),os.fdopen(c,"rb"),f,str(d).encode()]
+
+def spawn(c):
+	# Start the command c (bytes) in the background, and return its job handle. If the maximum
+	# number of jobs are already running, wait for one of them to finish first.
+	global jn
+	import subprocess
+	flush()
+	while sum(1 for x in jobs.values() if x.poll() is None) >= nj:
+		pause()
+	jn+=1
+	jobs[jn]=subprocess.Popen(c,shell=True)
+	return jn
+
+def done(h,w):
+	# Return the handle of a finished job (job h, or any job if h is 0), or 0 if there is none. If
+	# w is True, wait until a job has finished (unless there are no such jobs).
+	while True:
+		k=[h] if h in jobs else ([] if h else sorted(jobs))
+		for x in k:
+			if jobs[x].poll() is not None:
+				return x
+		if not w or not k:
+			return 0
+		pause()
+
+def thread(a,s):
+	# Start a thread at address a with the stack pointer s, and return its handle (the process ID
+	# of the thread, or 0 if threads are not supported). Threads are forked processes, and the
+	# memory is moved to a shared memory map (that can not grow) when the first thread is started.
+	# The thread starts with a copy of the registers, and it runs until it executes EXIT. Python 2
+	# is not supported, since indexing a memory map gives strings rather than integers there.
+	global m,pc,th,lk,jobs,co,aq
+	if not hasattr(os,"fork") or sys.version_info[0]<3:
+		return 0
+	if th is None:
+		import multiprocessing
+		t=mmap.mmap(-1,len(m))
+		t[:]=m[:]
+		m=t
+		th=set()
+		lk=multiprocessing.Lock()
+	flush()
+	p=os.fork()
+	if p:
+		th.add(p)
+		return p
+
+	# This is the new thread. Run it until it exits, and then end the process.
+	r[255]=s
+	pc=a
+	th=set()
+	jobs={}
+	co=None if co is None else []
+	aq=None
+	try:
+		loop(-1)
+	except BaseException:
+		import traceback
+		traceback.print_exc()
+	flush()
+	os._exit(exit_code&255)
+
+def join(h):
+	# Wait for thread h to finish, and return its exit code (-1 if there is no such thread).
+	if not th or h not in th:
+		return -1
+	p,v=os.waitpid(h,0 if aq is None else os.WNOHANG)
+	if p == 0:
+		raise Wait(("poll",))
+	th.discard(h)
+	return os.WEXITSTATUS(v) if os.WIFEXITED(v) else -1
+
+def cas(a,x,y):
+	# Atomic compare and swap: if the word at address a equals x, replace it with y. Returns the old
+	# value of the word.
+	if lk:
+		lk.acquire()
+	try:
+		v=getI(a)
+		if v == x:
+			setI(a,((y+(1<<31))&0xffffffff)-(1<<31))
+	finally:
+		if lk:
+			lk.release()
+	return v
+
+def xadd(a,x):
+	# Atomic fetch and add: add x to the word at address a. Returns the old value of the word.
+	if lk:
+		lk.acquire()
+	try:
+		v=getI(a)
+		setI(a,((v+x+(1<<31))&0xffffffff)-(1<<31))
+	finally:
+		if lk:
+			lk.release()
+	return v
+
+def fopen(n,x):
+	# Open the file n (bytes) for reading (x=0), writing (x=1) or appending (x=2), and return its
+	# handle. With x=3 the size of the file is returned instead, and with x=4 the file is loaded
+	# into new memory at the end of the address space (the memory grows), and its address is
+	# returned. Returns -1 on failure.
+	global fn
+	try:
+		if x == 3:
+			return os.path.getsize(n)
+		if x == 4:
+			with open(n,"rb") as f:
+				t=len(m)
+				l=os.fstat(f.fileno()).st_size
+				if grow(t+l) < t+l or readinto(f,t,l) != l:
+					return -1
+				return t
+		f=open(n,"rb") if x == 0 else open(n,("wb","ab")[x-1],0)
+	except (IndexError,IOError,OSError):
+		return -1
+	fn+=1
+	fh[fn]=f
+	return fn
+
+def fclose(h):
+	# Close the file with the handle h (the standard streams are not closed).
+	f=fh.pop(h,None) if h > 2 else None
+	if f:
+		try:
+			f.close()
+		except (IOError,OSError):
+			pass
+
+def fread(h,a,l):
+	# Read at most l bytes from the file with the handle h (stdin if h is 0) to the memory at
+	# address a. If l is negative, read a line of at most -l bytes (including the newline) instead.
+	# Returns the number of bytes that were read (0 at the end of the file), or -1 on failure.
+	if a < 0:
+		return -1
+	if h == 0 and (ci is not None or aq is not None):
+		return iread(a,l)
+	try:
+		f=fh.get(h) if h else stdin()
+		if f is None:
+			return -1
+		if l < 0:
+			t=f.readline(min(-l,len(m)-a))
+			m[a:a+len(t)]=t
+			return len(t)
+		return readinto(f,a,l)
+	except (IOError,OSError,ValueError):
+		return -1
+
+def fwrite(h,a,l):
+	# Write the memory range a..a+l-1 to the file with the handle h. Returns the number of bytes
+	# that were written, or -1 on failure.
+	f=fh.get(h)
+	if f is None or a < 0:
+		return -1
+	t=m[a:a+max(l,0)]
+	try:
+		f.write(t)
+	except (IOError,OSError,ValueError):
+		return -1
+	return len(t)
+
+def stdin():
+	# Return the reader for stdin (handle 0). It is created on demand (e.g. after the fork server
+	# has taken over the stdin of the client), with a large buffer for streaming input.
+	f=fh.get(0)
+	if f is None:
+		f=fh[0]=io.open(sys.stdin.fileno(),"rb",_IN_BUF,closefd=False)
+	return f
+
+def iread(a,l):
+	# Read from the program input (handle 0) through the input buffer, like fread.
+	n=max(min(-l if l < 0 else l,len(m)-a),0)
+	while not ie and len(ib) < n and (l >= 0 or b"\n" not in ib):
+		fill(n)
+	t=ib[:n]
+	if l < 0:
+		t=t[:t.find(b"\n")+1 or n]
+	del ib[:len(t)]
+	m[a:a+len(t)]=t
+	return len(t)
+
+def fill(n):
+	# Add more input (at least n bytes are requested) to the input buffer, from the input callback.
+	# In asynchronous mode, the host reads the input instead, so that a VM that waits for input
+	# never blocks the other VMs (the input is only consumed by the program once it is complete, so
+	# the instruction can simply be executed again).
+	global ie
+	if aq is None:
+		t=ci(max(n,_IN_BUF))
+	elif "read" in aq:
+		t=aq.pop("read")[1]
+	else:
+		flush()
+		raise Wait(("read",max(n,_IN_BUF)))
+	ib.extend(t)
+	ie=not t
+
+def readinto(f,a,l):
+	# Read at most l bytes from the file f directly into the memory at address a (no copying).
+	return f.readinto(memoryview(m)[a:a+max(l,0)]) or 0
+
+def perf(x):
+	# Read the performance counter x: the number of executed instructions (x=0, only counted if the
+	# VM was built with counters enabled), or the monotonic clock in microseconds (x=1) or in
+	# milliseconds (x=2). Returns the lowest 32 bits of the counter (0 for an invalid counter).
+	if x == 0:
+		v=ni
+	elif x in (1,2):
+		v=int(clock()*(1000000 if x == 1 else 1000))
+	else:
+		v=0
+	return ((v+(1<<31))&0xffffffff)-(1<<31)
+
+def stats():
+	# Write the instruction statistics to the file st, as JSON: the total number of executed
+	# instructions, the wall time (in seconds), the number of instructions per second, and the
+	# number of times that each full opcode byte (OP + AT) and each pair of consecutive full opcode
+	# bytes was executed, most frequent first. Only the instructions of the main thread are counted.
+	import json
+	t=clock()-t0
+	n=sum(sc)
+	d={"instructions":n,"time":t,"ips":n/t if t > 0 else 0,
+		"ops":sorted(([x,c] for x,c in enumerate(sc) if c),key=lambda x:-x[1]),
+		"pairs":sorted(([x>>8,x&255,c] for x,c in enumerate(sq) if c and x > 255),
+			key=lambda x:-x[2])}
+	with open(st,"w") as f:
+		json.dump(d,f)
+
+def tick():
+	# Attribute the instructions and the time since the last tick to the current call stack.
+	global pl,tl
+	t=clock()
+	v=pp.get(ps)
+	if v is None:
+		v=pp[ps]=[0,0.0]
+	v[0]+=pn-pl
+	v[1]+=t-tl
+	pl=pn
+	tl=t
+
+def call(a,n):
+	# JSR to the routine at address a, that returns to address n: push it to the shadow call stack.
+	global ps
+	tick()
+	cs.append(n)
+	ps+=(a,)
+
+def ret(a):
+	# RTS to address a: pop the routine that returns to a from the shadow call stack, along with any
+	# routines that were called by it (i.e. that were left without RTS). An RTS that does not match
+	# any routine in the shadow call stack (e.g. if the return address has been changed) is ignored.
+	global ps
+	i=len(cs)-1
+	while i >= 0 and cs[i] != a:
+		i-=1
+	if i >= 0:
+		tick()
+		del cs[i:]
+		ps=ps[:i+1]
+
+def symbols():
+	# Return the labels from the symbol file (bsvm.sym, see build.py --sym) as a sorted list of
+	# (address, name) tuples, or an empty list if there is no symbol file for the program.
+	try:
+		with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),"bsvm.sym")) as f:
+			d=f.read().split("\n")
+	except EnvironmentError:
+		return []
+	if pg is not None or d[0] != str(pb):
+		return []
+	return sorted((int(x[0]),x[1]) for x in (y.split(" ",1) for y in d[1:] if y))
+
+def profile():
+	# Write the profile to the file pr, as collapsed call stacks for flamegraph tools (one line per
+	# call stack: the routine names separated by semicolons, and the number of instructions that
+	# were executed in the last routine), and print a table of the routines with the most exclusive
+	# instructions to stderr. A routine is named after the label at its address (or the closest
+	# label before it) if there is a symbol file, or after its address otherwise.
+	import bisect
+	tick()
+	y=symbols()
+	k=[x[0] for x in y]
+	nm={}
+	for p in pp:
+		for a in p:
+			i=bisect.bisect_right(k,a)-1
+			if i < 0:
+				nm[a]="0x{:x}".format(a)
+			else:
+				nm[a]=y[i][1] if k[i] == a else "{}+{}".format(y[i][1],a-k[i])
+
+	# Sum up the inclusive and exclusive instructions and time per routine (a routine that calls
+	# itself is only included once per call stack).
+	inc={}
+	exc={}
+	with open(pr,"w") as f:
+		for p,v in sorted(pp.items()):
+			if v[0]:
+				f.write("{} {}\n".format(";".join(nm[a] for a in p),v[0]))
+			for a,d in [(p[-1],exc)]+[(a,inc) for a in set(p)]:
+				w=d.get(a)
+				if w is None:
+					w=d[a]=[0,0.0]
+				w[0]+=v[0]
+				w[1]+=v[1]
+
+	n=max(pn,1)
+	f="{:>12} {:>12} {:>6} {:>10} {:>10}  {}"
+	t=[f.format("incl. instr","excl. instr","excl.%","incl. ms","excl. ms","routine")]
+	f="{:>12} {:>12} {:>6.1f} {:>10.1f} {:>10.1f}  {}"
+	for a in sorted(exc,key=lambda a:-exc[a][0])[:_PROF_TOP]:
+		i,e=inc[a],exc[a]
+		t.append(f.format(i[0],e[0],100.0*e[0]/n,i[1]*1000,e[1]*1000,nm[a]))
+	sys.stderr.write("\n".join(t)+"\n")
+
+def span(a,s,l):
+	# Count the leading bytes of the memory range a..a+l-1 that are in the zero-terminated set of
+	# bytes at address s.
+	k=cstr(s)
+	if not k:
+		return 0
+	p=sp.get(k)
+	if p is None:
+		import re
+		p=sp[k]=re.compile(b"["+re.escape(k)+b"]*")
+	return p.match(m,a,a+l).end()-a
+
+def crc(a,l):
+	# CRC-32 of the memory range a..a+l-1 (as a signed 32-bit value).
+	v=binascii.crc32(m[a:a+clip(a,l)])&0xffffffff
+	return v-(1<<32) if v > 0x7fffffff else v
+
+def atoi(a,l):
+	# Parse the decimal number in the memory range a..a+l-1 (None if it is not a valid number).
+	s=bytes(m[a:a+max(l,0)])
+	d=s[1:] if s[:1] == b"-" else s
+	if d.isdigit():
+		v=int(s)
+		if -2147483648 <= v <= 2147483647:
+			return v
+
+def grow(l):
+	# Grow the memory to l bytes (if possible), and return the memory size. The memory may be
+	# replaced by a new object, so compiled blocks must return after calling this. A memory map
+	# can not be resized while a memoryview of it exists (BufferError), so it is copied then.
+	global m
+	if th is None and len(m) < l < 1<<31:
+		try:
+			m.resize(l)
+		except (AttributeError,BufferError,EnvironmentError,SystemError):
+			try:
+				t=bytearray(l)
+				t[:len(m)]=m
+				m=t
+			except MemoryError:
+				pass
+	return len(m)
+
+def snap(a):
+	# Save the VM state to the image file (unless it was restored from there), resuming at a. Only
+	# the memory pages that are not all zeros are saved. The image is written to a temporary file
+	# first, so that other VM instances never see a partial image.
+	global img
+	if img:
+		try:
+			z=b"\0"*_PAGE
+			d=[(k,m[k:k+_PAGE]) for k in range(0,len(m),_PAGE)]
+			d=[(k,x+z[len(x):]) for k,x in d if x != z[:len(x)]]
+			t="{}.{}".format(img,os.getpid())
+			with open(t,"wb") as f:
+				f.write(struct.pack("<4sI4i",b"BSVM",pid,a,cc,len(m),len(d)))
+				f.write(struct.pack("<256i",*[((x+(1<<31))&0xffffffff)-(1<<31) for x in r]))
+				for k,x in d:
+					f.write(struct.pack("<i",k)+x)
+			if os.path.exists(img):
+				os.remove(img)
+			os.rename(t,img)
+		except EnvironmentError:
+			pass
+		img=None
+
+def restore():
+	# Restore the VM state from the image file, if there is one that was made from this program.
+	global pc,cc
+	try:
+		with open(img,"rb") as f:
+			h=struct.unpack("<4sI4i",f.read(24))
+			if h[0] != b"BSVM" or h[1] != pid:
+				return False
+			v=struct.unpack("<256i",f.read(1024))
+			d=f.read(h[5]*(_PAGE+4))
+	except (EnvironmentError,TypeError,struct.error):
+		return False
+	if len(d) != h[5]*(_PAGE+4) or grow(h[4]) < h[4]:
+		return False
+	r[:]=array.array('l',v)
+	for i in range(0,len(d),_PAGE+4):
+		k=struct.unpack_from("<i",d,i)[0]
+		x=d[i+4:i+4+min(_PAGE,len(m)-k)]
+		m[k:k+len(x)]=x
+	pc,cc=h[2],h[3]
+	return True
+
+def bits(s,t):
+	# Translate the bytes of s with the table t, and return them as one big (big-endian) integer.
+	return int(binascii.hexlify(s.translate(t)) or b"0",16)
+
+def unpack():
+	# Decode the packed program string (3 characters per 2 bytes) without a per-byte loop. The
+	# characters are translated to their bit fields in each output byte, and the fields of all
+	# bytes are then merged at once with big integer operations.
+	s=bytearray(p.encode())
+	n=len(s)//3
+	if n == 0:
+		return bytearray()
+	t=[bytes(bytearray((f(c-40))&255 for c in range(256))) for f in (
+		lambda c:c<<2,lambda c:c>>3,lambda c:(c&7)<<5,lambda c:c)]
+	d=bytearray(2*n)
+	d[0::2]=binascii.unhexlify("%0*x"%(2*n,bits(s[0::3],t[0])|bits(s[1::3],t[1])))
+	d[1::2]=binascii.unhexlify("%0*x"%(2*n,bits(s[1::3],t[2])|bits(s[2::3],t[3])))
+	return d
+
+def load():
+	# Load the program into memory: the program that was given to BSVM.load (if any), the program
+	# binary of the ahead of time compiled VM, or preferably the binary sidecar file (if there is
+	# one that matches this program).
+	d=pa if pg is None else pg
+	if d is not None:
+		m[1:1+len(d)]=d
+		return
+	try:
+		with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),"bsvm.bin"),"rb") as f:
+			d=f.read()
+		if binascii.crc32(d)&0xffffffff != pb:
+			d=unpack()
+	except EnvironmentError:
+		d=unpack()
+	WriteDebug("prg_size={}".format(len(d)))
+	m[1:1+len(d)]=d
+
+def gen(op0,a,b,x,n):
+	# Generate the Python source lines for an instruction, given its operands and the address of
+	# the next instruction (x is a register number for arg type 0).
 	op=op0&63
+	lines=(sem[op] if op < len(sem) else None) or ["running=False","return {N}"]
+	if op0 < 64:
+		x="r[{}]".format(x)
+	return [line.format(A=a,B=b,X=x,N=n) for line in lines]
 
-	WriteDebug("PC={} CC={} OP={} OP*={} AT={}".format(pc0,cc,op0,op,at))
-
-	# Read the operands.
-	o=[]
-	for i in range(nout[op]):
-		# Get register number (0-255)
-		o+=[m[pc]]
-		pc+=1
-	for i in range(ninr[op]):
-		# Get register value
-		o+=[r[m[pc]]]
-		pc+=1
-	for i in range(ninx[op]):
-		if at == 3:
-			# 32-bit immediate.
-			v=getI(pc)
-			pc+=4
-		else:
-			# Arg types 0-2 use a single byte.
-			v=m[pc]
-			pc+=1
+def define(name,src):
+	# Compile the source code for a function and return the function.
+	g=globals()
+	exec(compile(src,name,"exec"),g)
+	return g.pop("f")
 
-			if at == 0:
-				# Register value.
-				v=r[v]
+def handler(k):
+	# Create the handler for a full opcode byte (k), + 256 if the handler also counts the
+	# instruction for the statistics (see stats), and + 512 if it also updates the profile (see
+	# profile). The handler takes the predecoded operands and the address of the next instruction,
+	# and returns the new PC.
+	op0=k&255
+	src="def f(A,B,X,N):\n\tglobal cc,running,exit_code\n"
+	if k&256:
+		src+="\tglobal so\n\tsc[{0}]+=1\n\tsq[so|{0}]+=1\n\tso={1}\n".format(op0,op0<<8)
+	if k&512:
+		src+="\tglobal pn\n\tpn+=1\n"
+	lines=gen(op0,"A","B","X","N")+["return N"]
+	if k&512 and op0&63 in (7,8):
+		# Update the shadow call stack before JSR or RTS returns the new PC (see call and ret).
+		e=lines[-2][7:]
+		lines[-2:-2]=["call({},N)".format(e) if op0&63 == 7 else "ret({})".format(e)]
+	for line in lines:
+		src+="\t"+line+"\n"
+	h[k]=define("op{}".format(k),src)
+	return h[k]
+
+def decode(a):
+	# Decode the instruction at address a and add it to the instruction cache.
+	global ce
+	op0=m[a]
+	op=op0&63
+	at=op0>>6
+	o=[0,0,0]
+	k=a+1
+	if op < len(nout):
+		for i in range(nout[op]+ninr[op]):
+			# Get register number (0-255)
+			o[i]=m[k]
+			k+=1
+		if ninx[op]:
+			if at == 3:
+				# 32-bit immediate.
+				o[2]=getI(k)
+				k+=4
 			else:
-				# Convert unsigned to signed byte (-128..127).
-				if v > 127:
-					v-=256
-
-				if at == 2:
-					# 8-bit PC-relative offset.
-					v+=pc0
-				# else v=v (at=1, 8-bit signed immedate)
-		o+=[v]
-
-	# Execute the instruction.
-	if op == 1: # MOV
-		WriteDebug("MOV R{}, {}".format(o[0],o[1]))
-		r[o[0]]=o[1]
-
-	elif op == 2: # LDB
-		WriteDebug("LDB R{}, {}, {}".format(o[0],o[1],o[2]))
-		r[o[0]]=m[o[1]+o[2]]
-
-	elif op == 3: # LDW
-		WriteDebug("LDW R{}, {}, {}".format(o[0],o[1],o[2]))
-		r[o[0]]=getI(o[1]+o[2])
-
-
-	elif op == 4: # STB
-		WriteDebug("STB {}, {}, {}".format(o[0],o[1],o[2]))
-		m[o[1]+o[2]]=o[0]&255
-
-	elif op == 5: # STW
-		WriteDebug("STW {}, {}, {}".format(o[0],o[1],o[2]))
-		setI(o[1]+o[2],o[0])
-
-	elif op == 6: # JMP
-		WriteDebug("JMP {}".format(o[0]))
-		pc=o[0]
-
-	elif op == 7: # JSR
-		WriteDebug("JSR {}".format(o[0]))
-		r[255]-=4  # Pre-decrement SP
-		setI(r[255],pc)
-		pc=o[0]
-
-	elif op == 8: # RTS
-		WriteDebug("RTS")
-		pc=getI(r[255])
-		r[255]+=4  # Post-increment SP
-
-	elif op == 9: # BEQ
-		WriteDebug("BEQ {}".format(o[0]))
-		if cc & _EQ != 0:
-			pc=o[0]
-
-	elif op == 10: # BNE
-		WriteDebug("BNE {}".format(o[0]))
-		if cc & _EQ == 0:
-			pc=o[0]
-
-	elif op == 11: # BLT
-		WriteDebug("BLT {}".format(o[0]))
-		if cc & _LT != 0:
-			pc=o[0]
-
-	elif op == 12: # BLE
-		WriteDebug("BLE {}".format(o[0]))
-		if cc & (_LT|_EQ) != 0:
-			pc=o[0]
-
-	elif op == 13: # BGT
-		WriteDebug("BGT {}".format(o[0]))
-		if cc & _GT != 0:
-			pc=o[0]
-
-	elif op == 14: # BGE
-		WriteDebug("BGE {}".format(o[0]))
-		if cc & (_GT|_EQ) != 0:
-			pc=o[0]
-
-	elif op == 15: # CMP
-		WriteDebug("CMP {}, {}".format(o[0],o[1]))
-		cc=0
-		if o[0] == o[1]:
-			cc|=_EQ
-		if o[0] < o[1]:
-			cc|=_LT
-		if o[0] > o[1]:
-			cc|=_GT
-
-	elif op == 16: # PUSH
-		WriteDebug("PUSH {}".format(o[0]))
-		r[255]-=4  # Pre-decrement SP
-		setI(r[255],o[0])
-
-	elif op == 17: # POP
-		WriteDebug("POP R{}".format(o[0]))
-		r[o[0]]=getI(r[255])
-		r[255]+=4  # Post-increment SP
-
-	elif op == 18: # ADD
-		WriteDebug("ADD R{}, {}".format(o[0],o[1]))
-		r[o[0]]+=o[1]
-
-	elif op == 19: # SUB
-		WriteDebug("SUB R{}, {}".format(o[0],o[1]))
-		r[o[0]]-=o[1]
-
-	elif op == 20: # MUL
-		WriteDebug("MUL R{}, {}".format(o[0],o[1]))
-		r[o[0]]*=o[1]
-
-	elif op == 21: # DIV
-		WriteDebug("DIV R{}, {}".format(o[0],o[1]))
-		r[o[0]]//=o[1]
-
-	elif op == 22: # MOD
-		WriteDebug("MOD R{}, {}".format(o[0],o[1]))
-		r[o[0]]%=o[1]
-
-	elif op == 23: # AND
-		WriteDebug("AND R{}, {}".format(o[0],o[1]))
-		r[o[0]]&=o[1]
-
-	elif op == 24: # OR
-		WriteDebug("OR R{}, {}".format(o[0],o[1]))
-		r[o[0]]|=o[1]
-
-	elif op == 25: # XOR
-		WriteDebug("XOR R{}, {}".format(o[0],o[1]))
-		r[o[0]]^=o[1]
-
-	elif op == 26: # SHL
-		WriteDebug("SHL R{}, {}".format(o[0],o[1]))
-		r[o[0]]<<=o[1]
-
-	elif op == 27: # SHR
-		WriteDebug("SHR R{}, {}".format(o[0],o[1]))
-		r[o[0]]>>=o[1]
-
-	elif op == 28: # EXIT
-		WriteDebug("EXIT {}".format(o[0]))
-		exit_code=o[0]
-		running=False
-
-	elif op == 29: # PRINTLN
-		s=getS(o[0],o[1])
-		WriteDebug("PRINTLN {}, {} ({})".format(o[0],o[1],s))
-		print(s)
-		sys.stdout.flush()
-
-	elif op == 30: # PRINT
-		s=getS(o[0],o[1])
-		WriteDebug("PRINT {}, {} ({})".format(o[0],o[1],s))
-		print(s,end="")
-		sys.stdout.flush()
-
-	elif op == 31: # RUN
-		s=getS(o[0],o[1])
-		WriteDebug("RUN {}, {} ({})".format(o[0],o[1],s))
-		os.system(s)
+				# Arg types 0-2 use a single byte.
+				v=m[k]
+				k+=1
+				if at != 0:
+					# Convert unsigned to signed byte (-128..127).
+					if v > 127:
+						v-=256
+
+					if at == 2:
+						# 8-bit PC-relative offset.
+						v+=a
+				# else v=register number (at=0)
+				o[2]=v
+	x=op0|(256 if st else 0)|(512 if pr else 0)
+	d=(h.get(x) or handler(x),o[0],o[1],o[2],k)
+	ic[a]=d
+	for i in range(a,k):
+		cb.setdefault(i,set()).add(a)
+	if k > ce:
+		ce=k
+	return d
+
+def block(a):
+	# Compile the straight-line block of instructions that starts at address a (up to and
+	# including the first control flow instruction) into a function that takes r and m, and
+	# returns the new PC.
+	src="def f(r,m):\n\tglobal cc,running,exit_code\n"
+	src+="\tglobal ni\n"  # (counters only)
+	k=a
+	for i in range(_BLOCK_MAX):
+		d=ic.get(k) or decode(k)
+		src+="\tni+=1\n"  # (counters only)
+		lines=gen(m[k],d[1],d[2],d[3],d[4])
+		for line in lines:
+			src+="\t"+line+"\n"
+		k=d[4]
+		if lines[-1].startswith("return"):
+			break
+	else:
+		src+="\treturn {}\n".format(k)
+	WriteDebug("Compiled block {}-{}:\n{}".format(a,k,src))
+	jb[a]=define("block{}".format(a),src)
+	for i in range(a,k):
+		bb.setdefault(i,set()).add(a)
+	return jb[a]
+
+def inval(a,l):
+	# Drop cached instructions and compiled blocks that overlap the memory range a..a+l-1 (e.g.
+	# self-modifying code). Blocks may overlap (e.g. when a branch lands inside another block), so
+	# every block that covers a written byte is dropped. Returns True if anything was dropped.
+	x=False
+	for i in range(a,a+l):
+		if i in cb:
+			for j in cb.pop(i):
+				ic.pop(j,None)
+			x=True
+		if i in bb:
+			for j in bb.pop(i):
+				jb.pop(j,None)
+			x=True
+	return x
+
+def config():
+	# Read the settings that are given by environment variables.
+	global lb,nj,rc,st,pr
+
+	# Line buffered output (see ob).
+	lb=sys.stdout.isatty() or os.environ.get("BSVM_LINEBUF","0") != "0"
+
+	# Max number of running background jobs (see jobs).
+	nj=int(os.environ.get("BSVM_JOBS",0)) or (os.cpu_count() if hasattr(os,"cpu_count") else 1) or 1
+
+	# Result cache for RUN and RUNO (enabled with BSVM_CACHE=1, otherwise None), as a list of: the
+	# cache directory, the input files (BSVM_CACHE_FILES, separated by os.pathsep) and the
+	# environment variables (BSVM_CACHE_ENV, separated by commas) that are part of the cache key,
+	# and the maximum cache size in bytes (BSVM_CACHE_SIZE, 64 MiB by default).
+	rc=None
+	if os.environ.get("BSVM_CACHE","0") != "0":
+		if sys.platform == "darwin":
+			v=os.path.expanduser("~/Library/Caches")
+		else:
+			v=os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+		rc=[os.path.join(v,"bs","run"),
+			[x for x in os.environ.get("BSVM_CACHE_FILES","").split(os.pathsep) if x],
+			[x for x in os.environ.get("BSVM_CACHE_ENV","").split(",") if x],
+			int(os.environ.get("BSVM_CACHE_SIZE",1<<26))]
+
+	# Instruction statistics (enabled with BSVM_STATS=<file>, otherwise None), see stats.
+	st=os.environ.get("BSVM_STATS") or None
+
+	# Profile (enabled with BSVM_PROFILE=<file>, otherwise None), see profile.
+	pr=os.environ.get("BSVM_PROFILE") or None
+
+def reset():
+	# Reset the VM: create the memory, clear the execution state and the caches, and load the
+	# program (or restore the VM state from the snapshot image).
+	global m,pc,cc,r,ic,cb,ce,jit,hot,jb,bb,hc,img,pid,exit_code,running,aw,th,fn,ni,sc,sq,so,t0
+	global pn,cs,ps,pp,pl,tl
+
+	# Create RAM (the initial size is given by BSVM_MEM, in bytes). Where possible (Python 3 on
+	# Unix) the memory is a private anonymous memory map, so only the pages that are actually
+	# touched are backed by the OS.
+	v=int(os.environ.get("BSVM_MEM",1<<20))
+	if sys.version_info[0]>=3 and hasattr(mmap,"MAP_PRIVATE"):
+		m=mmap.mmap(-1,v,mmap.MAP_PRIVATE)
+	else:
+		m=bytearray(v)
+	th=None
+
+	# Clear execution state.
+	pc=1
+	cc=0
+	r=array.array('l',[0])*256
+	exit_code=1
+	running=True
+	aw=None
+	ni=0  # Number of executed instructions (see perf)
+	del ob[:]
+	if aq is not None:
+		aq.clear()
+	for x in list(fh):
+		fclose(x)
+	fn=2
+
+	# Clear the instruction statistics.
+	sc=[0]*256
+	sq=[0]*65536
+	so=0
+	t0=clock()
+
+	# Clear the profile.
+	pn=0
+	cs=[]
+	ps=(1,)
+	pp={}
+	pl=0
+	tl=t0
+
+	# Clear the instruction cache and the compiled blocks (the instruction handlers do not depend on
+	# the program, so they are kept). Compiled blocks are not used in asynchronous mode, since an
+	# instruction that raises Wait must be the first one to be executed again, nor when collecting
+	# instruction statistics or a profile, since that is done by the handlers.
+	ic={}
+	cb={}
+	ce=0
+	hot=aq is None and st is None and pr is None and os.environ.get("BSVM_JIT","0") != "0"
+	jit=hot
+	jb={}
+	bb={}
+	hc={}
+
+	# Use the blocks that were compiled ahead of time (unless another program has been loaded).
+	# They are dispatched to like the compiled blocks of the tiered mode, but other blocks are
+	# only compiled at run time if BSVM_JIT is set.
+	if pg is None and aq is None and st is None and pr is None:
+		for a,e,f in aot:
+			jb[a]=f
+			for i in range(a,e):
+				bb.setdefault(i,set()).add(a)
+			ce=max(ce,e)
+			jit=True
+
+	# Snapshot image (enabled with BSVM_IMAGE=<file>). The SNAP instruction saves the VM state to
+	# the image, and later runs of the same program (identified by pid) resume from there.
+	img=os.environ.get("BSVM_IMAGE")
+	pid=binascii.crc32(p.encode() if pg is None else pg)&0xffffffff
+	if img and restore():
+		WriteDebug("Restored {}".format(img))
+		img=None
+	else:
+		load()
+
+def step():
+	# Execute a single instruction. Returns True if the program is still running.
+	global pc,aw
+	global ni  # (counters only)
+	aw=None
+	if running:
+		d=ic.get(pc) or decode(pc)
+		WriteDebug("PC={} CC={} OP={} A={} B={} X={}".format(pc,cc,m[pc],d[1],d[2],d[3]))
+		ni+=1  # (counters only)
+		try:
+			pc=d[0](d[1],d[2],d[3],d[4])
+		except Wait as e:
+			aw=e.args[0]
+	if not running:
+		flush()
+	return running
+
+def loop(n):
+	# Run the program until it exits, or for at most n steps if n >= 0 (a step is an instruction,
+	# or a compiled block in tiered mode). Returns True if the program is still running (it may then
+	# be waiting for the host, see aw).
+	global pc,aw
+	global ni  # (counters only)
+	aw=None
+	try:
+		while running and n:
+			if jit:
+				# Run the compiled block that starts at the current PC, once it has been entered
+				# enough times to be considered hot (or if it was compiled ahead of time).
+				f=jb.get(pc)
+				if f is None and hot:
+					hc[pc]=hc.get(pc,0)+1
+					if hc[pc] >= _HOT:
+						f=block(pc)
+				if f:
+					pc=f(r,m)
+					n-=1
+					continue
+
+			while running and n:
+				# Look up the predecoded instruction (decode it on a cache miss).
+				d=ic.get(pc) or decode(pc)
+				WriteDebug("PC={} CC={} OP={} A={} B={} X={}".format(pc,cc,m[pc],d[1],d[2],d[3]))
+
+				# Execute the instruction.
+				ni+=1  # (counters only)
+				pc=d[0](d[1],d[2],d[3],d[4])
+				n-=1
+
+				# In tiered mode, a jump leaves the block.
+				if jit and pc != d[4]:
+					break
+	except Wait as e:
+		aw=e.args[0]
+	if not running:
+		flush()
+	return running
+
+def serve(a):
+	# Fork server mode (Python 3 on POSIX only). The VM is initialized once, and then a copy of this
+	# process is forked for each client that connects to the Unix socket a. The client (bsvmc.py)
+	# sends its stdin, stdout and stderr file descriptors, followed by its working directory, its
+	# arguments and its environment. The server replies with the process ID of the child (so that
+	# the client can forward signals), and finally with the exit code of the program. This function
+	# only returns in the child, once it has taken over the state of the client process.
+	import signal,socket
+	reset()
+	v=[os.environ.get(x) for x in ("BSVM_MEM","BSVM_JIT","BSVM_IMAGE")]
+	s=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+	if os.path.exists(a):
+		os.remove(a)
+	u=os.umask(0o077)
+	s.bind(a)
+	os.umask(u)
+	s.listen(64)
+	signal.signal(signal.SIGCHLD,signal.SIG_IGN)
+	while True:
+		c=s.accept()[0]
+		if os.fork() == 0:
+			break
+		c.close()
+	s.close()
+	signal.signal(signal.SIGCHLD,signal.SIG_DFL)
+	c.sendall(struct.pack("<i",os.getpid()))
+
+	# Receive the file descriptors (along with the size of the request), and the request.
+	d,x=c.recvmsg(4,socket.CMSG_LEN(12))[:2]
+	f=array.array("i")
+	for l,t,y in x:
+		if l == socket.SOL_SOCKET and t == socket.SCM_RIGHTS:
+			f.frombytes(y[:len(y)-len(y)%f.itemsize])
+	n=struct.unpack("<I",d)[0]
+	d=b""
+	while len(d) < n:
+		y=c.recv(n-len(d))
+		if not y:
+			os._exit(1)
+		d+=y
+
+	# Take over the state of the client process.
+	for i,x in enumerate(f):
+		os.dup2(x,i)
+		os.close(x)
+	d=d.split(b"\0")
+	k=int(d[1])+2
+	os.chdir(d[0])
+	sys.argv=sys.argv[:1]+[os.fsdecode(x) for x in d[2:k]]
+	os.environ.clear()
+	for x in d[k:]:
+		x=x.split(b"=",1)
+		if len(x) == 2:
+			os.environb[x[0]]=x[1]
+	atexit.register(lambda:c.sendall(struct.pack("<i",exit_code)))
+	config()
+	if v != [os.environ.get(x) for x in ("BSVM_MEM","BSVM_JIT","BSVM_IMAGE")]:
+		reset()
 
+def main():
+	# Run the program, and exit with its exit code. With BSVM_SERVE=<socket>, the VM runs as a fork
+	# server instead (see serve).
+	if os.environ.get("BSVM_SERVE"):
+		serve(os.environ["BSVM_SERVE"])
 	else:
-		WriteDebug("Unsupported op0={} @ pc={}".format(op0,pc))
-		running=False
+		reset()
+	atexit.register(flush)
+	if st:
+		atexit.register(stats)
+	if pr:
+		atexit.register(profile)
+	loop(-1)
+	sys.exit(exit_code)
+
+class BSVM(object):
+	# Embeddable VM, for running BS VM programs from Python code. Each instance executes the VM code
+	# in a namespace of its own, so instances are independent of each other, and any number of them
+	# can be used in the same process (e.g. one per thread). The program output (PRINT, PRINTLN and
+	# RUN) is passed to the output callback, a function that takes bytes, or written to stdout if no
+	# callback is given. The program input (FREAD from handle 0) is read with the input callback, a
+	# function that takes the max number of bytes to read and returns bytes (b"" at the end of the
+	# input), or from stdin if no callback is given.
+	#
+	# The module code is compiled once (or taken from the bytecode cache of the import system or of
+	# bsvm_run.py), and each instance only executes it.
+	#
+	# In asynchronous mode, the VM never blocks. Instead, run and step return early when an
+	# instruction has to wait for something (see Wait), and the host (e.g. bsvm_async.py) takes care
+	# of it before resuming the VM. Blocks are not compiled in asynchronous mode.
+	#
+	#   vm=BSVM(output=f,input=g,asynchronous=False)
+	#                      - Create a VM that runs the built in program.
+	#   vm.load(code)      - Load another program (as bytes), and reset the VM.
+	#   vm.reset()         - Reset the VM, so that the program starts from the beginning.
+	#   vm.step()          - Execute one instruction, and return True if the program is running.
+	#   vm.run(n=-1)       - Run the program until it exits, and return its exit code. If n >= 0,
+	#                        run at most n steps, and return None if the program is still running.
+	#   vm.waiting()       - What the VM waits for, if run or step returned early: ("run",c),
+	#                        ("read",n) or ("poll",), or None.
+	#   vm.complete(v,t)   - Give the exit status v and the output t (bytes) of the command that
+	#                        the VM waits for, or the input t (at most n bytes, b"" at the end of
+	#                        the input) that it waits for (v is ignored). In asynchronous mode,
+	#                        the host reads the input (with vm.input, or from stdin if it is None).
+	code=None
+
+	def __init__(self,output=None,input=None,asynchronous=False):
+		if BSVM.code is None:
+			try:
+				BSVM.code=__loader__.get_code(__name__)
+			except (NameError,AttributeError,ImportError):
+				pass
+		if BSVM.code is None:
+			with open(__file__,"rb") as f:
+				BSVM.code=compile(f.read(),__file__,"exec")
+		self.ns={"__name__":"bsvm_instance","__file__":__file__}
+		exec(BSVM.code,self.ns)
+		self.ns["oc"]=output
+		self.ns["ci"]=input
+		self.input=input
+		if asynchronous:
+			self.ns["aq"]={}
+		self.reset()
+
+	def load(self,code):
+		self.ns["pg"]=bytes(code)
+		self.reset()
+
+	def reset(self):
+		self.ns["reset"]()
+
+	def step(self):
+		return self.ns["step"]()
+
+	def run(self,n=-1):
+		return None if self.ns["loop"](n) else self.ns["exit_code"]
+
+	def waiting(self):
+		return self.ns["aw"]
+
+	def complete(self,v,t):
+		w=self.ns["aw"]
+		self.ns["aq"][w[1] if w[0] == "run" else w[0]]=(v,t)
+
+# Output buffer. The output is flushed on exit, before RUN, when the buffer is full, and after
+# every print if stdout is a TTY or if line buffering is forced with BSVM_LINEBUF=1. The output
+# goes to the output callback oc (set by BSVM), or to stdout if oc is None.
+out=getattr(sys.stdout,"buffer",sys.stdout)
+ob=bytearray()
+oc=None
+
+# Program input, when it is read with the input callback ci (set by BSVM) or by the host (in
+# asynchronous mode) instead of from stdin.
+#
+#  * ib - Input that has been read but not yet consumed by the program.
+#  * ie - True when the end of the input has been reached.
+ci=None
+ib=bytearray()
+ie=False
+
+# Program that was given to BSVM.load, as bytes (None for the built in program).
+pg=None
+
+# Asynchronous mode (see BSVM).
+#
+#  * aq - Results of the commands that the host has run, keyed by command, and the input that the
+#         host has read, keyed by "read" (None if the VM is not in asynchronous mode).
+#  * aw - What the VM is waiting for (the argument of Wait), or None.
+aq=None
+aw=None
+
+# Shell co-process for RUN (POSIX and Python 3 only, otherwise None), as a list of: the command
+# pipe, the exit status pipe, the name of the output capture file and the exit status file
+# descriptor (of the shell). The co-process is started on demand.
+co=[] if os.name == "posix" and sys.version_info[0]>=3 else None
+
+# Background jobs (SPAWN), keyed by job handle. At most nj jobs (BSVM_JOBS, or the number of CPU
+# cores by default) run at the same time. Jobs are kept until their exit status has been read.
+jobs={}
+jn=0
+
+# Read the settings that are given by environment variables (lb, nj, rc, st and pr).
+config()
+
+# Threads (TSPAWN).
+#
+#  * th - Handles of the threads that have not been joined (None until the first thread is started).
+#  * lk - Lock for the atomic memory operations, shared by all threads (None until the first thread
+#         is started, since it is not needed before that).
+th=None
+lk=None
+
+# Open files (FOPEN), keyed by file handle. Handles 0-2 are reserved for the standard streams, so
+# fn (the last used handle) starts at 2. The files are closed by reset (except for the stdin reader,
+# see stdin).
+fh={}
+fn=2
+
+# Compiled byte set patterns for MEMSPN, keyed by the byte set.
+sp={}
+
+# Predecoded instruction cache (cleared by reset, except for the handlers).
+#
+#  * h  - Instruction handlers, keyed by the full opcode byte (+ 256 and + 512 for the handlers that
+#         also collect statistics or a profile, see handler), created on demand.
+#  * ic - Decoded instructions, keyed by PC: (handler, A, B, X, next PC).
+#  * cb - Addresses of the cached instructions that cover a certain memory address (a set).
+#  * ce - End of the cached code (no cached instruction covers any address at or above ce).
+h={}
+
+# Instruction statistics (enabled with BSVM_STATS=<file>, cleared by reset). The instructions are
+# counted by the handlers, see handler.
+#
+#  * sc - Number of executed instructions, indexed by full opcode byte.
+#  * sq - Number of executed instruction pairs, indexed by (previous opcode byte << 8) | opcode
+#         byte.
+#  * so - Opcode byte of the previous instruction << 8 (0 before the first instruction).
+#  * t0 - Monotonic clock when the program was started.
+
+# Profile (enabled with BSVM_PROFILE=<file>, cleared by reset). The instructions are counted by the
+# handlers, and the handlers for JSR and RTS maintain a shadow call stack (see call and ret).
+#
+#  * pn - Number of executed instructions.
+#  * cs - Return addresses of the routines in the shadow call stack.
+#  * ps - Shadow call stack, as a tuple of routine addresses (starting with the program start).
+#  * pp - Number of executed instructions and time (in seconds), keyed by call stack.
+#  * pl - Value of pn at the last tick (see tick).
+#  * tl - Monotonic clock at the last tick.
+
+# Compiled blocks (tiered mode, enabled with BSVM_JIT=1, cleared by reset).
+#
+#  * jit - True if compiled blocks are used (in tiered mode, or for blocks compiled ahead of time).
+#  * hot - True if hot blocks are compiled at run time (tiered mode).
+#  * jb - Compiled block functions, keyed by the start address of the block.
+#  * bb - Start addresses of the compiled blocks that cover a certain memory address (a set, since
+#         blocks may overlap).
+#  * hc - Number of entries for each (not yet compiled) block start address.
+
+# Blocks that were compiled ahead of time, as (start address, end address, function) tuples.
+aot=[]  # DON'T MODIFY THIS LINE! IT IS REPLACED BY THE BUILD PROCESS!
+
+# Program binary, if the program was compiled ahead of time (it is then loaded as is, instead of
+# unpacking p), otherwise None.
+pa=None  # DON'T MODIFY THIS LINE! IT IS REPLACED BY THE BUILD PROCESS!
 
-sys.exit(exit_code)
+# Run the program when used as a script (rather than imported as a module, for using BSVM, or by
+# the bsvm_run.py launcher).
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,76 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: t; -*-
+# -------------------------------------------------------------------------------------------------
+# Copyright (c) 2020 Marcus Geelnard
+#
+# This software is provided 'as-is', without any express or implied warranty. In no event will the
+# authors be held liable for any damages arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose, including commercial
+# applications, and to alter it and redistribute it freely, subject to the following restrictions:
+#
+#  1. The origin of this software must not be misrepresented; you must not claim that you wrote
+#     the original software. If you use this software in a product, an acknowledgment in the
+#     product documentation would be appreciated but is not required.
+#
+#  2. Altered source versions must be plainly marked as such, and must not be misrepresented as
+#     being the original software.
+#
+#  3. This notice may not be removed or altered from any source distribution.
+# -------------------------------------------------------------------------------------------------
+
+
+# Cooperative scheduler for running many instances of the Python VM concurrently in one process,
+# with asyncio (Python 3 only). Each VM runs in asynchronous mode (see BSVM in bsvm.py) for a time
+# slice of a given number of instructions at a time, and then yields to the event loop. Commands
+# (RUN and RUNO) are run with asyncio.create_subprocess_shell, input (FREAD from handle 0) is read
+# in a worker thread (with the input callback of the VM, or from stdin), and waiting for background
+# jobs is done with asyncio.sleep, so a VM that waits never blocks the other VMs.
+#
+#   await run(vm,n=_SLICE)        - Run a VM until its program exits, and return the exit code.
+#   await run_all(vms,n=_SLICE)   - Run several VMs concurrently, and return their exit codes.
+#   new(output=None,input=None)   - Create a VM in asynchronous mode.
+#
+# Example:
+#
+#   vms=[bsvm_async.new() for i in range(100)]
+#   codes=asyncio.run(bsvm_async.run_all(vms))
+import asyncio,os,sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from bsvm import BSVM
+
+# Constants.
+_SLICE=10000  # Number of instructions per time slice
+_POLL=0.005  # Time between checks for finished background jobs (seconds)
+
+def new(output=None,input=None):
+	# Create a VM in asynchronous mode.
+	return BSVM(output=output,input=input,asynchronous=True)
+
+def read(n):
+	# Read at most n bytes from stdin (this blocks, so it is done in a worker thread).
+	return os.read(sys.stdin.fileno(),n)
+
+async def run(vm,n=_SLICE):
+	# Run the VM until its program exits, and return the exit code.
+	while True:
+		v=vm.run(n)
+		if v is not None:
+			return v
+		w=vm.waiting()
+		if w is None:
+			# The time slice is used up.
+			await asyncio.sleep(0)
+		elif w[0] == "run":
+			p=await asyncio.create_subprocess_shell(w[1],stdout=asyncio.subprocess.PIPE)
+			t=(await p.communicate())[0]
+			vm.complete(p.returncode,t)
+		elif w[0] == "read":
+			t=await asyncio.get_running_loop().run_in_executor(None,vm.input or read,w[1])
+			vm.complete(0,t)
+		else:
+			await asyncio.sleep(_POLL)
+
+async def run_all(vms,n=_SLICE):
+	# Run several VMs concurrently, and return their exit codes (in the same order as the VMs).
+	return await asyncio.gather(*[run(x,n) for x in vms])
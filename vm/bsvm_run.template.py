@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- mode: python; tab-width: 4; indent-tabs-mode: t; -*-
+# -------------------------------------------------------------------------------------------------
+# Copyright (c) 2020 Marcus Geelnard
+#
+# This software is provided 'as-is', without any express or implied warranty. In no event will the
+# authors be held liable for any damages arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose, including commercial
+# applications, and to alter it and redistribute it freely, subject to the following restrictions:
+#
+#  1. The origin of this software must not be misrepresented; you must not claim that you wrote
+#     the original software. If you use this software in a product, an acknowledgment in the
+#     product documentation would be appreciated but is not required.
+#
+#  2. Altered source versions must be plainly marked as such, and must not be misrepresented as
+#     being the original software.
+#
+#  3. This notice may not be removed or altered from any source distribution.
+# -------------------------------------------------------------------------------------------------
+
+
+# Launcher for the Python VM (bsvm_aot.py). The VM is run as a module from a cached code object, so
+# that its source code is only compiled the first time it is run (or after it has changed), just
+# like an imported module with a __pycache__ entry. The code cache is stored next to the VM, or in
+# the per-user cache directory if that is not writable. Unlike the __pycache__ of the import system
+# this works with any Python version, and regardless of PYTHONDONTWRITEBYTECODE.
+#
+# Only a few (quickly loaded) modules are used, and the launcher is meant to be run with "python -S
+# -E", since the whole point is to keep the startup time as short as possible.
+import binascii,marshal,os,sys
+
+def caches(n):
+	# Return the names of the code cache files for the Python source file n, in order of preference.
+	d,b=os.path.split(n)
+	if sys.platform == "darwin":
+		u=os.path.expanduser("~/Library/Caches")
+	elif os.name == "nt":
+		u=os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+	else:
+		u=os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+	h=binascii.crc32(n.encode("utf8"))&0xffffffff
+	return [os.path.join(d,"__pycache__",b+".code"),
+		os.path.join(u,"bs","pycache","{}.{:08x}.code".format(b,h))]
+
+def load(n):
+	# Return the code object for the Python source file n, from the code cache if possible. Each
+	# cache file starts with a line that identifies the Python version and the source file version.
+	t=os.stat(n)
+	k="{} {!r} {}\n".format(sys.version.replace("\n"," "),t.st_mtime,t.st_size).encode("utf8")
+	for c in caches(n):
+		try:
+			with open(c,"rb") as f:
+				if f.readline() == k:
+					return marshal.loads(f.read())
+		except (EnvironmentError,EOFError,TypeError,ValueError):
+			pass
+
+	# Cache miss: compile the source code, and store the code object in the first cache location
+	# that is writable (errors are ignored, i.e. the code is simply not cached).
+	with open(n,"rb") as f:
+		x=compile(f.read(),n,"exec")
+	for c in caches(n):
+		t="{}.{}".format(c,os.getpid())
+		try:
+			if not os.path.isdir(os.path.dirname(c)):
+				os.makedirs(os.path.dirname(c))
+			with open(t,"wb") as f:
+				f.write(k+marshal.dumps(x))
+			getattr(os,"replace",os.rename)(t,c)
+			break
+		except EnvironmentError:
+			try:
+				os.remove(t)
+			except EnvironmentError:
+				pass
+	return x
+
+# Run the VM as the module bsvm_aot (BSVM instances reuse its code object).
+n=os.path.join(os.path.dirname(os.path.abspath(__file__)),"bsvm_aot.py")
+m=type(sys)("bsvm_aot")
+m.__file__=n
+sys.modules["bsvm_aot"]=m
+x=load(n)
+exec(x,m.__dict__)
+m.BSVM.code=x
+m.main()
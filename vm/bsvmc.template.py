@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- mode: python; tab-width: 4; indent-tabs-mode: t; -*-
+# -------------------------------------------------------------------------------------------------
+# Copyright (c) 2020 Marcus Geelnard
+#
+# This software is provided 'as-is', without any express or implied warranty. In no event will the
+# authors be held liable for any damages arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose, including commercial
+# applications, and to alter it and redistribute it freely, subject to the following restrictions:
+#
+#  1. The origin of this software must not be misrepresented; you must not claim that you wrote
+#     the original software. If you use this software in a product, an acknowledgment in the
+#     product documentation would be appreciated but is not required.
+#
+#  2. Altered source versions must be plainly marked as such, and must not be misrepresented as
+#     being the original software.
+#
+#  3. This notice may not be removed or altered from any source distribution.
+# -------------------------------------------------------------------------------------------------
+
+
+# Client for the fork server mode of the Python VM (see serve in bsvm.py). The program is run by the
+# server that listens to the Unix socket given by BSVM_SOCKET, with the stdin, stdout and stderr,
+# the working directory, the arguments and the environment of this process. If the server can not
+# be reached, the program is run by the Python VM instead.
+#
+# Only a few (quickly loaded) modules are used, and the client is meant to be run with "python -S
+# -E", since the whole point is to keep the startup time as short as possible.
+import array,os,socket,struct,sys
+
+def recv(s,n):
+	# Receive n bytes from the socket s (or fewer, if the connection is closed).
+	d=b""
+	while len(d) < n:
+		x=s.recv(n-len(d))
+		if not x:
+			break
+		d+=x
+	return d
+
+try:
+	s=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+	s.connect(os.environ["BSVM_SOCKET"])
+	d=[os.getcwdb(),str(len(sys.argv)-1).encode()]+[os.fsencode(x) for x in sys.argv[1:]]
+	d=b"\0".join(d+[k+b"="+v for k,v in os.environb.items()])
+	s.sendmsg([struct.pack("<I",len(d))],
+		[(socket.SOL_SOCKET,socket.SCM_RIGHTS,array.array("i",[0,1,2]))])
+	s.sendall(d)
+	p=struct.unpack("<i",recv(s,4))[0]
+except (AttributeError,KeyError,EnvironmentError,struct.error):
+	x=os.path.join(os.path.dirname(os.path.abspath(__file__)),"bsvm_run.py")
+	os.execv(sys.executable,[sys.executable,"-S","-E",x]+sys.argv[1:])
+
+# Wait for the exit code, and forward interrupts (e.g. Ctrl+C) to the server process that runs the
+# program.
+while True:
+	try:
+		d=recv(s,4)
+		break
+	except KeyboardInterrupt:
+		os.kill(p,2)
+sys.exit(struct.unpack("<i",d)[0] if len(d) == 4 else 1)